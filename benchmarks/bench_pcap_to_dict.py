@@ -0,0 +1,103 @@
+"""Time the per packet dict conversion of chepy_pcaps.
+
+Writes a synthetic Ether/IP/TCP|UDP|ICMP capture of 1M packets, unless
+``--packets`` says otherwise, and times
+
+- dict conversion only: ``_Pkt2Dict(packet).to_dict()`` over the packets
+  of the capture, read one at a time and timed without their dissection
+- pcap_to_dict end to end, dissection included
+
+for every chepy_pcaps module that is passed, so an older version can be
+compared with the current one:
+
+    git show <commit>:chepy_pcaps.py > /tmp/chepy_pcaps_old.py
+    python benchmarks/bench_pcap_to_dict.py /tmp/chepy_pcaps_old.py chepy_pcaps.py
+
+The numbers quoted in the commits came from the default run on one core.
+"""
+
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+from scapy.all import ICMP, IP, TCP, UDP, Ether, PcapReader, PcapWriter, Raw
+
+
+def write_capture(path: str, count: int):
+    templates = []
+    for i in range(1000):
+        if i % 5 == 0:
+            l4 = ICMP(id=i, seq=i)
+        elif i % 3:
+            l4 = TCP(sport=40000 + i % 100, dport=443, flags="PA", seq=i * 1000)
+        else:
+            l4 = UDP(sport=5000 + i % 7, dport=53)
+        packet = (
+            Ether(src="00:11:22:33:44:55", dst="66:77:88:99:aa:bb")
+            / IP(src="10.0.%d.1" % (i % 50), dst="10.1.0.%d" % (i % 200))
+            / l4
+            / Raw(b"x" * (i % 64 + 1))
+        )
+        templates.append(Ether(bytes(packet)))
+    with PcapWriter(path, linktype=1) as writer:
+        for i in range(count):
+            packet = templates[i % len(templates)]
+            packet.time = 1700000000 + i / 1000
+            writer.write(packet)
+
+
+def load(path: str, name: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=[os.path.join(os.path.dirname(__file__), "..", "chepy_pcaps.py")],
+        help="chepy_pcaps.py files to time",
+    )
+    parser.add_argument("--packets", type=int, default=1000000)
+    parser.add_argument(
+        "--no-end-to-end",
+        action="store_true",
+        help="skip the pcap_to_dict run",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        capture = os.path.join(tmp, "capture.pcap")
+        write_capture(capture, args.packets)
+
+        for n, path in enumerate(args.modules):
+            module = load(path, "chepy_pcaps_bench_%d" % n)
+            # the packets are read one at a time, as a million dissected
+            # packets do not fit in memory, and only the conversion is timed
+            elapsed, count = 0.0, 0
+            with PcapReader(capture) as reader:
+                for packet in reader:
+                    start = time.perf_counter()
+                    module._Pkt2Dict(packet).to_dict()
+                    elapsed += time.perf_counter() - start
+                    count += 1
+            print(
+                "{}: dict conversion, {} packets: {:.1f}s".format(path, count, elapsed)
+            )
+            if not args.no_end_to_end:
+                start = time.perf_counter()
+                count = len(module.Pcap(capture).read_pcap().pcap_to_dict().o)
+                print(
+                    "{}: pcap_to_dict, {} packets: {:.1f}s".format(
+                        path, count, time.perf_counter() - start
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
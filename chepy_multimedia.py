@@ -1,12 +1,363 @@
 import io
+import os
+import struct
+import sys
+import zlib
+import warnings
+import concurrent.futures
 from typing import List, Tuple, TypeVar
 
+import decorator
+import numpy as np
 from PIL import Image, ImageDraw, ImageEnhance, ImageFilter, ImageOps
 
 import chepy.core
 
 MultimediaT = TypeVar("MultimediaT", bound="Multimedia")
 
+_CHANNELS = {"r": 0, "g": 1, "b": 2, "a": 3}
+
+#: channel sets tried by `Multimedia.bit_plane_sweep`, like zsteg
+_SWEEP_CHANNELS = ("r", "g", "b", "a", "rgb", "bgr", "rgba", "abgr")
+_SWEEP_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF8", "gif"),
+    (b"BM", "bmp"),
+    (b"PK\x03\x04", "zip"),
+    (b"Rar!\x1a\x07", "rar"),
+    (b"7z\xbc\xaf\x27\x1c", "7z"),
+    (b"\x1f\x8b\x08", "gzip"),
+    (b"BZh", "bzip2"),
+    (b"%PDF", "pdf"),
+    (b"\x7fELF", "elf"),
+    (b"MZ", "exe"),
+    (b"OggS", "ogg"),
+    (b"RIFF", "riff"),
+    (b"ID3", "mp3"),
+)
+_PRINTABLE = np.zeros(256, dtype=bool)
+_PRINTABLE[0x20:0x7F] = True
+_PRINTABLE[[0x09, 0x0A, 0x0D]] = True
+
+
+def _sweep_pixels(pixels, column_first: bool, reverse: bool, count: int = None):
+    """Flatten the ``(height, width, channels)`` pixels into reading order,
+    optionally only the first count pixels so the rest is never copied
+    """
+    if reverse:
+        pixels = pixels[::-1, ::-1]
+    if column_first:
+        if count is not None:
+            pixels = pixels[:, : -(-count // pixels.shape[0])]
+        pixels = pixels.transpose(1, 0, 2)
+    elif count is not None:
+        pixels = pixels[: -(-count // pixels.shape[1])]
+    flat = pixels.reshape(-1, pixels.shape[2])
+    return flat if count is None else flat[:count]
+
+
+def _stego_sweep(image, top: int, sample: int):
+    """Rank the bit streams of every channel set, bit, pixel order and bit
+    order of a decoded image. Candidates are scored on their first sample
+    bytes, and only the best ones are extracted in full.
+    """
+    has_alpha = "A" in image.getbands()
+    array = np.asarray(image.convert("RGBA" if has_alpha else "RGB"))
+    candidates = []
+    for channels in _SWEEP_CHANNELS:
+        if "a" in channels and not has_alpha:
+            continue
+        pixels = array[:, :, [_CHANNELS[c] for c in channels]]
+        count = -(-sample * 8 // len(channels))
+        for column_first in (False, True):
+            for reverse in (False, True):
+                head = _sweep_pixels(pixels, column_first, reverse, count)
+                for bit in range(8):
+                    plane = ((head >> bit) & 1).ravel()
+                    # only whole bytes are scored, and a stream of an image
+                    # too small to fill one scores 0
+                    plane = plane[: plane.size - plane.size % 8]
+                    for bit_order in ("msb", "lsb"):
+                        data = np.packbits(
+                            plane, bitorder="big" if bit_order == "msb" else "little"
+                        )[:sample]
+                        head_bytes = data.tobytes()
+                        magic = None
+                        for signature, name in _SWEEP_MAGIC:
+                            if head_bytes.startswith(signature):
+                                magic = name
+                                break
+                        candidates.append(
+                            {
+                                "channels": channels,
+                                "bit": bit,
+                                "order": "column" if column_first else "row",
+                                "reverse": reverse,
+                                "bit_order": bit_order,
+                                "printable": (
+                                    round(float(_PRINTABLE[data].mean()), 4)
+                                    if data.size
+                                    else 0.0
+                                ),
+                                "magic": magic,
+                            }
+                        )
+    candidates.sort(
+        key=lambda c: (c["magic"] is not None, c["printable"]), reverse=True
+    )
+    for candidate in candidates[:top]:
+        pixels = array[:, :, [_CHANNELS[c] for c in candidate["channels"]]]
+        bits = _sweep_pixels(
+            pixels, candidate["order"] == "column", candidate["reverse"]
+        )
+        candidate["data"] = np.packbits(
+            ((bits >> candidate["bit"]) & 1).ravel(),
+            bitorder="big" if candidate["bit_order"] == "msb" else "little",
+        ).tobytes()
+    return candidates[:top]
+
+
+def _stego_sweep_file(path: str, top: int, sample: int):
+    try:
+        image = Image.open(path)
+        image.load()
+    except (OSError, SyntaxError, ValueError):
+        return None
+    return _stego_sweep(image, top, sample)
+
+
+def _deprecated(message: str):
+    """Warn that a feature is deprecated, pointing at the first caller that is
+    not this module, chepy's core or a wrapper made by the decorator package
+    """
+    internal = {
+        os.path.abspath(path)
+        for path in (__file__, chepy.core.__file__, decorator.__file__)
+    }
+    frame, stacklevel = sys._getframe(), 1
+    while frame.f_back is not None and (
+        os.path.abspath(frame.f_code.co_filename) in internal
+        or frame.f_code.co_filename.startswith("<decorator-gen-")
+    ):
+        frame, stacklevel = frame.f_back, stacklevel + 1
+    warnings.warn(message, DeprecationWarning, stacklevel=stacklevel)
+
+
+class _DecodedImage:
+    """The decoded image that an image method of the image pipeline set as
+    the state, kept next to the encoded bytes it set the state to
+    """
+
+    __slots__ = ("image", "data")
+
+    def __init__(self, image, data: bytes):
+        self.image = image
+        self.data = data
+
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+#: channels of the 8 bit PNG color types that can be read in strips
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+#: PNG color type and channels of the image modes that can be written in strips
+_PNG_MODES = {"L": (0, 1), "LA": (4, 2), "RGB": (2, 3), "RGBA": (6, 4)}
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+    )
+
+
+class _PngStrips:
+    """Decode a non interlaced 8 bit PNG a strip of rows at a time.
+
+    The compressed data is inflated only as far as the next strip. Each strip
+    is decoded by PIL as a small PNG of its own, with the unfiltered last row
+    of the previous strip in front of it, which is all that the PNG row
+    filters look back at.
+    """
+
+    def __init__(self, rows: int, header, chunks, idat):
+        self.rows = rows
+        self.width, self.height = header[0], header[1]
+        self.header = header
+        self.chunks = chunks
+        self.idat = idat
+
+    @classmethod
+    def open(cls, data: bytes, rows: int):
+        """Index the chunks of a PNG, or None if it can not be read in strips"""
+        if not data.startswith(_PNG_SIGNATURE):
+            return None
+        view = memoryview(data)
+        offset = len(_PNG_SIGNATURE)
+        header = None
+        chunks = {}
+        idat = []
+        while offset + 8 <= len(data):
+            length, kind = struct.unpack_from(">I4s", data, offset)
+            body = view[offset + 8 : offset + 8 + length]
+            offset += length + 12
+            if kind == b"IHDR":
+                header = struct.unpack(">IIBBBBB", body)
+            elif kind in (b"PLTE", b"tRNS", b"iCCP"):
+                chunks[kind] = bytes(body)
+            elif kind == b"IDAT":
+                idat.append(body)
+            elif kind == b"IEND":
+                break
+        if (
+            header is None
+            or not idat
+            or header[2] != 8
+            or header[3] not in _PNG_CHANNELS
+            or header[6] != 0
+        ):
+            return None
+        return cls(rows, header, chunks, idat)
+
+    def blocks(self):
+        """Yield the image a strip of rows at a time"""
+        stride = self.width * _PNG_CHANNELS[self.header[3]]
+        inflate = zlib.decompressobj()
+        idat = iter(self.idat)
+        pending = b""
+        prior = bytes(stride)
+        for top in range(0, self.height, self.rows):
+            rows = min(self.rows, self.height - top)
+            size = rows * (stride + 1)
+            data = [pending]
+            have = len(pending)
+            while have < size:
+                compressed = inflate.unconsumed_tail or next(idat, None)
+                if compressed is None:
+                    break
+                piece = inflate.decompress(compressed, size - have)
+                data.append(piece)
+                have += len(piece)
+            data = b"".join(data)
+            pending = data[size:]
+            # the previous row goes in unfiltered, as the row before the strip
+            raw = b"\x00" + prior + data[:size]
+            header = struct.pack(">IIBBBBB", self.width, rows + 1, *self.header[2:])
+            png = [_PNG_SIGNATURE, _png_chunk(b"IHDR", header)]
+            for kind in (b"iCCP", b"PLTE", b"tRNS"):
+                if kind in self.chunks:
+                    png.append(_png_chunk(kind, self.chunks[kind]))
+            png.append(_png_chunk(b"IDAT", zlib.compress(raw, 0)))
+            png.append(_png_chunk(b"IEND", b""))
+            image = Image.open(io.BytesIO(b"".join(png)))
+            image.load()
+            prior = image.crop((0, rows, self.width, rows + 1)).tobytes()
+            yield image.crop((0, 1, self.width, rows + 1))
+
+    def halo_blocks(self, halo: int):
+        """Yield each strip with up to halo rows of its neighbours above and
+        below it, the number of rows that were added above it and its height
+        """
+        blocks = self.blocks()
+        previous = None
+        current = next(blocks, None)
+        while current is not None:
+            following = next(blocks, None)
+            if not halo:
+                yield current, 0, current.height
+            else:
+                parts = []
+                if previous is not None:
+                    height = previous.height
+                    parts.append(previous.crop((0, height - halo, self.width, height)))
+                parts.append(current)
+                if following is not None:
+                    height = min(halo, following.height)
+                    parts.append(following.crop((0, 0, self.width, height)))
+                image = Image.new(
+                    current.mode, (self.width, sum(p.height for p in parts))
+                )
+                image.info = current.info
+                top = 0
+                for part in parts:
+                    image.paste(part, (0, top))
+                    top += part.height
+                yield image, halo if previous is not None else 0, current.height
+            previous, current = current, following
+
+    def map(self, process, halo: int = 0) -> bytes:
+        """Run process over every strip and encode the results as a PNG"""
+        writer = None
+        for image, top, rows in self.halo_blocks(halo):
+            image = process(image)
+            if halo:
+                image = image.crop((0, top, self.width, top + rows))
+            if writer is None:
+                writer = _PngWriter(image, self.width, self.height)
+            writer.write(image)
+        return writer.close()
+
+
+class _PngWriter:
+    """Encode a PNG a strip of rows at a time, Paeth filtered"""
+
+    def __init__(self, image, width: int, height: int):
+        color_type, self.channels = _PNG_MODES[image.mode]
+        self.stride = width * self.channels
+        self.prior = np.zeros(self.stride, dtype=np.int16)
+        self.compress = zlib.compressobj()
+        self.fh = io.BytesIO()
+        self.fh.write(_PNG_SIGNATURE)
+        self.fh.write(
+            _png_chunk(
+                b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+            )
+        )
+        icc = image.info.get("icc_profile")
+        if icc:
+            self.fh.write(_png_chunk(b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc)))
+        transparency = image.info.get("transparency")
+        if image.mode == "L" and isinstance(transparency, int):
+            self.fh.write(_png_chunk(b"tRNS", struct.pack(">H", transparency)))
+        elif image.mode == "RGB" and isinstance(transparency, (list, tuple)):
+            self.fh.write(_png_chunk(b"tRNS", struct.pack(">3H", *transparency)))
+
+    def write(self, image):
+        pixels = np.asarray(image).reshape(-1, self.stride)
+        # a few rows at a time, so the int16 temporaries stay small
+        step = max(1, (1 << 20) // self.stride)
+        for top in range(0, len(pixels), step):
+            self._filter(pixels[top : top + step].astype(np.int16))
+
+    def _filter(self, pixels):
+        above = np.vstack((self.prior, pixels[:-1]))
+        left = np.zeros_like(pixels)
+        left[:, self.channels :] = pixels[:, : -self.channels]
+        corner = np.zeros_like(pixels)
+        corner[:, self.channels :] = above[:, : -self.channels]
+        # Paeth predictor, vectorised over all the rows
+        pa = np.abs(above - corner)
+        pb = np.abs(left - corner)
+        pc = np.abs(left + above - 2 * corner)
+        predicted = np.where(
+            (pa <= pb) & (pa <= pc), left, np.where(pb <= pc, above, corner)
+        )
+        filtered = np.empty((len(pixels), self.stride + 1), dtype=np.uint8)
+        filtered[:, 0] = 4
+        filtered[:, 1:] = (pixels - predicted) & 0xFF
+        self.prior = pixels[-1]
+        self._idat(self.compress.compress(filtered.tobytes()))
+
+    def _idat(self, data: bytes):
+        if data:
+            self.fh.write(_png_chunk(b"IDAT", data))
+
+    def close(self) -> bytes:
+        self._idat(self.compress.flush())
+        self.fh.write(_png_chunk(b"IEND", b""))
+        return self.fh.getvalue()
+
 
 class Multimedia(chepy.core.ChepyCore):
     """The `Multimedia` class is used predominantly to handle image and
@@ -44,6 +395,50 @@ class Multimedia(chepy.core.ChepyCore):
     def __init__(self, *data):
         super().__init__(*data)
 
+    @property
+    def _decoded_image(self):
+        """The decoded image of the state, if the image pipeline kept one for
+        it and the state was not written since
+        """
+        decoded = getattr(self, "_decoded_images", {}).get(self._current_index)
+        if decoded is None:
+            return None
+        if self.states.get(self._current_index) is not decoded.data:
+            del self._decoded_images[self._current_index]
+            return None
+        return decoded
+
+    def _image(self, copy: bool = False):
+        """Get the state as an image. An image that was kept decoded by the
+        image pipeline is used as is, or copied if it is going to be changed
+        in place.
+        """
+        decoded = self._decoded_image
+        if decoded is None:
+            return Image.open(self._load_as_file())
+        return decoded.image.copy() if copy else decoded.image
+
+    def _set_image(self, image, extension: str, **params):
+        """Set an image as the state. The image pipeline also keeps the
+        decoded image for the next image method.
+        """
+        fh = io.BytesIO()
+        image.save(fh, extension, **params)
+        self.state = fh.getvalue()
+        if getattr(self, "_image_pipeline", False):
+            if not hasattr(self, "_decoded_images"):
+                self._decoded_images = {}
+            self._decoded_images[self._current_index] = _DecodedImage(image, self.state)
+
+    def _image_strips(self, extension: str = "png", halo: int = 0):
+        """Get the state as a PNG that is read in strips when image tiles are
+        on, or None if the image has to be processed as a whole
+        """
+        rows = getattr(self, "_image_tile_rows", None)
+        if not rows or self._decoded_image is not None or extension.lower() != "png":
+            return None
+        return _PngStrips.open(self._convert_to_bytes(), max(rows, halo))
+
     def _force_rgba(self, image):  # pragma: no cover
         if image.mode != "RGBA":
             new = image.convert("RGBA")
@@ -58,6 +453,146 @@ class Multimedia(chepy.core.ChepyCore):
         else:
             return image
 
+    def _channel_array(self, image, channel: str):
+        """Get one color channel of an image as a 2d uint8 array"""
+        if channel not in _CHANNELS:
+            raise TypeError("Valid channels are r, g, b and a")
+        if channel == "a":
+            image = self._force_rgba(image)
+        elif image.mode not in ("RGB", "RGBA"):
+            image = self._force_rgb(image)
+        return np.asarray(image)[:, :, _CHANNELS[channel]]
+
+    def _bit_plane(
+        self, image, channel: str, bit: int, column_first: bool, packed: bool
+    ):
+        """Get one bit of every pixel of a channel, row by row or column by
+        column, as a string of 0 and 1 or packed 8 bits to a byte
+        """
+        plane = (self._channel_array(image, channel) >> bit) & 1
+        if column_first:
+            plane = plane.T
+        return self._bits_output(plane.ravel(), packed)
+
+    def _dump_order(self, order: str, column_first: bool, default: bool):
+        """Check if a bit dump is read column by column. column_first is the
+        deprecated way to ask for a column first dump, and default is the
+        order the dump has always had when neither is given.
+        """
+        if column_first:
+            _deprecated('column_first is deprecated, use order="column"')
+            if order is None:
+                order = "column"
+        if order is None:
+            return default
+        if order not in ("row", "column"):
+            raise TypeError("Valid orders are row and column")
+        return order == "column"
+
+    def _bits_output(self, bits, packed: bool):
+        if packed:
+            return np.packbits(bits).tobytes()
+        return (bits + ord("0")).tobytes().decode()
+
+    def _dump_bit_plane(self, channel: str, bit: int, column_first: bool, packed: bool):
+        """Get a bit plane of the state, a strip at a time when image tiles
+        are on. Only a column first dump has its bits put together whole.
+        """
+        strips = self._image_strips()
+        if strips is None:
+            return self._bit_plane(self._image(), channel, bit, column_first, packed)
+        planes = (
+            (self._channel_array(block, channel) >> bit) & 1
+            for block in strips.blocks()
+        )
+        if column_first:
+            bits = np.empty((strips.width, strips.height), dtype=np.uint8)
+            top = 0
+            for plane in planes:
+                bits[:, top : top + len(plane)] = plane.T
+                top += len(plane)
+            return self._bits_output(bits.ravel(), packed)
+        if not packed:
+            return b"".join(
+                (plane.ravel() + ord("0")).tobytes() for plane in planes
+            ).decode()
+        # bits that do not fill a byte are carried over to the next strip
+        hold = []
+        carry = np.empty(0, dtype=np.uint8)
+        for plane in planes:
+            bits = np.concatenate((carry, plane.ravel()))
+            whole = len(bits) // 8 * 8
+            hold.append(np.packbits(bits[:whole]).tobytes())
+            carry = bits[whole:]
+        hold.append(np.packbits(carry).tobytes())
+        return b"".join(hold)
+
+    @chepy.core.ChepyDecorators.call_stack
+    def image_pipeline(self, enable: bool = True) -> MultimediaT:
+        """Keep images decoded between chained image methods.
+
+        Every image method decodes the state and encodes its result again,
+        so a chain of image methods decodes the image that the method before
+        it just encoded. With the image pipeline on, the image methods still
+        set the encoded bytes as the state, and keep their decoded result
+        aside for the next image method, which uses it as long as the state
+        was not changed since. The decoded image is the one before it was
+        encoded, so with a lossy extension such as jpeg the next method
+        does not see the loss of the intermediate encode.
+
+        Args:
+            enable (bool, optional): Turn the image pipeline on or off.
+                Defaults to True.
+
+        Returns:
+            Chepy: The Chepy object.
+
+        Examples:
+            >>> c = Chepy("logo.png").load_file().image_pipeline()
+            >>> c.resize_image(1024, 1024).rotate_image(90).grayscale_image()
+            >>> c.write("/path/to/file.png", as_binary=True)
+        """
+        self._image_pipeline = enable
+        if not enable:
+            self._decoded_images = {}
+        return self
+
+    @chepy.core.ChepyDecorators.call_stack
+    def image_tiles(self, enable: bool = True, rows: int = 256) -> MultimediaT:
+        """Process very large images a strip of rows at a time.
+
+        With image tiles on, invert_image, image_brightness, image_contrast,
+        grayscale_image, blur_image and the LSB and MSB dumps decode, process
+        and encode the image one strip of full width rows at a time, so the
+        decoded pixels held at once scale with the width of the image times
+        the rows of a strip, and not with the height of the image. The
+        compressed PNG bytes of the input and the output are still held
+        whole. blur_image also reads the rows
+        around each strip that its kernel reaches, and image_contrast reads
+        the image once more to get its mean gray. The results are the same
+        as without tiles.
+
+        Image tiles work on non interlaced 8 bit PNG images that are saved
+        as png. Other images, and images held decoded by the image pipeline,
+        are processed whole.
+
+        Args:
+            enable (bool, optional): Turn image tiles on or off. Defaults to True.
+            rows (int, optional): Rows of a strip. Defaults to 256.
+
+        Returns:
+            Chepy: The Chepy object.
+
+        Examples:
+            >>> c = Chepy("scan.png").load_file().image_tiles(rows=512)
+            >>> c.image_contrast(1.5).invert_image()
+            >>> c.write("/path/to/file.png", as_binary=True)
+        """
+        if enable and rows < 1:
+            raise TypeError("Valid rows are 1 and above")
+        self._image_tile_rows = rows if enable else None
+        return self
+
     @chepy.core.ChepyDecorators.call_stack
     def resize_image(
         self,
@@ -83,7 +618,6 @@ class Multimedia(chepy.core.ChepyCore):
             >>> c = Chepy("image.png").load_file().resize_image(256, 256, "png")
             >>> c.write_to_file("/path/to/file.png", as_binary=True)
         """
-        fh = io.BytesIO()
         if resample == "nearest":
             resample = Image.NEAREST
         elif resample == "antialias":
@@ -98,18 +632,24 @@ class Multimedia(chepy.core.ChepyCore):
             raise TypeError(
                 "Valid resampling options are: nearest, antialias, bilinear, box and hamming"
             )
-        image = Image.open(self._load_as_file())
+        image = self._image()
         resized = image.resize((width, height), resample=resample)
-        resized.save(fh, extension, quality=quality)
-        self.state = fh.getvalue()
+        self._set_image(resized, extension, quality=quality)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
-    def split_color_channels(self, extension: str = "png") -> MultimediaT:
+    def split_color_channels(
+        self, extension: str = "png", output: str = "rgb"
+    ) -> MultimediaT:
         """Split an image into its red, green and blue channels
 
         Args:
             extension (str, optional): File extension of loaded image. Defaults to png
+            output (str, optional): How each channel is returned. rgb is an RGBA
+                image with the other channels set to 0, gray is a single band
+                grayscale image of the channel, and array is a 2d uint8 NumPy
+                array of the channel, which can be changed on its own.
+                Defaults to rgb.
 
         Returns:
             Chepy: The Chepy object.
@@ -121,35 +661,40 @@ class Multimedia(chepy.core.ChepyCore):
             >>> c.split_color_channels("png")
             {'red': b'...', 'green': b'...', 'blue': b'...'}
             >>> c.get_by_key("blue").write("/path/to/file.png", as_binary=True)
+
+            Get the channels as arrays to work on them with NumPy
+
+            >>> Chepy("logo.png").load_file().split_color_channels(output="array").o
+            {'red': array([[...]], dtype=uint8), 'green': ..., 'blue': ...}
         """
+        if output not in ("rgb", "gray", "array"):
+            raise TypeError("Valid outputs are rgb, gray and array")
+        image = self._image()
+        if image.mode not in ("RGB", "RGBA"):
+            image = self._force_rgb(image)
+        names = ("red", "green", "blue")
+        if output == "array":
+            pixels = np.asarray(image)
+            # a copy per channel, so changing one does not change the others
+            self.state = {name: pixels[:, :, i].copy() for i, name in enumerate(names)}
+            return self
+
+        bands = image.split()[:3]
+        if output == "rgb":
+            empty = Image.new("L", image.size, 0)
+            opaque = Image.new("L", image.size, 255)
+            bands = [
+                Image.merge(
+                    "RGBA",
+                    [band if i == j else empty for j in range(3)] + [opaque],
+                )
+                for i, band in enumerate(bands)
+            ]
         hold = {}
-        image = Image.open(self._load_as_file())
-        image = self._force_rgba(image)
-        data = image.getdata()
-
-        red = []
-        green = []
-        blue = []
-        for d in data:
-            red.append((d[0], 0, 0))
-            green.append((0, d[1], 0))
-            blue.append((0, 0, d[2]))
-
-        red_fh = io.BytesIO()
-        image.putdata(red)
-        image.save(red_fh, extension)
-        hold["red"] = red_fh.getvalue()
-
-        green_fh = io.BytesIO()
-        image.putdata(green)
-        image.save(green_fh, extension)
-        hold["green"] = green_fh.getvalue()
-
-        blue_fh = io.BytesIO()
-        image.putdata(blue)
-        image.save(blue_fh, extension)
-        hold["blue"] = blue_fh.getvalue()
-
+        for name, band in zip(names, bands):
+            fh = io.BytesIO()
+            band.save(fh, extension)
+            hold[name] = fh.getvalue()
         self.state = hold
         return self
 
@@ -170,11 +715,9 @@ class Multimedia(chepy.core.ChepyCore):
             >>> c = Chepy("logo.png").load_file().rotate_image(180, "png")
             >>> c.write('/path/to/file.png', as_binary=True)
         """
-        image = Image.open(self._load_as_file())
-        fh = io.BytesIO()
+        image = self._image()
         rotated = image.rotate(rotate_by)
-        rotated.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(rotated, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -186,7 +729,8 @@ class Multimedia(chepy.core.ChepyCore):
         Args:
             extension (str, optional): File extension of loaded image. Defaults to png
             gaussian (bool, optional): If Gaussian blur is to be applied. Defaults to False.
-            radius (int, optional): Radius for Gaussian blur. Defaults to 2.
+            radius (int|tuple, optional): Radius for Gaussian blur, or an
+                (x, y) pair of radii. Defaults to 2.
 
         Returns:
             Chepy: The Chepy object.
@@ -201,14 +745,22 @@ class Multimedia(chepy.core.ChepyCore):
             >>> c.blur_image(extension="png", gaussian=True, radius=4)
             >>> >>> c.write('/path/to/file.png', as_binary=True)
         """
-        image = Image.open(self._load_as_file())
-        fh = io.BytesIO()
         if gaussian:
-            blurred = image.filter(ImageFilter.GaussianBlur(radius=radius))
+            image_filter = ImageFilter.GaussianBlur(radius=radius)
+            # each of the 3 box blurs that make up the gaussian reaches
+            # radius + 1 pixels, and pillow also takes an (x, y) radius
+            reach = max(radius) if isinstance(radius, (tuple, list)) else radius
+            halo = 3 * (int(reach) + 2)
         else:
-            blurred = image.filter(ImageFilter.BLUR)
-        blurred.save(fh, extension)
-        self.state = fh.getvalue()
+            image_filter = ImageFilter.BLUR
+            halo = 2
+        strips = self._image_strips(extension, halo)
+        if strips is not None and strips.header[3] != 3:
+            self.state = strips.map(lambda block: block.filter(image_filter), halo)
+            return self
+        image = self._image()
+        blurred = image.filter(image_filter)
+        self._set_image(blurred, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -225,11 +777,13 @@ class Multimedia(chepy.core.ChepyCore):
             >>> c = Chepy("logo.png").load_file().grayscale_image("png")
             >>> >>> c.write('/path/to/file.png', as_binary=True)
         """
-        image = Image.open(self._load_as_file())
-        fh = io.BytesIO()
+        strips = self._image_strips(extension)
+        if strips is not None:
+            self.state = strips.map(lambda block: block.convert("LA"))
+            return self
+        image = self._image()
         gray = image.convert("LA")
-        gray.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(gray, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -246,12 +800,16 @@ class Multimedia(chepy.core.ChepyCore):
             >>> c = Chepy("logo.png").load_file().invert_image("png")
             >>> >>> c.write('/path/to/file.png', as_binary=True)
         """
-        image = Image.open(self._load_as_file())
+        strips = self._image_strips(extension)
+        if strips is not None:
+            self.state = strips.map(
+                lambda block: ImageOps.invert(self._force_rgb(block))
+            )
+            return self
+        image = self._image()
         image = self._force_rgb(image)
-        fh = io.BytesIO()
         inverted = ImageOps.invert(image)
-        inverted.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(inverted, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -265,12 +823,10 @@ class Multimedia(chepy.core.ChepyCore):
         Returns:
             Chepy: The Chepy object.
         """
-        image = Image.open(self._load_as_file())
+        image = self._image(copy=True)
         image = self._force_rgba(image)
-        fh = io.BytesIO()
         image.putalpha(level)
-        image.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(image, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -284,12 +840,27 @@ class Multimedia(chepy.core.ChepyCore):
         Returns:
             Chepy: The Chepy object.
         """
-        image = Image.open(self._load_as_file())
+        strips = self._image_strips(extension)
+        if strips is not None:
+            # the contrast is around the mean gray of the whole image
+            histogram = np.zeros(256, dtype=np.int64)
+            for block in strips.blocks():
+                gray = self._force_rgb(block).convert("L")
+                histogram += np.asarray(gray.histogram(), dtype=np.int64)
+            total = int(histogram @ np.arange(256))
+            mean = int(total / int(histogram.sum()) + 0.5)
+            self.state = strips.map(
+                lambda block: Image.blend(
+                    Image.new("RGB", block.size, (mean,) * 3),
+                    self._force_rgb(block),
+                    factor,
+                )
+            )
+            return self
+        image = self._image()
         image = self._force_rgb(image)
-        fh = io.BytesIO()
         enhanced = ImageEnhance.Contrast(image).enhance(factor)
-        enhanced.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(enhanced, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -303,12 +874,18 @@ class Multimedia(chepy.core.ChepyCore):
         Returns:
             Chepy: The Chepy object.
         """
-        image = Image.open(self._load_as_file())
+        strips = self._image_strips(extension)
+        if strips is not None:
+            self.state = strips.map(
+                lambda block: ImageEnhance.Brightness(self._force_rgb(block)).enhance(
+                    factor
+                )
+            )
+            return self
+        image = self._image()
         image = self._force_rgb(image)
-        fh = io.BytesIO()
         enhanced = ImageEnhance.Brightness(image).enhance(factor)
-        enhanced.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(enhanced, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -322,12 +899,10 @@ class Multimedia(chepy.core.ChepyCore):
         Returns:
             Chepy: The Chepy object.
         """
-        image = Image.open(self._load_as_file())
+        image = self._image()
         image = self._force_rgb(image)
-        fh = io.BytesIO()
         enhanced = ImageEnhance.Sharpness(image).enhance(factor)
-        enhanced.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(enhanced, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -341,12 +916,10 @@ class Multimedia(chepy.core.ChepyCore):
         Returns:
             Chepy: The Chepy object.
         """
-        image = Image.open(self._load_as_file())
+        image = self._image()
         image = self._force_rgb(image)
-        fh = io.BytesIO()
         enhanced = ImageEnhance.Color(image).enhance(factor)
-        enhanced.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(enhanced, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -404,7 +977,7 @@ class Multimedia(chepy.core.ChepyCore):
             .::......................................................::.
             .::.:..................................................:.::.
         """
-        img = Image.open(self._load_as_file())
+        img = self._image()
 
         width, height = img.size
         aspect_ratio = height / width
@@ -445,16 +1018,14 @@ class Multimedia(chepy.core.ChepyCore):
             b'\\xff\\xd8\\xff\\xe0...'
             >>> c.write("/path/to/file.jpeg", as_binary=True)
         """
-        image = Image.open(self._load_as_file())
-        fh = io.BytesIO()
+        image = self._image()
 
         if image.mode != "RGB":
             new = image.convert("RGB")
         else:  # pragma: no cover
             new = image
 
-        new.save(fh, format_to)
-        self.state = fh.getvalue()
+        self._set_image(new, format_to)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
@@ -483,8 +1054,7 @@ class Multimedia(chepy.core.ChepyCore):
             b'\\xff\\xd8\\xff\\xe0...'
             >>> c.write("/path/to/file.jpeg", as_binary=True)
         """
-        image = Image.open(self._load_as_file())
-        fh = io.BytesIO()
+        image = self._image(copy=True)
 
         if image.mode != "RGB":
             new = image.convert("RGB")
@@ -492,84 +1062,145 @@ class Multimedia(chepy.core.ChepyCore):
             new = image
 
         ImageDraw.Draw(new).text(coordinates, text, color)
-        new.save(fh, extension)
-        self.state = fh.getvalue()
+        self._set_image(new, extension)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
     def lsb_dump_by_channel(
-        self, channel: str = "r", column_first: bool = False
-    ) -> MultimediaT:  # pragma: no cover
+        self,
+        channel: str = "r",
+        column_first: bool = False,
+        packed: bool = False,
+        order: str = None,
+    ) -> MultimediaT:
         """Dump LSB from a specific color channel
 
         Args:
-            channel (str, optional): Color channel. r, g, b. Defaults to 'r'.
-            column_first (bool, optional): Order by column first. Defaults to False.
+            channel (str, optional): Color channel. r, g, b or a. Defaults to 'r'.
+            column_first (bool, optional): Deprecated, use order. True reads
+                the pixels column by column, like order="column", and warns.
+                Defaults to False.
+            packed (bool, optional): Pack every 8 bits into a byte instead of
+                returning a string of 0 and 1. Defaults to False.
+            order (str, optional): row or column. Read the pixels row by row
+                or column by column. Defaults to row.
 
         Returns:
             Chepy: The Chepy object.
-        """
-        channels = ["r", "g", "b"]
-        assert channel in channels, "Valid channels are {}".format("".join(channels))
-        if channel == "r":
-            index = 0
-        elif channel == "g":
-            index = 1
-        elif channel == "b":
-            index = 2
-        image = Image.open(self._load_as_file())
-        pixels = image.load()
-        if column_first:
-            height, width = image.size
-        else:
-            width, height = image.size
-
-        data = ""
-        for y in range(height):
-            for x in range(width):
-                try:
-                    pix = pixels[x, y][index]
-                    lsb = bin(pix).zfill(8)[-1]
-                    data += lsb
-                except IndexError:
-                    break
 
-        self.state = data
+        Examples:
+            >>> Chepy("stego.png").load_file().lsb_dump_by_channel("r").state
+            '0110100001101001...'
+            >>> Chepy("stego.png").load_file().lsb_dump_by_channel("r", packed=True).o
+            b'hi...'
+        """
+        column_first = self._dump_order(order, column_first, False)
+        self.state = self._dump_bit_plane(channel, 0, column_first, packed)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
     def msb_dump_by_channel(
-        self, channel: str = "r", column_first: bool = False
-    ) -> MultimediaT:  # pragma: no cover
+        self,
+        channel: str = "r",
+        column_first: bool = False,
+        packed: bool = False,
+        order: str = None,
+    ) -> MultimediaT:
         """Dump MSB from a specific color channel
 
         Args:
-            channel (str, optional): Color channel. r, g, b. Defaults to 'r'.
-            column_first (bool, optional): Order by column first. Defaults to False.
+            channel (str, optional): Color channel. r, g, b or a. Defaults to 'r'.
+            column_first (bool, optional): Deprecated, use order. True reads
+                the pixels column by column, like order="column", and warns.
+                Defaults to False.
+            packed (bool, optional): Pack every 8 bits into a byte instead of
+                returning a string of 0 and 1. Defaults to False.
+            order (str, optional): row or column. Read the pixels row by row
+                or column by column. Defaults to column.
 
         Returns:
             Chepy: The Chepy object.
         """
-        channels = ["r", "g", "b"]
-        assert channel in channels, "Valid channels are {}".format("".join(channels))
-        if channel == "r":
-            index = 0
-        elif channel == "g":
-            index = 1
-        elif channel == "b":
-            index = 2
-        image = Image.open(self._load_as_file())
-        pixels = image.load()
-        if column_first:
-            height, width = image.size
-        else:
-            width, height = image.size
+        column_first = self._dump_order(order, column_first, True)
+        self.state = self._dump_bit_plane(channel, 7, column_first, packed)
+        return self
+
+    @chepy.core.ChepyDecorators.call_stack
+    def bit_plane_sweep(
+        self, top: int = 10, sample: int = 256, workers: int = 1
+    ) -> MultimediaT:
+        """Try every bit plane stream of an image in one decode, like zsteg.
+
+        The image is decoded once and the r, g, b, a, rgb, bgr, rgba and abgr
+        channel sets are read at every bit from 0 to 7, by row or by column,
+        from the first or the last pixel, and packed MSB or LSB first. The
+        streams are ranked by a file magic at their start, and then by the
+        ratio of printable bytes in their first sample bytes. Streams of an
+        image too small to fill a byte score 0. The top streams are returned
+        with their full data.
+
+        When the state is a directory, every image in it is swept and the
+        results are keyed by file name.
 
-        data = ""
-        for x in range(height):
-            for y in range(width):
-                val = pixels[x, y][index]
-                data += ((bin(val)[2:]).zfill(8))[0]
+        Args:
+            top (int, optional): Number of streams to return. Defaults to 10.
+            sample (int, optional): Bytes of each stream that are scored.
+                Defaults to 256.
+            workers (int, optional): Number of processes to sweep the images
+                of a directory with. Defaults to 1.
+
+        Returns:
+            Chepy: The Chepy object.
 
-        self.state = data
+        Examples:
+            >>> Chepy("stego.png").load_file().bit_plane_sweep(top=1).o
+            [
+                {
+                    'channels': 'rgb',
+                    'bit': 0,
+                    'order': 'row',
+                    'reverse': False,
+                    'bit_order': 'msb',
+                    'printable': 1.0,
+                    'magic': None,
+                    'data': b'flag{...}...'
+                }
+            ]
+            >>> Chepy("/path/to/images").bit_plane_sweep(top=3, workers=4).o
+            {'a.png': [...], 'b.png': [...]}
+        """
+        if sample < 1:
+            raise TypeError("Valid samples are 1 and above")
+        if (
+            self._decoded_image is None
+            and isinstance(self.state, str)
+            and os.path.isdir(self.state)
+        ):
+            folder = str(self._abs_path(self.state))
+            names = sorted(
+                name
+                for name in os.listdir(folder)
+                if os.path.isfile(os.path.join(folder, name))
+            )
+            paths = [os.path.join(folder, name) for name in names]
+            if workers > 1:
+                with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                    results = list(
+                        pool.map(
+                            _stego_sweep_file,
+                            paths,
+                            [top] * len(paths),
+                            [sample] * len(paths),
+                        )
+                    )
+            else:
+                results = [_stego_sweep_file(path, top, sample) for path in paths]
+            self.state = {
+                name: result
+                for name, result in zip(names, results)
+                if result is not None
+            }
+            return self
+        image = self._image()
+        self.state = _stego_sweep(image, top, sample)
         return self
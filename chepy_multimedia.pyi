@@ -6,8 +6,10 @@ MultimediaT = TypeVar('MultimediaT', bound='Multimedia')
 class Multimedia(ChepyCore):
     def __init__(self, *data: Any) -> None: ...
     state: Any = ...
+    def image_pipeline(self: MultimediaT, enable: bool=...) -> MultimediaT: ...
+    def image_tiles(self: MultimediaT, enable: bool=..., rows: int=...) -> MultimediaT: ...
     def resize_image(self: MultimediaT, width: int, height: int, extension: str=..., resample: str=..., quality: int=...) -> MultimediaT: ...
-    def split_color_channels(self: MultimediaT, extension: str=...) -> MultimediaT: ...
+    def split_color_channels(self: MultimediaT, extension: str=..., output: str=...) -> MultimediaT: ...
     def rotate_image(self: MultimediaT, rotate_by: int, extension: str=...) -> MultimediaT: ...
     def blur_image(self: MultimediaT, extension: str=..., gaussian: bool=..., radius: int=...) -> MultimediaT: ...
     def grayscale_image(self: MultimediaT, extension: str=...) -> MultimediaT: ...
@@ -20,5 +22,6 @@ class Multimedia(ChepyCore):
     def image_to_asciiart(self: MultimediaT, art_width: int=..., chars: List[str]=...) -> MultimediaT: ...
     def convert_image(self: MultimediaT, format_to: str) -> MultimediaT: ...
     def image_add_text(self: MultimediaT, text: str, extension: str=..., coordinates: Tuple[int, int]=..., color: Tuple[int, int, int]=...) -> MultimediaT: ...
-    def lsb_dump_by_channel(self: MultimediaT, channel: str=..., column_first: bool=...) -> MultimediaT: ...
-    def msb_dump_by_channel(self: MultimediaT, channel: str=..., column_first: bool=...) -> MultimediaT: ...
+    def lsb_dump_by_channel(self: MultimediaT, channel: str=..., column_first: bool=..., packed: bool=..., order: str=...) -> MultimediaT: ...
+    def msb_dump_by_channel(self: MultimediaT, channel: str=..., column_first: bool=..., packed: bool=..., order: str=...) -> MultimediaT: ...
+    def bit_plane_sweep(self: MultimediaT, top: int=..., sample: int=..., workers: int=...) -> MultimediaT: ...
@@ -1,6 +1,26 @@
+import io
+import os
+import gzip
+import json
+import lzma
+import bisect
+import mmap
 import sys
-import binascii
+import time
+import glob
+import heapq
+import array
+import struct
+import datetime
+import hashlib
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
 import collections
+import concurrent.futures
 
 import regex as re
 import logging
@@ -10,114 +30,3153 @@ try:
 
     scapy = lazy_import.lazy_module("scapy.all")
     # import scapy.all as scapy
+    np = lazy_import.lazy_module("numpy")
+    zstandard = lazy_import.lazy_module("zstandard")
 
 except ImportError:
-    logging.warning("Could not import scapy. Use pip install scapy")
+    logging.warning("Could not import scapy or numpy. Use pip install scapy numpy")
 
 import chepy.core
 
 logging.getLogger("scapy").setLevel(logging.ERROR)
 
+_PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+_PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
 
-def _full_duplex(p):  # pragma: no cover
-    """Create a full duplex stream from packets
-    `Reference <https://gist.github.com/MarkBaggett/d8933453f431c111169158ce7f4e2222>`__
-    """
-    sess = "Other"
-    if "Ether" in p:
-        if "IP" in p:
-            if "TCP" in p:
-                sess = str(
-                    sorted(
-                        [
-                            "TCP",
-                            p[scapy.IP].src,
-                            p[scapy.TCP].sport,
-                            p[scapy.IP].dst,
-                            p[scapy.TCP].dport,
-                        ],
-                        key=str,
-                    )
-                )
-            elif "UDP" in p:
-                sess = str(
-                    sorted(
-                        [
-                            "UDP",
-                            p[scapy.IP].src,
-                            p[scapy.UDP].sport,
-                            p[scapy.IP].dst,
-                            p[scapy.UDP].dport,
-                        ],
-                        key=str,
+
+def _pcapng_resolution(options, endian):
+    """Get the timestamp resolution and offset from the options of an
+    interface description block
+    """
+    resolution, ts_offset = 1e-6, 0
+    while len(options) >= 4:
+        code, length = struct.unpack(endian + "HH", options[:4])
+        if code == 0:
+            break
+        value = options[4 : 4 + length]
+        if code == 9 and length == 1:
+            if value[0] & 0x80:  # pragma: no cover
+                resolution = 2.0 ** -(value[0] & 0x7F)
+            else:
+                resolution = 10.0 ** -value[0]
+        elif code == 14 and length == 8:  # pragma: no cover
+            ts_offset = struct.unpack(endian + "q", value)[0]
+        options = options[4 + ((length + 3) & ~3) :]
+    return resolution, ts_offset
+
+
+class _RecordReader:
+    """Read the raw records of a pcap or pcapng file handle without
+    dissecting them.
+
+    `offset` always points at the next unread record or pcapng block. Given
+    the `state` of a reader and a record offset, a new reader can start in
+    the middle of a file.
+
+    Iterating yields ``(offset, timestamp, linktype, wirelen, data)`` tuples
+    where offset is the file offset of the first byte of the packet data.
+    """
+
+    def __init__(self, fh, state=None, offset: int = None):
+        self.fh = fh
+        self._pending = b""
+        if state is None:
+            magic = fh.read(4)
+            if magic in _PCAP_MAGIC:
+                endian, resolution = _PCAP_MAGIC[magic]
+                linktype = struct.unpack(endian + "HHiIII", fh.read(20))[-1]
+                state, offset = (False, endian, resolution, linktype, ()), 24
+            elif magic == _PCAPNG_MAGIC:
+                state, offset = (True, "<", 1e-6, None, ()), 0
+                self._pending = magic
+            else:  # pragma: no cover
+                raise TypeError("Not a valid pcap or pcapng file")
+        else:
+            fh.seek(offset)
+        self.pcapng, self.endian, self.resolution, self.linktype, interfaces = state
+        self.interfaces = list(interfaces)
+        self.offset = offset
+
+    def __iter__(self):
+        return self.records()
+
+    def state(self):
+        return (
+            self.pcapng,
+            self.endian,
+            self.resolution,
+            self.linktype,
+            tuple(self.interfaces),
+        )
+
+    def records(self, end: int = None):
+        """Yield records until the end of the file, or until the record
+        that starts at or after end.
+        """
+        if self.pcapng:
+            yield from self._pcapng_records(end)
+            return
+        record = struct.Struct(self.endian + "IIII")
+        resolution, linktype = self.resolution, self.linktype
+        while end is None or self.offset < end:
+            header = self.fh.read(16)
+            if len(header) < 16:
+                break
+            sec, frac, caplen, wirelen = record.unpack(header)
+            data = self.fh.read(caplen)
+            if len(data) < caplen:
+                break
+            offset = self.offset + 16
+            self.offset = offset + caplen
+            yield offset, sec + frac * resolution, linktype, wirelen, data
+
+    def scan(self):
+        """Yield the offset of every record without reading its data"""
+        if self.pcapng:
+            while True:
+                start = self.offset
+                block = self._pcapng_block(skip_packets=True)
+                if block is None:
+                    break
+                if block[0] in (2, 3, 6):
+                    yield start
+            return
+        record = struct.Struct(self.endian + "IIII")
+        while True:
+            header = self.fh.read(16)
+            if len(header) < 16:
+                break
+            yield self.offset
+            caplen = record.unpack(header)[2]
+            self.fh.seek(caplen, 1)
+            self.offset += 16 + caplen
+
+    def _pcapng_block(self, skip_packets: bool = False):
+        """Read the next pcapng block and keep track of the byte order and
+        interfaces. Returns ``(block_type, length, body)`` or None at the end
+        of the file.
+        """
+        head = self._pending + self.fh.read(8 - len(self._pending))
+        self._pending = b""
+        if len(head) < 8:
+            return None
+        if head[:4] == _PCAPNG_MAGIC:
+            # section header block. byte order is decided by its magic
+            bom = self.fh.read(4)
+            if len(bom) < 4:
+                return None
+            self.endian = "<" if bom == b"\x4d\x3c\x2b\x1a" else ">"
+            length = struct.unpack(self.endian + "I", head[4:])[0]
+            body = self.fh.read(length - 12)
+            if len(body) < length - 12:  # pragma: no cover
+                return None
+            self.interfaces = []
+            self.offset += length
+            return 0x0A0D0D0A, length, body
+        block_type, length = struct.unpack(self.endian + "II", head)
+        if skip_packets and block_type in (2, 3, 6):
+            self.fh.seek(length - 8, 1)
+            self.offset += length
+            return block_type, length, None
+        body = self.fh.read(length - 8)
+        if len(body) < length - 8:
+            return None
+        if block_type == 1:
+            linktype, _, snaplen = struct.unpack(self.endian + "HHI", body[:8])
+            self.interfaces.append(
+                (linktype, snaplen) + _pcapng_resolution(body[8:-4], self.endian)
+            )
+        self.offset += length
+        return block_type, length, body
+
+    def _pcapng_records(self, end: int = None):
+        endian = self.endian
+        while end is None or self.offset < end:
+            start = self.offset
+            block = self._pcapng_block()
+            if block is None:
+                break
+            block_type, length, body = block
+            if block_type in (2, 6):
+                # enhanced and obsolete packet blocks share the same layout
+                # apart from the width of the interface id
+                endian = self.endian
+                if block_type == 6:
+                    iface, high, low, caplen, wirelen = struct.unpack(
+                        endian + "IIIII", body[:20]
                     )
-                )
-            elif "ICMP" in p:
-                sess = str(
-                    sorted(
-                        [
-                            "ICMP",
-                            p[scapy.IP].src,
-                            p[scapy.IP].dst,
-                            p[scapy.ICMP].code,
-                            p[scapy.ICMP].type,
-                            p[scapy.ICMP].id,
-                        ],
-                        key=str,
+                else:  # pragma: no cover
+                    iface, _, high, low, caplen, wirelen = struct.unpack(
+                        endian + "HHIIII", body[:20]
                     )
+                linktype, _, resolution, ts_offset = self.interfaces[iface]
+                timestamp = ts_offset + ((high << 32) | low) * resolution
+                yield start + 28, timestamp, linktype, wirelen, body[20 : 20 + caplen]
+            elif block_type == 3:  # pragma: no cover
+                linktype, snaplen, _, _ = self.interfaces[0]
+                wirelen = struct.unpack(self.endian + "I", body[:4])[0]
+                caplen = min(wirelen, snaplen or wirelen, length - 16)
+                yield start + 12, None, linktype, wirelen, body[4 : 4 + caplen]
+
+
+class _MappedRecordReader(_RecordReader):
+    """`_RecordReader` over a memory mapped capture. Record data are
+    memoryview slices into the mapping, so nothing is copied until a caller
+    asks for bytes.
+    """
+
+    def __init__(self, path: str, state=None, offset: int = None, buffer=None):
+        with open(path, "rb") as fh:
+            super().__init__(fh, state, offset)
+            if buffer is None:
+                # the mapping stays open for as long as a slice of it is alive
+                buffer = memoryview(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+            self.buffer = buffer
+        self.fh = None
+        self._pending = b""
+
+    def records(self, end: int = None):
+        if self.pcapng:
+            yield from self._pcapng_records(end)
+            return
+        buffer, size = self.buffer, len(self.buffer)
+        record = struct.Struct(self.endian + "IIII")
+        resolution, linktype = self.resolution, self.linktype
+        while end is None or self.offset < end:
+            offset = self.offset + 16
+            if offset > size:
+                break
+            sec, frac, caplen, wirelen = record.unpack_from(buffer, self.offset)
+            if offset + caplen > size:
+                break
+            self.offset = offset + caplen
+            yield offset, sec + frac * resolution, linktype, wirelen, buffer[
+                offset : self.offset
+            ]
+
+    def scan(self):
+        if self.pcapng:
+            yield from super().scan()
+            return
+        buffer, size = self.buffer, len(self.buffer)
+        record = struct.Struct(self.endian + "8xI")
+        while self.offset + 16 <= size:
+            yield self.offset
+            self.offset += 16 + record.unpack_from(buffer, self.offset)[0]
+
+    def _pcapng_block(self, skip_packets: bool = False):
+        buffer, start = self.buffer, self.offset
+        if start + 12 > len(buffer):
+            return None
+        if buffer[start : start + 4] == _PCAPNG_MAGIC:
+            bom = buffer[start + 8 : start + 12]
+            self.endian = "<" if bom == b"\x4d\x3c\x2b\x1a" else ">"
+            length = struct.unpack_from(self.endian + "I", buffer, start + 4)[0]
+            if start + length > len(buffer):  # pragma: no cover
+                return None
+            self.interfaces = []
+            self.offset += length
+            return 0x0A0D0D0A, length, buffer[start + 12 : start + length]
+        block_type, length = struct.unpack_from(self.endian + "II", buffer, start)
+        if start + length > len(buffer):
+            return None
+        body = buffer[start + 8 : start + length]
+        if block_type == 1:
+            linktype, _, snaplen = struct.unpack_from(self.endian + "HHI", body)
+            self.interfaces.append(
+                (linktype, snaplen) + _pcapng_resolution(body[8:-4], self.endian)
+            )
+        self.offset += length
+        return block_type, length, body
+
+
+_COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
+
+def _compression(path: str):
+    """Get the compression of a capture from its magic bytes. Returns gzip,
+    xz, zstd or None for an uncompressed file.
+    """
+    with open(path, "rb") as fh:
+        head = fh.read(6)
+    for magic, kind in _COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+_CAPTURE_EXTENSIONS = (".pcap", ".pcapng", ".cap")
+_COMPRESSED_EXTENSIONS = ("", ".gz", ".bgz", ".xz", ".zst")
+
+
+def _is_capture(path: str):
+    """Whether a file found in a directory or by a glob is a capture: it has
+    a capture extension, compressed or not, or starts with pcap or pcapng
+    magic. Index sidecars are never captures.
+    """
+    name = os.path.basename(path).lower()
+    if name.endswith(".chepy-index") or not os.path.isfile(path):
+        return False
+    if name.endswith(
+        tuple(
+            extension + compressed
+            for extension in _CAPTURE_EXTENSIONS
+            for compressed in _COMPRESSED_EXTENSIONS
+        )
+    ):
+        return True
+    try:
+        with open(path, "rb") as fh:
+            magic = fh.read(4)
+    except OSError:  # pragma: no cover
+        return False
+    return magic in _PCAP_MAGIC or magic == _PCAPNG_MAGIC
+
+
+def _gzip_frames(fh):
+    """Member offsets of a BGZF file, followed by the end of the file. Every
+    member of a BGZF file keeps its compressed size in the header and its
+    uncompressed size in the trailer, so the members are found without
+    inflating anything. Other gzip files return None.
+    """
+    frames, offset, position = [], 0, 0
+    while True:
+        fh.seek(offset)
+        header = fh.read(18)
+        if not header:
+            frames.append((offset, position))
+            return frames
+        if (
+            len(header) < 18
+            or header[:4] != b"\x1f\x8b\x08\x04"
+            or header[12:14] != b"BC"
+        ):
+            return None
+        size = struct.unpack("<H", header[16:18])[0] + 1
+        fh.seek(offset + size - 4)
+        frames.append((offset, position))
+        position += struct.unpack("<I", fh.read(4))[0]
+        offset += size
+
+
+def _zstd_frames(fh):
+    """Frame offsets of a zstd file followed by the end of the file, found by
+    walking the frame and block headers. Returns None when a frame does not
+    declare its content size.
+    """
+    frames, offset, position = [], 0, 0
+    while True:
+        fh.seek(offset)
+        header = fh.read(6)
+        if not header:
+            frames.append((offset, position))
+            return frames
+        if len(header) < 6:  # pragma: no cover
+            return None
+        magic = struct.unpack("<I", header[:4])[0]
+        if magic & 0xFFFFFFF0 == 0x184D2A50:
+            # skippable frame
+            offset += 8 + struct.unpack("<I", header[4:6] + fh.read(2))[0]
+            continue
+        if magic != 0xFD2FB528:  # pragma: no cover
+            return None
+        descriptor = header[4]
+        single_segment = descriptor >> 5 & 1
+        size_length = (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+        if not size_length:
+            return None
+        start = offset + 5 + (not single_segment)
+        start += (0, 1, 2, 4)[descriptor & 3]
+        fh.seek(start)
+        size = int.from_bytes(fh.read(size_length), "little")
+        if size_length == 2:
+            size += 256
+        frames.append((offset, position))
+        position += size
+        offset = start + size_length
+        while True:
+            fh.seek(offset)
+            block = int.from_bytes(fh.read(3), "little")
+            block_type = block >> 1 & 3
+            if block_type == 3:  # pragma: no cover
+                return None
+            offset += 3 + (1 if block_type == 1 else block >> 3)
+            if block & 1:
+                break
+        if descriptor & 4:
+            offset += 4
+
+
+class _CompressedFile(io.RawIOBase):
+    """Seekable file object over a gzip, xz or zstd compressed capture that
+    decompresses while it is read, so nothing is written to disk.
+
+    When the file is made of independent frames (BGZF members, or zstd
+    frames that declare their size) a frame index maps uncompressed offsets
+    to compressed ones, and seeking starts decompressing at the frame that
+    holds the offset. Otherwise seeking forward decompresses up to the
+    offset and seeking backward starts over.
+    """
+
+    #: frame indexes of the files opened last in this process
+    _frames = collections.OrderedDict()
+    _frames_size = 32
+
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.kind = kind
+        self.fh = open(path, "rb", buffering=1 << 20)
+        stat = os.fstat(self.fh.fileno())
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key in self._frames:
+            self._frames.move_to_end(key)
+        else:
+            frames = None
+            if kind == "gzip":
+                frames = _gzip_frames(self.fh)
+            elif kind == "zstd":
+                frames = _zstd_frames(self.fh)
+            self._frames[key] = frames
+            while len(self._frames) > self._frames_size:
+                self._frames.popitem(last=False)
+        frames = self._frames[key]
+        #: ``(compressed offset, uncompressed offset)`` per frame
+        self.frames = frames[:-1] if frames and len(frames) > 1 else None
+        self.positions = [frame[1] for frame in self.frames or ()]
+        #: uncompressed size when the frames are known
+        self.size = frames[-1][1] if self.frames else None
+        self.position = 0
+        self.stream = None
+
+    @property
+    def seekable_frames(self):
+        return self.frames is not None and len(self.frames) > 1
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.stream = None
+            self.fh.close()
+        super().close()
+
+    def _open(self, position: int):
+        """Start decompressing at the frame that holds position"""
+        offset, start = 0, 0
+        if self.frames is not None:
+            offset, start = self.frames[
+                max(bisect.bisect_right(self.positions, position) - 1, 0)
+            ]
+        self.fh.seek(offset)
+        if self.kind == "gzip":
+            self.stream = gzip.GzipFile(fileobj=self.fh, mode="rb")
+        elif self.kind == "xz":
+            self.stream = lzma.LZMAFile(self.fh)
+        else:
+            self.stream = zstandard.ZstdDecompressor().stream_reader(
+                self.fh, read_size=1 << 20, read_across_frames=True, closefd=False
+            )
+        self.position = start
+        self._skip(position - start)
+
+    def _skip(self, size: int):
+        while size > 0:
+            data = self.stream.read(min(size, 1 << 20))
+            if not data:
+                break
+            self.position += len(data)
+            size -= len(data)
+
+    def seek(self, offset: int, whence: int = 0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:  # pragma: no cover
+            raise io.UnsupportedOperation("Can not seek from the end")
+        if self.stream is None or offset < self.position:
+            self._open(offset)
+        elif offset > self.position:
+            if self.seekable_frames and bisect.bisect_right(
+                self.positions, offset
+            ) > bisect.bisect_right(self.positions, self.position):
+                self._open(offset)
+            else:
+                self._skip(offset - self.position)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.stream is None:
+            self._open(self.position)
+        data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def _open_capture(path: str, kind: str = None):
+    """Open a capture for reading. Compressed captures are decompressed on
+    the fly behind a large read buffer.
+    """
+    kind = kind or _compression(path)
+    if kind is None:
+        return open(path, "rb")
+    return io.BufferedReader(_CompressedFile(path, kind), buffer_size=1 << 20)
+
+
+def _capture_seekable(path: str):
+    """Check if a reader can start in the middle of a capture without
+    decompressing everything before that point
+    """
+    kind = _compression(path)
+    if kind is None:
+        return True
+    with _CompressedFile(path, kind) as fh:
+        return fh.seekable_frames
+
+
+def _open_records(path: str, state=None, offset: int = None, buffer=None):
+    """Get a record reader for a capture. Uncompressed captures are memory
+    mapped, compressed ones are streamed. buffer is a mapping of the capture
+    from `_capture_buffer` to read instead of mapping it again.
+    """
+    kind = _compression(path)
+    if kind is None:
+        return _MappedRecordReader(path, state, offset, buffer)
+    return _RecordReader(_open_capture(path, kind), state, offset)
+
+
+class _CaptureSlices:
+    """Byte slices of a compressed capture by uncompressed offset, for
+    the places that slice the memory map of an uncompressed one
+    """
+
+    def __init__(self, path: str):
+        self.fh = _open_capture(path)
+
+    def __getitem__(self, key: slice):
+        self.fh.seek(key.start)
+        return self.fh.read(key.stop - key.start)
+
+
+def _capture_buffer(path: str):
+    if _compression(path) is None:
+        return _MappedRecordReader(path).buffer
+    return _CaptureSlices(path)
+
+
+def _close_buffers(buffers: dict):
+    """Close the buffers from `_capture_buffer` in a dict of paths, and empty
+    it. A memory map that is still used by a reader or a record slice, for
+    example in a lazy generator, is closed by Python once the last of them
+    is freed, and so is the file of a compressed capture.
+    """
+    mappings = [b.obj for b in buffers.values() if isinstance(b, memoryview)]
+    # the views are not released, so readers that still hold one keep working
+    buffers.clear()
+    for mapping in mappings:
+        try:
+            mapping.close()
+        except BufferError:
+            pass
+
+
+def _tcpdump_records(path: str, bpf_filter: str):
+    """Records of a capture that match a filter tcpdump has to evaluate.
+    Compressed captures are decompressed into the stdin of tcpdump.
+    """
+    if _compression(path) is None:
+        with scapy.tcpdump(path, args=["-w", "-", bpf_filter], getfd=True) as fh:
+            yield from _RecordReader(fh)
+        return
+    source = _open_capture(path)
+    proc = subprocess.Popen(
+        [scapy.conf.prog.tcpdump, "-r", "-", "-w", "-", bpf_filter],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+    def feed():
+        # tcpdump writes while it reads, so stdin is fed from a thread
+        try:
+            shutil.copyfileobj(source, proc.stdin, 1 << 20)
+            proc.stdin.close()
+        except BrokenPipeError:  # pragma: no cover
+            pass
+        finally:
+            source.close()
+
+    threading.Thread(target=feed, daemon=True).start()
+    with proc.stdout as fh:
+        yield from _RecordReader(fh)
+    proc.wait()
+
+
+def _split_records(
+    path: str, parts: int, state=None, start: int = None, end=None, buffer=None
+):
+    """Split a capture, or the byte range of it that starts at a reader
+    state and offset, into about `parts` byte ranges that start on record
+    boundaries.
+
+    Returns:
+        list: ``(state, start, end)`` tuples that `_RecordReader` can resume
+        from. The end of the last range is end, which is None for the end of
+        the file.
+    """
+    reader = _open_records(path, state, start, buffer)
+    state, start = reader.state(), reader.offset
+    if isinstance(reader, _MappedRecordReader):
+        size = len(reader.buffer)
+    else:
+        size = reader.fh.raw.size
+    step = max(((end or size) - start) // parts, 1)
+    chunks = []
+    boundary = start + step
+    for offset in reader.scan():
+        if end is not None and offset >= end:
+            break
+        if offset >= boundary:
+            chunks.append((state, start, offset))
+            state, start = reader.state(), offset
+            boundary = offset + step
+    chunks.append((state, start, end))
+    return chunks
+
+
+class _TimeIndex:
+    """Sparse timestamp to file offset index of a capture. Every `every`
+    records a checkpoint keeps the reader state and offset, and the lowest
+    and highest timestamps of the records up to the next checkpoint, so
+    captures that are not strictly in time order are still read in full
+    for a window.
+    """
+
+    every = 1024
+
+    def __init__(self, path: str, buffer=None):
+        self.path = path
+        #: ``[state, offset, low, high]`` per checkpoint
+        self.checkpoints = []
+        reader = _open_records(path, buffer=buffer)
+        records = reader.records()
+        count = 0
+        checkpoint = None
+        while True:
+            state, offset = reader.state(), reader.offset
+            record = next(records, None)
+            if record is None:
+                break
+            if count % self.every == 0:
+                checkpoint = [state, offset, None, None]
+                self.checkpoints.append(checkpoint)
+            count += 1
+            timestamp = record[1]
+            if timestamp is None:  # pragma: no cover
+                continue
+            if checkpoint[2] is None or timestamp < checkpoint[2]:
+                checkpoint[2] = timestamp
+            if checkpoint[3] is None or timestamp > checkpoint[3]:
+                checkpoint[3] = timestamp
+
+    def range(self, start_time=None, end_time=None):
+        """Get the ``(state, start, end)`` byte range that holds every record
+        in the window. end is None for the end of the file. Returns None if
+        no record can be in the window.
+        """
+        checkpoints = self.checkpoints
+        first = 0
+        if start_time is not None:
+            # skip checkpoints where every record is before the window
+            while first < len(checkpoints) and (
+                checkpoints[first][3] is not None and checkpoints[first][3] < start_time
+            ):
+                first += 1
+        if first == len(checkpoints):
+            return None
+        end = None
+        if end_time is not None:
+            # stop at the first checkpoint after which every record is past
+            # the window
+            low = None
+            for checkpoint in reversed(checkpoints[first:]):
+                if checkpoint[2] is not None:
+                    low = checkpoint[2] if low is None else min(low, checkpoint[2])
+                if low is None or low < end_time:
+                    break
+                end = checkpoint[1]
+            if end == checkpoints[first][1]:
+                return None
+        state, start = checkpoints[first][:2]
+        return state, start, end
+
+
+def _pcap_time(value):
+    """Convert epoch seconds, a datetime or an ISO 8601 string to epoch seconds"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    raise TypeError(
+        "Valid times are epoch seconds, datetime objects and ISO 8601 strings"
+    )
+
+
+def _record_time(record):
+    timestamp = record[1]
+    return float("-inf") if timestamp is None else timestamp
+
+
+def _window_records(records, window):
+    """Only keep the records with a timestamp in ``[start, end)``"""
+    start_time, end_time = window
+    for record in records:
+        timestamp = record[1]
+        if timestamp is None:  # pragma: no cover
+            continue
+        if start_time is not None and timestamp < start_time:
+            continue
+        if end_time is not None and timestamp >= end_time:
+            continue
+        yield record
+
+
+class _Follower:
+    """Read the records that were appended to a growing capture since the
+    last read. The reader state and offset after the last complete record
+    are kept between reads, so a record that is still being written is
+    read again once it is complete.
+    """
+
+    #: seconds to wait between looking for new records
+    interval = 0.2
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state = None
+        self.offset = None
+
+    def records(self, timeout: float = 0):
+        """Yield the new records. At the end of the file, wait up to timeout
+        seconds for more records before stopping. The wait starts over
+        whenever new records are found.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            for record in self._read():
+                deadline = time.monotonic() + timeout
+                yield record
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(self.interval)
+
+    def _read(self):
+        with open(self.path, "rb", buffering=1 << 20) as fh:
+            if self.state is None:
+                # the file header may not be written yet
+                if len(fh.read(24)) < 24:
+                    return
+                fh.seek(0)
+                reader = _RecordReader(fh)
+            else:
+                reader = _RecordReader(fh, self.state, self.offset)
+            for record in reader.records():
+                self.state, self.offset = reader.state(), reader.offset
+                yield record
+
+
+def _dissect(linktype, data, timestamp=None):
+    """Dissect a raw record with scapy the same way `scapy.PcapReader` does"""
+    cls = scapy.conf.l2types.get(linktype, scapy.conf.raw_layer)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    try:
+        packet = cls(data)
+    except Exception:  # pragma: no cover
+        packet = scapy.conf.raw_layer(data)
+    if timestamp is not None:
+        packet.time = timestamp
+    return packet
+
+
+class _Flow:
+    """Packet and byte counters of a flow in a `_FlowTable`"""
+
+    __slots__ = ("key", "reverse", "packets", "bytes", "first", "last", "fins")
+
+    def __init__(self, key, reverse: bool, timestamp):
+        self.key = key
+        #: True if the first packet was sent from the hi side of the key
+        self.reverse = reverse
+        self.packets = 0
+        self.bytes = 0
+        self.first = timestamp
+        self.last = timestamp
+        #: 1 once the lo side sent a TCP FIN, 2 once the hi side did
+        self.fins = 0
+
+
+class _FlowTable:
+    """Bidirectional flows keyed by ``(proto, lo_ip, lo_port, hi_ip, hi_port)``
+    where the lo side is the smaller of the packed address and port pairs, so
+    both directions of a conversation map to the same key. Flows are kept in
+    the order they are first seen.
+
+    An evicting table only keeps the flows that are open, in the order they
+    were last seen. Flows are forgotten once they are closed, or once no
+    packet was seen for them in `timeout` seconds of capture time, and the
+    idle ones are collected in `expired` for the caller. A packet of a
+    forgotten flow starts a new flow.
+    """
+
+    protocols = {1: "ICMP", 6: "TCP", 17: "UDP", 58: "ICMPv6", 132: "SCTP"}
+    #: seconds of capture time after which an evicting table forgets an idle
+    #: flow
+    timeout = 300
+
+    def __init__(self, evict: bool = False):
+        self.flows = collections.OrderedDict() if evict else {}
+        self.evict = evict
+        #: idle flows that an evicting table forgot since the caller last
+        #: took them with `take_expired`
+        self.expired = []
+        #: latest timestamp seen by an evicting table
+        self.now = None
+        self.decoder = _FastDecoder()
+
+    def __getstate__(self):
+        return (self.flows,)
+
+    def __setstate__(self, state):
+        self.flows = state[0]
+        self.evict = False
+        self.expired = []
+        self.now = None
+        self.decoder = _FastDecoder()
+
+    def decode(self, linktype, data):
+        """Decode the headers of a record. Records with a link layer that
+        `_FastDecoder` does not support, and IP records whose transport ports
+        it could not find, such as IPv6 records with extension headers, are
+        dissected by scapy, and the packet is returned with the headers.
+        """
+        headers = self.decoder.decode(linktype, data)
+        if headers is not None and (
+            headers.exact or headers.sport is not None or headers.proto in (None, 1, 58)
+        ):
+            return headers, None
+        packet = _dissect(linktype, data)
+        headers = self.decoder.from_packet(packet)
+        if scapy.TCP in packet:
+            headers = headers._replace(proto=6)
+        elif scapy.UDP in packet:
+            headers = headers._replace(proto=17)
+        return headers, packet
+
+    def add(self, timestamp, wirelen: int, headers):
+        """Count a packet against its flow. Returns None if the packet is not
+        an IP packet.
+        """
+        proto = headers.proto
+        if proto is None or headers.src is None or headers.dst is None:
+            return None
+        src, sport, dst, dport = headers.src, headers.sport, headers.dst, headers.dport
+        forward = (src, sport or 0) <= (dst, dport or 0)
+        if forward:
+            key = (proto, src, sport, dst, dport)
+        else:
+            key = (proto, dst, dport, src, sport)
+        if self.evict:
+            self._expire(timestamp)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = _Flow(key, not forward, timestamp)
+        elif self.evict:
+            self.flows.move_to_end(key)
+        flow.packets += 1
+        flow.bytes += wirelen
+        if timestamp < flow.first:
+            flow.first = timestamp
+        if timestamp > flow.last:
+            flow.last = timestamp
+        return flow
+
+    def _expire(self, timestamp):
+        """Forget the flows that were idle for longer than the timeout. The
+        least recently seen flows come first, so only those are looked at.
+        """
+        if self.now is None or timestamp > self.now:
+            self.now = timestamp
+        while self.flows:
+            flow = next(iter(self.flows.values()))
+            if self.now - flow.last <= self.timeout:
+                break
+            del self.flows[flow.key]
+            self.expired.append(flow)
+
+    def take_expired(self):
+        """Get the idle flows that were forgotten since the last call"""
+        expired, self.expired = self.expired, []
+        return expired
+
+    def close(self, flow):
+        """Forget a flow whose connection is closed"""
+        if self.flows.get(flow.key) is flow:
+            del self.flows[flow.key]
+
+    def tcp_flags(self, flow, headers, flags: int):
+        """Follow the FIN and RST flags of a TCP flow, and forget the flow
+        once it is reset or both sides sent a FIN. Returns True if the flow
+        was closed.
+        """
+        if flags & 0x04:
+            self.close(flow)
+            return True
+        if flags & 0x01:
+            lo_side = (headers.src, headers.sport) == flow.key[1:3]
+            flow.fins |= 1 if lo_side else 2
+            if flow.fins == 3:
+                self.close(flow)
+                return True
+        return False
+
+    def extend(self, other):
+        """Merge the flows of a table built over a later part of the pcap"""
+        for key, flow in other.flows.items():
+            mine = self.flows.get(key)
+            if mine is None:
+                self.flows[key] = flow
+                continue
+            mine.packets += flow.packets
+            mine.bytes += flow.bytes
+            mine.first = min(mine.first, flow.first)
+            mine.last = max(mine.last, flow.last)
+
+    def to_list(self):
+        hold = []
+        for flow in self.flows.values():
+            proto, src, sport, dst, dport = flow.key
+            if flow.reverse:
+                src, sport, dst, dport = dst, dport, src, sport
+            hold.append(
+                {
+                    "proto": self.protocols.get(proto, proto),
+                    "src": _ntop(src),
+                    "sport": sport,
+                    "dst": _ntop(dst),
+                    "dport": dport,
+                    "packets": flow.packets,
+                    "bytes": flow.bytes,
+                    "first": flow.first,
+                    "last": flow.last,
+                }
+            )
+        return hold
+
+
+def _ntop(address: bytes):
+    family = socket.AF_INET if len(address) == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, address)
+
+
+_PLAIN_TYPES = (int, float, str, bytes, bool, list, tuple, set, dict, type(None))
+_LAYER_CONVERTERS = {}
+
+
+def _layer_converter(cls):
+    """Build the dict converter of a layer class. The fields of a class never
+    change, so what `getattr(layer, name)` would do for each field is worked
+    out once: fields are read straight from the field dicts of the layer, and
+    `i2h` is only called for fields that override it.
+    """
+    if not getattr(cls, "fields_desc", None):
+        return None
+    plain = set(_PLAIN_TYPES)
+    fields = []
+    for f in cls.fields_desc:
+        if hasattr(cls, f.name):
+            # a field shadowed by a class attribute, so go through getattr
+            fields.append((f.name, None, True))
+        elif getattr(type(f), "i2h", None) is scapy.Field.i2h:
+            fields.append((f.name, None, False))
+        else:
+            fields.append((f.name, f.i2h, False))
+    fields = tuple(fields)
+
+    def convert(obj):
+        d = {}
+        values = obj.fields
+        overloaded = obj.overloaded_fields
+        defaults = obj.default_fields
+        for key, i2h, shadowed in fields:
+            if key in values:
+                value = values[key]
+            elif key in overloaded:
+                value = overloaded[key]
+            elif key in defaults and not shadowed:
+                value = defaults[key]
+            else:
+                shadowed = True
+            if shadowed:
+                value = getattr(obj, key)
+            elif i2h is not None and not isinstance(value, scapy.RawVal):
+                value = i2h(obj, value)
+            if value is type(None):  # pragma: no cover
+                value = None
+
+            if type(value) not in plain and not isinstance(value, _PLAIN_TYPES):
+                value = _layer2dict(value)
+            d[key] = value
+        return {obj.name: d}
+
+    return convert
+
+
+def _layer2dict(obj):
+    cls = type(obj)
+    try:
+        convert = _LAYER_CONVERTERS[cls]
+    except KeyError:
+        convert = _LAYER_CONVERTERS[cls] = _layer_converter(cls)
+    if convert is None:
+        return
+    return convert(obj)
+
+
+def _iter_layers(packet):
+    """Iterate over the layers of a packet in the order of
+    `packet.getlayer(index)`, which visits packets held in fields, such as
+    DNS records, before the payload.
+    """
+    while packet:
+        yield packet
+        for f in packet.packetfields:
+            value = packet.getfieldval(f.name)
+            if value is None:
+                continue
+            for value in value if f.islist else [value]:
+                if isinstance(value, scapy.Packet):
+                    yield from _iter_layers(value)
+        packet = packet.payload
+
+
+class _Pkt2Dict:
+    def __init__(self, pkt):
+        self.pkt = pkt
+
+    def to_dict(self):
+        """
+        Turn every layer to dict, store in ChainMap type.
+        `Reference <https://github.com/littlezz/scapy2dict>`__
+        """
+        d = [_layer2dict(layer) for layer in _iter_layers(self.pkt)]
+        return dict(**collections.ChainMap(*list(filter(lambda x: x is not None, d))))
+
+
+_FastHeaders = collections.namedtuple(
+    "_FastHeaders",
+    [
+        "layers",
+        "ethertype",
+        "vlan",
+        "src",
+        "dst",
+        "proto",
+        "sport",
+        "dport",
+        "payload",
+        "exact",
+        "l4",
+    ],
+    defaults=(None,),
+)
+
+
+class _FastDecoder:
+    """Decode Ethernet, 802.1Q, ARP, IPv4, IPv6, TCP, UDP and ICMP headers of a
+    raw record with struct instead of scapy.
+
+    The addresses, protocol and ports are filled in whenever the headers can
+    be read. The layer stack and payload are only `exact` when scapy would
+    dissect the record into the same plain header stack followed by Raw. That
+    is not the case for fragments, IPv6 extension headers, ICMP errors or
+    payloads on ports that scapy binds an application layer to, and callers
+    fall back to scapy for those records.
+    """
+
+    names = {
+        "Ether": "Ethernet",
+        "Dot1Q": "802.1Q",
+        "ARP": "ARP",
+        "IP": "IP",
+        "IPv6": "IPv6",
+        "TCP": "TCP",
+        "UDP": "UDP",
+        "ICMP": "ICMP",
+        "Raw": "Raw",
+        "Padding": "Padding",
+    }
+
+    _u16 = struct.Struct("!H")
+    _ipv4 = struct.Struct("!BxHxxHxB2x4s4s")
+    _ipv6 = struct.Struct("!4xHBx16s16s")
+    _ports = struct.Struct("!HH")
+    _udp = struct.Struct("!HHH")
+
+    def __init__(self):
+        # scapy only binds application layers to tcp and udp by port, so any
+        # port that shows up in a binding has to go through scapy
+        self.bound_ports = {}
+        for proto in ("TCP", "UDP"):
+            ports = set()
+            for fields, _ in getattr(scapy, proto).payload_guess:
+                ports.update(v for k, v in fields.items() if k in ("sport", "dport"))
+            self.bound_ports[proto] = ports
+
+    def has_layer(self, headers, layer: str):
+        return any(layer in (name, self.names[name]) for name in headers.layers)
+
+    def decode(self, linktype, data):
+        """Decode the headers of a raw record. Returns None if the link layer
+        is not supported or the record is too short to read.
+        """
+        end = len(data)
+        layers = []
+        vlan = None
+        if linktype == 1:
+            if end < 14:
+                return None
+            layers.append("Ether")
+            ethertype = self._u16.unpack_from(data, 12)[0]
+            offset = 14
+            if ethertype == 0x8100:
+                if end < 18:
+                    return None
+                layers.append("Dot1Q")
+                vlan = self._u16.unpack_from(data, 14)[0] & 0xFFF
+                ethertype = self._u16.unpack_from(data, 16)[0]
+                offset = 18
+        elif linktype in (101, 228, 229) and end:
+            if linktype == 228 or (linktype == 101 and data[0] >> 4 != 6):
+                ethertype = 0x0800
+            else:
+                ethertype = 0x86DD
+            offset = 0
+        else:
+            return None
+
+        if ethertype == 0x0800:
+            if end - offset < 20:
+                return None
+            vihl, total, frag, proto, src, dst = self._ipv4.unpack_from(data, offset)
+            ihl = (vihl & 0xF) * 4
+            if vihl >> 4 != 4 or ihl < 20 or total < ihl or offset + ihl > end:
+                return None
+            layers.append("IP")
+            if frag & 0x1FFF:
+                return _FastHeaders(
+                    tuple(layers),
+                    ethertype,
+                    vlan,
+                    src,
+                    dst,
+                    proto,
+                    None,
+                    None,
+                    None,
+                    False,
                 )
+            ip_end = offset + total
+            offset += ihl
+        elif ethertype == 0x86DD:
+            if end - offset < 40 or data[offset] >> 4 != 6:
+                return None
+            plen, proto, src, dst = self._ipv6.unpack_from(data, offset)
+            layers.append("IPv6")
+            offset += 40
+            ip_end = offset + plen if plen else end
+        elif ethertype == 0x0806 and end - offset >= 8:
+            layers.append("ARP")
+            hlen, plen = data[offset + 4], data[offset + 5]
+            spa = offset + 8 + hlen
+            tpa = spa + plen + hlen
+            return _FastHeaders(
+                tuple(layers),
+                ethertype,
+                vlan,
+                data[spa : spa + plen],
+                data[tpa : tpa + plen],
+                None,
+                None,
+                None,
+                None,
+                False,
+            )
+        else:
+            return _FastHeaders(
+                tuple(layers),
+                ethertype,
+                vlan,
+                None,
+                None,
+                None,
+                None,
+                None,
+                None,
+                False,
+            )
+        seg_end = min(ip_end, end)
+
+        sport = dport = None
+        exact = bool(plen) if ethertype == 0x86DD else True
+        if proto == 6:
+            if seg_end - offset >= 4:
+                sport, dport = self._ports.unpack_from(data, offset)
+            dataofs = (data[offset + 12] >> 4) * 4 if seg_end - offset >= 20 else 0
+            if dataofs < 20 or offset + dataofs > seg_end:
+                exact = False
+                dataofs = 0
+            layers.append("TCP")
+            start, stop, bound = offset + dataofs, seg_end, self.bound_ports["TCP"]
+        elif proto == 17:
+            ulen = 0
+            if seg_end - offset >= 8:
+                sport, dport, ulen = self._udp.unpack_from(data, offset)
+            if ulen < 8:
+                exact = False
+            layers.append("UDP")
+            start, stop = offset + 8, min(offset + ulen, seg_end)
+            bound = self.bound_ports["UDP"]
+        elif proto == 1 and layers[-1] == "IP":
+            if seg_end - offset < 8 or data[offset] not in (0, 8):
+                exact = False
+            layers.append("ICMP")
+            start, stop, bound = offset + 8, seg_end, ()
+        else:
+            return _FastHeaders(
+                tuple(layers), ethertype, vlan, src, dst, proto, None, None, None, False
+            )
+
+        payload = None
+        if exact and start < stop:
+            if sport in bound or dport in bound:
+                exact = False
+            layers.append("Raw")
+            payload = (start, stop)
+        if stop < seg_end:
+            layers.append("Padding")
+        if seg_end < end:
+            layers.append("Padding")
+        return _FastHeaders(
+            tuple(layers),
+            ethertype,
+            vlan,
+            src,
+            dst,
+            proto,
+            sport,
+            dport,
+            payload,
+            exact,
+            offset,
+        )
+
+    def from_packet(self, packet):
+        """Get the same header fields as `decode` from a scapy packet. Used
+        for link layers that `decode` does not support.
+        """
+        ethertype = vlan = src = dst = proto = sport = dport = None
+        if scapy.Dot1Q in packet:
+            vlan = packet[scapy.Dot1Q].vlan
+        if scapy.IP in packet:
+            ip, ethertype, family = packet[scapy.IP], 0x0800, socket.AF_INET
+            proto = ip.proto
+        elif scapy.IPv6 in packet:
+            ip, ethertype, family = packet[scapy.IPv6], 0x86DD, socket.AF_INET6
+            proto = ip.nh
+        elif scapy.ARP in packet:
+            ip, ethertype, family = packet[scapy.ARP], 0x0806, socket.AF_INET
+        else:
+            return _FastHeaders(
+                (), None, vlan, None, None, None, None, None, None, False
+            )
+        try:
+            if ethertype == 0x0806:
+                src = socket.inet_pton(family, ip.psrc)
+                dst = socket.inet_pton(family, ip.pdst)
             else:
-                sess = str(
-                    sorted(
-                        ["IP", p[scapy.IP].src, p[scapy.IP].dst, p[scapy.IP].proto],
-                        key=str,
-                    )
+                src = socket.inet_pton(family, ip.src)
+                dst = socket.inet_pton(family, ip.dst)
+        except (OSError, TypeError):  # pragma: no cover
+            pass
+        if scapy.TCP in packet or scapy.UDP in packet:
+            l4 = packet[scapy.TCP] if scapy.TCP in packet else packet[scapy.UDP]
+            sport, dport = l4.sport, l4.dport
+        return _FastHeaders(
+            (), ethertype, vlan, src, dst, proto, sport, dport, None, False
+        )
+
+
+class _BpfUnsupported(Exception):
+    """Raised for BPF filters that `_BpfFilter` can not evaluate"""
+
+
+class _BpfFilter:
+    """Evaluate the common subset of the pcap-filter(7) syntax in process,
+    against the header fields decoded by `_FastDecoder`.
+
+    Supported are the host, net, port and portrange primitives with src/dst
+    and ip/ip6/arp/tcp/udp qualifiers, the ip, ip6, arp, rarp, tcp, udp,
+    sctp, icmp and icmp6 protocol primitives, ``[ip|ip6] proto``, ``vlan``,
+    and combining them with and/or/not and parentheses. Like tcpdump,
+    and/or have equal precedence and associate left to right, and an id
+    without qualifiers reuses the qualifiers of the previous primitive.
+    Anything else raises `_BpfUnsupported`.
+    """
+
+    _ethertypes = {"ip": 0x0800, "ip6": 0x86DD, "arp": 0x0806, "rarp": 0x8035}
+    _protos = {
+        "icmp": 1,
+        "igmp": 2,
+        "tcp": 6,
+        "udp": 17,
+        "gre": 47,
+        "esp": 50,
+        "ah": 51,
+        "icmp6": 58,
+        "sctp": 132,
+    }
+    _token_pattern = re.compile(r"\(|\)|&&|\|\||!|[^\s()!]+")
+
+    def __init__(self, expression: str):
+        self.decoder = _FastDecoder()
+        self._tokens = self._token_pattern.findall(expression)
+        self._pos = 0
+        self._last = None
+        self._vlan = False
+        if not self._tokens:
+            raise _BpfUnsupported(expression)
+        self.predicate = self._expression()
+        if self._pos != len(self._tokens):
+            raise _BpfUnsupported(expression)
+
+    def match(self, linktype, data):
+        headers = self.decoder.decode(linktype, data)
+        if headers is None:
+            headers = self.decoder.from_packet(_dissect(linktype, data))
+        return self.predicate(headers)
+
+    def _peek(self, ahead: int = 0):
+        pos = self._pos + ahead
+        return self._tokens[pos] if pos < len(self._tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise _BpfUnsupported("Unexpected end of filter")
+        self._pos += 1
+        return token
+
+    def _expression(self):
+        predicate = self._unary()
+        while self._peek() in ("and", "&&", "or", "||"):
+            op = self._next()
+            left, right = predicate, self._unary()
+            if op in ("and", "&&"):
+                predicate = lambda h, l=left, r=right: l(h) and r(h)
+            else:
+                predicate = lambda h, l=left, r=right: l(h) or r(h)
+        return predicate
+
+    def _unary(self):
+        token = self._peek()
+        if token in ("not", "!"):
+            self._next()
+            inner = self._unary()
+            return lambda h: not inner(h)
+        if token == "(":
+            self._next()
+            predicate = self._expression()
+            if self._next() != ")":
+                raise _BpfUnsupported("Unbalanced parentheses")
+            return predicate
+        return self._primitive()
+
+    def _primitive(self):
+        if self._peek() == "vlan":
+            return self._vlan_primitive()
+
+        proto = direction = kind = None
+        if self._peek() in self._ethertypes or self._peek() in self._protos:
+            proto = self._next()
+        if self._peek() in ("src", "dst"):
+            direction = self._next()
+            if self._peek() in ("or", "and") and self._peek(1) in ("src", "dst"):
+                direction = "{} {} {}".format(direction, self._next(), self._next())
+        if self._peek() in ("host", "net", "port", "portrange", "proto"):
+            kind = self._next()
+
+        if kind is None and direction is None:
+            if proto is not None:
+                return self._gate(self._proto_primitive(proto))
+            if self._last is None:
+                proto, direction, kind = None, None, "host"
+            else:
+                proto, direction, kind = self._last
+        kind = kind or "host"
+        self._last = (proto, direction, kind)
+        value = self._next()
+
+        if kind == "proto":
+            return self._gate(self._ip_proto(proto, value))
+        if kind in ("host", "net"):
+            if proto not in (None, "ip", "ip6", "arp", "rarp"):
+                raise _BpfUnsupported("{} {}".format(proto, kind))
+            size, mask, net = self._network(value, kind)
+            predicate = self._address(direction, size, mask, net)
+        else:
+            if proto not in (None, "ip", "ip6", "tcp", "udp", "sctp"):
+                raise _BpfUnsupported("{} {}".format(proto, kind))
+            low, high = self._ports(value, kind)
+            predicate = self._port(direction, low, high, proto)
+        if proto in self._ethertypes:
+            ethertype = self._ethertypes[proto]
+            inner = predicate
+            predicate = lambda h: h.ethertype == ethertype and inner(h)
+        elif proto is None and kind in ("host", "net"):
+            inner = predicate
+            predicate = lambda h: h.ethertype in (0x0800, 0x86DD, 0x0806) and inner(h)
+        return self._gate(predicate)
+
+    def _gate(self, predicate):
+        """Primitives after a vlan primitive only match tagged packets, and
+        primitives before it only match untagged packets, like tcpdump.
+        """
+        if self._vlan:
+            return lambda h: h.vlan is not None and predicate(h)
+        return lambda h: h.vlan is None and predicate(h)
+
+    def _vlan_primitive(self):
+        self._next()
+        if self._vlan:
+            raise _BpfUnsupported("Nested vlan")
+        self._vlan = True
+        token = self._peek()
+        if token is not None and token.isdigit():
+            vlan = int(self._next())
+            return lambda h: h.vlan == vlan
+        return lambda h: h.vlan is not None
+
+    def _proto_primitive(self, proto: str):
+        if proto in self._ethertypes:
+            ethertype = self._ethertypes[proto]
+            return lambda h: h.ethertype == ethertype
+        number = self._protos[proto]
+        if proto == "icmp":
+            return lambda h: h.ethertype == 0x0800 and h.proto == number
+        if proto == "icmp6":
+            return lambda h: h.ethertype == 0x86DD and h.proto == number
+        return lambda h: h.ethertype in (0x0800, 0x86DD) and h.proto == number
+
+    def _ip_proto(self, proto: str, value: str):
+        value = value.lstrip("\\")
+        number = int(value) if value.isdigit() else self._protos.get(value)
+        if number is None:
+            raise _BpfUnsupported("proto {}".format(value))
+        if proto in ("ip", "ip6"):
+            ethertype = self._ethertypes[proto]
+            return lambda h: h.ethertype == ethertype and h.proto == number
+        if proto is not None:
+            raise _BpfUnsupported("{} proto".format(proto))
+        return lambda h: h.ethertype in (0x0800, 0x86DD) and h.proto == number
+
+    def _network(self, value: str, kind: str):
+        """Get the address size, mask and masked network of a host or net"""
+        prefix = None
+        if kind == "net" and "/" in value:
+            value, prefix = value.split("/", 1)
+            if not prefix.isdigit():
+                raise _BpfUnsupported(value)
+            prefix = int(prefix)
+        family = socket.AF_INET6 if ":" in value else socket.AF_INET
+        if kind == "net" and family == socket.AF_INET and value.count(".") < 3:
+            # abbreviated networks like 10.1 are 10.1.0.0/16
+            octets = value.split(".")
+            if prefix is None:
+                prefix = 8 * len(octets)
+            value = ".".join(octets + ["0"] * (4 - len(octets)))
+        try:
+            packed = socket.inet_pton(family, value)
+        except (OSError, ValueError):
+            # host names would need a dns lookup
+            raise _BpfUnsupported(value)
+        size = len(packed)
+        if kind == "net" and self._peek() == "mask":
+            self._next()
+            try:
+                mask = int.from_bytes(socket.inet_pton(family, self._next()), "big")
+            except (OSError, ValueError):
+                raise _BpfUnsupported("mask")
+        else:
+            prefix = size * 8 if prefix is None else prefix
+            mask = ((1 << prefix) - 1) << (size * 8 - prefix)
+        return size, mask, int.from_bytes(packed, "big") & mask
+
+    def _address(self, direction, size, mask, net):
+        def check(addr):
+            return (
+                addr is not None
+                and len(addr) == size
+                and int.from_bytes(addr, "big") & mask == net
+            )
+
+        if direction == "src":
+            return lambda h: check(h.src)
+        if direction == "dst":
+            return lambda h: check(h.dst)
+        if direction == "src and dst":
+            return lambda h: check(h.src) and check(h.dst)
+        return lambda h: check(h.src) or check(h.dst)
+
+    def _ports(self, value: str, kind: str):
+        if kind == "portrange":
+            low, sep, high = value.partition("-")
+            if not sep:
+                raise _BpfUnsupported(value)
+            return self._port_number(low), self._port_number(high)
+        port = self._port_number(value)
+        return port, port
+
+    def _port_number(self, value: str):
+        if value.isdigit():
+            return int(value)
+        for proto in ("tcp", "udp"):
+            try:
+                return socket.getservbyname(value, proto)
+            except OSError:
+                continue
+        raise _BpfUnsupported(value)
+
+    def _port(self, direction, low, high, proto):
+        if proto in ("tcp", "udp", "sctp"):
+            protos = (self._protos[proto],)
+        else:
+            protos = (6, 17, 132)
+
+        def check(port):
+            return port is not None and low <= port <= high
+
+        if direction == "src":
+            ports = lambda h: check(h.sport)
+        elif direction == "dst":
+            ports = lambda h: check(h.dport)
+        elif direction == "src and dst":
+            ports = lambda h: check(h.sport) and check(h.dport)
+        else:
+            ports = lambda h: check(h.sport) or check(h.dport)
+        return lambda h: h.proto in protos and ports(h)
+
+
+def _scapy_layers():
+    """The scapy version and a digest of the scapy layer modules that are
+    loaded, which decide how packets are dissected. That is the modules scapy
+    is set up to load and any other ``scapy.layers`` module that was
+    imported, such as scapy.layers.http, which binds HTTP to the HTTP ports.
+    contrib modules are left out, as scapy imports some of them lazily while
+    dissecting, so the key is the same before and after a capture has been
+    read.
+    """
+    modules = set(scapy.conf.load_layers)
+    modules.update(
+        name[len("scapy.layers.") :]
+        for name in list(sys.modules)
+        if name.startswith("scapy.layers.") and name.count(".") == 2
+    )
+    digest = hashlib.blake2b("\n".join(sorted(modules)).encode(), digest_size=8)
+    return "{} {}".format(scapy.conf.version, digest.hexdigest())
+
+
+class _IndexEntry:
+    """A single packet in a `_PacketIndex`"""
+
+    __slots__ = (
+        "offset",
+        "time",
+        "length",
+        "layers",
+        "nested",
+        "payload",
+        "convo",
+        "source",
+    )
+
+    def __init__(
+        self, offset, time, length, layers, payload, convo=None, nested=(), source=0
+    ):
+        self.offset = offset
+        self.time = time
+        self.length = length
+        self.layers = layers
+        #: layers held in the fields of the packet, such as IP options or DNS
+        #: records, which scapy haslayer also finds
+        self.nested = nested
+        self.payload = payload
+        #: src, layer name and dst of the packet as `_layer3_convos` sees it
+        self.convo = convo
+        #: position of the file of the entry in `_PacketIndex.paths`
+        self.source = source
+
+
+class _PacketIndex:
+    """Packet index of a capture that is built with a single scapy pass.
+
+    Every packet keeps its data offset, timestamp, layer stack, the layers
+    held in its fields, its layer 3 conversation and the position of its raw
+    payload, which is enough for `pcap_payload`, `pcap_payload_offset`,
+    `pcap_layer_stats` and `pcap_convos` to answer without dissecting the
+    capture again.
+    """
+
+    version = 3
+
+    def __init__(self, path: str):
+        self.path = path
+        self.paths = [path]
+        self.entries = []
+        #: scapy layer class name to layer display name
+        self.names = {}
+        # layer stacks repeat, so every entry shares one tuple per stack
+        self._stacks = {}
+
+    @classmethod
+    def build(cls, path: str, buffer=None):
+        index = cls(path)
+        records = _open_records(path, buffer=buffer)
+        for offset, timestamp, linktype, wirelen, data in records:
+            index.add(offset, timestamp, wirelen, _dissect(linktype, data), data)
+        return index
+
+    def add(self, offset, timestamp, wirelen, packet, data):
+        layers = []
+        payload = None
+        layer = packet
+        while layer:
+            name = type(layer).__name__
+            if name not in self.names:
+                self.names[sys.intern(name)] = layer.name
+            layers.append(name)
+            if payload is None and type(layer) is scapy.Raw:
+                start = len(data) - len(bytes(layer))
+                end = start + len(layer.load)
+                if data[start:end] == layer.load:
+                    payload = (start, end)
+                else:  # pragma: no cover
+                    payload = bytes(layer.load)
+            layer = layer.payload
+        layers = tuple(layers)
+        layers = self._stacks.setdefault(layers, layers)
+        nested = []
+        self._field_layers(packet, nested)
+        nested = tuple(dict.fromkeys(nested))
+        nested = self._stacks.setdefault(nested, nested)
+        # getlayer also counts layers held in fields, such as IP options
+        convo = None
+        if scapy.IP in packet and packet.getlayer(2) is not None:
+            ip_layer = packet.getlayer(scapy.IP)
+            convo = (ip_layer.src, packet.getlayer(2).name, ip_layer.dst)
+        self.entries.append(
+            _IndexEntry(offset, timestamp, wirelen, layers, payload, convo, nested)
+        )
+
+    def _field_layers(self, packet, found: list, nested: bool = False):
+        """Collect the class names of the layers in the packet fields of a
+        packet and its payloads, the same places scapy haslayer looks in
+        """
+        layer = packet
+        while layer:
+            if nested:
+                name = type(layer).__name__
+                if name not in self.names:
+                    self.names[sys.intern(name)] = layer.name
+                found.append(name)
+            for field in layer.packetfields:
+                value = layer.getfieldval(field.name)
+                if value is None:
+                    continue
+                for item in value if field.islist else [value]:
+                    if isinstance(item, scapy.Packet):
+                        self._field_layers(item, found, True)
+            layer = layer.payload
+
+    @staticmethod
+    def file_key(path: str):
+        """The path, size, mtime and content hash that a sidecar is valid for,
+        along with the scapy that dissected it. It is computed once per read,
+        and checked against the key stored in the sidecar.
+        """
+        stat = os.stat(path)
+        h = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+        return {
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": h.hexdigest(),
+            # the layers scapy dissects into depend on the loaded layer modules
+            "scapy": _scapy_layers(),
+        }
+
+    def save(self, sidecar: str, key: dict):
+        """Write the index to a sidecar file. The sidecar is a NumPy npz of
+        plain arrays and a JSON header, so loading it never unpickles.
+        """
+        strings = {}
+
+        def intern(value):
+            if value is None:
+                return -1
+            return strings.setdefault(value, len(strings))
+
+        stacks = {stack: i for i, stack in enumerate(self._stacks)}
+        count = len(self.entries)
+        columns = {
+            name: np.empty(count, dtype=np.int64)
+            for name in (
+                "offset",
+                "length",
+                "stack",
+                "nested",
+                "start",
+                "end",
+                "convo_src",
+                "convo_layer",
+                "convo_dst",
+            )
+        }
+        times = np.empty(count, dtype=np.float64)
+        extra = []
+        for i, entry in enumerate(self.entries):
+            columns["offset"][i] = entry.offset
+            times[i] = entry.time
+            columns["length"][i] = entry.length
+            columns["stack"][i] = stacks[entry.layers]
+            columns["nested"][i] = stacks[entry.nested]
+            if entry.payload is None:
+                start, end = -1, -1
+            elif isinstance(entry.payload, bytes):  # pragma: no cover
+                start, end = -2, len(extra)
+                extra.append(entry.payload.hex())
+            else:
+                start, end = entry.payload
+            columns["start"][i] = start
+            columns["end"][i] = end
+            convo_src, convo_layer, convo_dst = entry.convo or (None,) * 3
+            columns["convo_src"][i] = intern(convo_src)
+            columns["convo_layer"][i] = intern(convo_layer)
+            columns["convo_dst"][i] = intern(convo_dst)
+        meta = dict(
+            key,
+            version=self.version,
+            names=self.names,
+            stacks=[list(stack) for stack in stacks],
+            strings=list(strings),
+            extra=extra,
+        )
+        meta = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+        directory = os.path.dirname(os.path.abspath(sidecar))
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as fh:
+            try:
+                np.savez(fh, meta=meta, time=times, **columns)
+            except Exception:  # pragma: no cover
+                fh.close()
+                os.remove(fh.name)
+                raise
+        os.replace(fh.name, sidecar)
+
+    @classmethod
+    def load(cls, path: str, sidecar: str, key: dict):
+        """Load the index of path from a sidecar file. Returns None if there
+        is no sidecar, or if it was not written for key, the `file_key` of
+        path.
+        """
+        try:
+            with np.load(sidecar, allow_pickle=False) as data:
+                meta = json.loads(data["meta"].tobytes())
+                if meta.get("version") != cls.version or any(
+                    meta.get(k) != v for k, v in key.items()
+                ):
+                    return None
+                columns = {name: data[name].tolist() for name in data.files}
+        except Exception:
+            # a missing or unreadable sidecar is rebuilt
+            return None
+
+        index = cls(path)
+        index.names = {sys.intern(k): v for k, v in meta["names"].items()}
+        stacks = [tuple(sys.intern(name) for name in stack) for stack in meta["stacks"]]
+        index._stacks = {stack: stack for stack in stacks}
+        strings = [sys.intern(value) for value in meta["strings"]]
+        extra = meta["extra"]
+        for row in zip(
+            columns["offset"],
+            columns["time"],
+            columns["length"],
+            columns["stack"],
+            columns["nested"],
+            columns["start"],
+            columns["end"],
+            columns["convo_src"],
+            columns["convo_layer"],
+            columns["convo_dst"],
+        ):
+            offset, time, length, stack, nested, start, end = row[:7]
+            convo_src, convo_layer, convo_dst = row[7:]
+            if start == -1:
+                payload = None
+            elif start == -2:  # pragma: no cover
+                payload = bytes.fromhex(extra[end])
+            else:
+                payload = (start, end)
+            convo = None
+            if convo_src != -1:
+                convo = (strings[convo_src], strings[convo_layer], strings[convo_dst])
+            index.entries.append(
+                _IndexEntry(
+                    offset,
+                    time,
+                    length,
+                    stacks[stack],
+                    payload,
+                    convo,
+                    stacks[nested],
                 )
-        elif "ARP" in p:
-            sess = str(sorted(["ARP", p[scapy.ARP].psrc, p[scapy.ARP].pdst], key=str))
-        # else:
-        #     sess = p.sprintf("Ethernet type=%04xr,Ether.type%")
-    return sess
+            )
+        return index
+
+    @classmethod
+    def merge(cls, indexes):
+        """Merge the indexes of a set of files into one index with the entries
+        in timestamp order
+        """
+        index = cls(indexes[0].path)
+        index.paths = [i.path for i in indexes]
+        for source, other in enumerate(indexes):
+            index.names.update(other.names)
+            for entry in other.entries:
+                entry.source = source
+                entry.layers = index._stacks.setdefault(entry.layers, entry.layers)
+                entry.nested = index._stacks.setdefault(entry.nested, entry.nested)
+        index.entries = list(
+            heapq.merge(
+                *(i.entries for i in indexes),
+                key=lambda e: float("-inf") if e.time is None else e.time,
+            )
+        )
+        return index
+
+    def window(self, start_time=None, end_time=None):
+        """Get a copy of the index with only the entries in ``[start, end)``"""
+        index = type(self)(self.path)
+        index.paths = self.paths
+        index.names = self.names
+        index._stacks = self._stacks
+        index.entries = [
+            entry
+            for entry in self.entries
+            if entry.time is not None
+            and (start_time is None or entry.time >= start_time)
+            and (end_time is None or entry.time < end_time)
+        ]
+        return index
+
+    def has_layer(self, layer: str):
+        """Get a predicate that checks if an entry contains the layer. Like
+        scapy haslayer, both the class name and the display name of a layer
+        match, and layers held in packet fields count.
+        """
+        wanted = {k for k, v in self.names.items() if layer in (k, v)}
+        return lambda entry: not (
+            wanted.isdisjoint(entry.layers) and wanted.isdisjoint(entry.nested)
+        )
+
+    def payloads(self, layer: str = None, buffer=_capture_buffer):
+        """Yield the raw payload of every entry that has one, optionally
+        only for entries that contain layer. buffer gets the buffer of a
+        capture path, and is called once per path.
+        """
+        check = self.has_layer(layer) if layer else None
+        buffers = {}
+        for entry in self.entries:
+            if entry.payload is None:
+                continue
+            if check is not None and not check(entry):
+                continue
+            if isinstance(entry.payload, bytes):  # pragma: no cover
+                yield entry.payload
+                continue
+            start, end = entry.payload
+            source = buffers.get(entry.source)
+            if source is None:
+                source = buffers[entry.source] = buffer(self.paths[entry.source])
+            yield source[entry.offset + start : entry.offset + end]
+
+
+def _seq_delta(a: int, b: int):
+    """Signed distance between two TCP sequence numbers"""
+    delta = (a - b) & 0xFFFFFFFF
+    return delta - 0x100000000 if delta & 0x80000000 else delta
+
+
+class _TcpStream:
+    """One direction of a TCP connection. Segments are put back into
+    sequence order, retransmitted and overlapping bytes are dropped, and the
+    in order data is fed to the sink. Out of order data is buffered up to
+    `window` bytes, after which the missing bytes are skipped.
+    """
+
+    __slots__ = ("sink", "next_seq", "pending", "pending_size", "fin", "closed")
+
+    window = 4 * 1024 * 1024
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.next_seq = None
+        self.pending = {}
+        self.pending_size = 0
+        self.fin = None
+        self.closed = False
+
+    def add(self, seq: int, flags: int, data):
+        if self.closed:
+            return
+        if flags & 0x02:
+            # SYN takes up one sequence number
+            seq = (seq + 1) & 0xFFFFFFFF
+            if self.next_seq is None:
+                self.next_seq = seq
+        if self.next_seq is None:
+            self.next_seq = seq
+        if flags & 0x01:
+            self.fin = (seq + len(data)) & 0xFFFFFFFF
+        if data:
+            if _seq_delta(seq, self.next_seq) > 0:
+                if seq not in self.pending or len(self.pending[seq]) < len(data):
+                    self.pending_size += len(data) - len(self.pending.get(seq, b""))
+                    self.pending[seq] = data
+                if self.pending_size > self.window:
+                    # give up on the missing bytes to keep memory bounded
+                    self.next_seq = min(
+                        self.pending, key=lambda k: _seq_delta(k, self.next_seq)
+                    )
+            else:
+                self._deliver(seq, data)
+            self._drain()
+        if self.fin is not None and not self.pending and self.next_seq == self.fin:
+            self.close()
+
+    def _deliver(self, seq: int, data):
+        overlap = -_seq_delta(seq, self.next_seq)
+        if overlap >= len(data):
+            return
+        data = data[overlap:]
+        self.next_seq = (self.next_seq + len(data)) & 0xFFFFFFFF
+        self.sink.feed(data)
+
+    def _drain(self):
+        while self.pending:
+            seq = min(self.pending, key=lambda k: _seq_delta(k, self.next_seq))
+            if _seq_delta(seq, self.next_seq) > 0:
+                break
+            data = self.pending.pop(seq)
+            self.pending_size -= len(data)
+            self._deliver(seq, data)
+
+    def flush(self):
+        """Hand the data that is still waiting for a missing segment to the
+        sink in sequence order, skipping the missing bytes
+        """
+        for seq in sorted(self.pending, key=lambda k: _seq_delta(k, self.next_seq)):
+            if _seq_delta(seq, self.next_seq) > 0:
+                self.next_seq = seq
+            self._deliver(seq, self.pending[seq])
+        self.pending = {}
+        self.pending_size = 0
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.pending = {}
+            self.sink.close()
+
+
+class _HttpBody:
+    """Collect a message body in memory, and in a temporary file once it
+    grows past spill_size.
+    """
+
+    __slots__ = ("data", "file", "size", "spill_size", "spill_dir")
+
+    def __init__(self, spill_size: int, spill_dir: str = None):
+        self.data = bytearray()
+        self.file = None
+        self.size = 0
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir
+
+    def write(self, chunk):
+        if self.file is None and len(self.data) + len(chunk) > self.spill_size:
+            self.file = tempfile.NamedTemporaryFile(
+                prefix="body_", dir=self.spill_dir, delete=False
+            )
+            self.file.write(self.data)
+            self.data = None
+        if self.file is None:
+            self.data += chunk
+        else:
+            self.file.write(chunk)
+        self.size += len(chunk)
+
+    def value(self):
+        """The body as bytes, or a dict with the path of the file it was
+        spilled to and its size
+        """
+        if self.file is not None:
+            self.file.close()
+            return {"spilled": self.file.name, "size": self.size}
+        return bytes(self.data) if self.data else {}
+
+
+#: header fields of the scapy HTTPRequest and HTTPResponse layers
+_HTTP_GENERAL_HEADERS = (
+    "Cache-Control Connection Content-Length Content-MD5 Content-Type Date "
+    "Keep-Alive Permanent Pragma Upgrade Via Warning X-Correlation-ID "
+    "X-Request-ID"
+).split()
+_HTTP_FIELDS = {
+    "request": ("Method", "Path", "Http-Version")
+    + tuple(
+        sorted(
+            _HTTP_GENERAL_HEADERS
+            + (
+                "A-IM Accept Accept-Charset Accept-Datetime Accept-Encoding "
+                "Accept-Language Access-Control-Request-Headers "
+                "Access-Control-Request-Method Authorization Cookie DNT Expect "
+                "Forwarded From Front-End-Https HTTP2-Settings Host If-Match "
+                "If-Modified-Since If-None-Match If-Range If-Unmodified-Since "
+                "Max-Forwards Origin Proxy-Authorization Proxy-Connection Range "
+                "Referer Save-Data TE Upgrade-Insecure-Requests User-Agent "
+                "X-ATT-DeviceId X-Csrf-Token X-Forwarded-For X-Forwarded-Host "
+                "X-Forwarded-Proto X-Http-Method-Override X-Requested-With "
+                "X-UIDH X-Wap-Profile"
+            ).split()
+        )
+    ),
+    "response": ("Http-Version", "Status-Code", "Reason-Phrase")
+    + tuple(
+        sorted(
+            _HTTP_GENERAL_HEADERS
+            + (
+                "Accept-Patch Accept-Ranges Access-Control-Allow-Credentials "
+                "Access-Control-Allow-Headers Access-Control-Allow-Methods "
+                "Access-Control-Allow-Origin Access-Control-Expose-Headers "
+                "Access-Control-Max-Age Age Allow Alt-Svc Content-Disposition "
+                "Content-Encoding Content-Language Content-Location "
+                "Content-Range Content-Security-Policy Delta-Base ETag Expires "
+                "IM Last-Modified Link Location P3P Proxy-Authenticate "
+                "Public-Key-Pins Refresh Retry-After Server Set-Cookie Status "
+                "Strict-Transport-Security Timing-Allow-Origin Tk Trailer "
+                "Transfer-Encoding Vary WWW-Authenticate X-Content-Duration "
+                "X-Content-Security-Policy X-Content-Type-Options "
+                "X-Frame-Options X-Powered-By X-UA-Compatible X-WebKit-CSP "
+                "X-XSS-Protection"
+            ).split()
+        )
+    ),
+}
+
+
+def _http_fields(head: bytes, kind: str):
+    """Get the fields that the scapy HTTPRequest or HTTPResponse layer has
+    for a message head. The head is parsed here, as importing
+    scapy.layers.http binds HTTP to the HTTP ports, which would change how
+    every later packet on those ports is dissected.
+    """
+    first_line, _, lines = head.partition(b"\r\n")
+    found = {}
+    for line in lines.split(b"\r\n"):
+        name, sep, value = line.partition(b":")
+        if not sep:
+            continue
+        key = name.strip().decode("latin-1").replace("-", "_").lower()
+        found[key] = (name, value.strip())
+    fields = {}
+    for name in _HTTP_FIELDS[kind]:
+        name = name.replace("-", "_")
+        if name.lower() in found:
+            fields[name] = found.pop(name.lower())[1]
+    if found:
+        fields["Unknown_Headers"] = dict(found.values())
+    first = re.split(rb"\s+", first_line.strip(), 2)
+    if len(first) == 3:
+        for name, value in zip(_HTTP_FIELDS[kind][:3], first):
+            fields[name.replace("-", "_")] = value
+    return fields
+
+
+class _HttpParser:
+    """Incremental HTTP/1.x parser for one direction of a TCP stream. Each
+    complete message is handed to the `_HttpFlow` as a dict of its scapy
+    header fields, as `_http_fields` gets them, and its de-chunked payload.
+    """
+
+    methods = (
+        b"GET",
+        b"POST",
+        b"PUT",
+        b"HEAD",
+        b"DELETE",
+        b"OPTIONS",
+        b"PATCH",
+        b"CONNECT",
+        b"TRACE",
+    )
+    max_head = 64 * 1024
+
+    def __init__(self, flow):
+        self.flow = flow
+        self.kind = None
+        self.buffer = bytearray()
+        self.state = "head"
+        self.message = None
+        self.body = None
+        self.remaining = 0
+
+    def feed(self, data):
+        if self.kind is False:
+            return
+        self.buffer += data
+        while self.kind is not False and self._step():
+            pass
+
+    def close(self):
+        if self.state != "head":
+            self._finish()
+        self.kind = False
+        self.buffer = bytearray()
+
+    def _step(self):
+        buffer = self.buffer
+        if self.state == "head":
+            if not buffer:
+                return False
+            if not self._detect():
+                return False
+            end = buffer.find(b"\r\n\r\n")
+            if end < 0:
+                if len(buffer) > self.max_head:
+                    self.close()
+                return False
+            head = bytes(buffer[: end + 4])
+            del buffer[: end + 4]
+            self._start(head)
+            return True
+        if self.state in ("body", "chunk"):
+            size = min(self.remaining, len(buffer))
+            if not size and self.remaining:
+                return False
+            self.body.write(bytes(buffer[:size]))
+            del buffer[:size]
+            self.remaining -= size
+            if self.remaining:
+                return False
+            if self.state == "body":
+                self._finish()
+            else:
+                self.state = "chunk_end"
+            return True
+        if self.state == "eof":
+            if buffer:
+                self.body.write(bytes(buffer))
+                del buffer[:]
+            return False
+        end = buffer.find(b"\r\n")
+        if end < 0:
+            return False
+        line = bytes(buffer[:end])
+        del buffer[: end + 2]
+        if self.state == "chunk_size":
+            try:
+                size = int(line.split(b";")[0].strip(), 16)
+            except ValueError:
+                self.close()
+                return False
+            self.state, self.remaining = (
+                ("trailer", 0) if size == 0 else ("chunk", size)
+            )
+        elif self.state == "chunk_end":
+            self.state = "chunk_size"
+        elif self.state == "trailer" and not line:
+            self._finish()
+        return True
+
+    def _detect(self):
+        """Decide if the stream carries requests or responses"""
+        buffer = self.buffer
+        if buffer.startswith(b"HTTP/"):
+            kind = "response"
+        elif bytes(buffer[:8]).split(b" ")[0] in self.methods:
+            kind = "request"
+        elif len(buffer) < 8 and (
+            b"HTTP/".startswith(bytes(buffer))
+            or any(m.startswith(bytes(buffer)) for m in self.methods)
+        ):
+            return False
+        else:
+            kind = False
+        if self.kind is not None and kind != self.kind:
+            kind = False
+        self.kind = kind
+        if kind is False:
+            self.buffer = bytearray()
+            return False
+        return True
+
+    def _start(self, head: bytes):
+        lines = head.split(b"\r\n")
+        start_line = lines[0].split(b" ")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+        if self.kind == "request":
+            self.message = {"headers": _http_fields(head, "request")}
+            method, status = start_line[0], None
+            self.flow.methods.append(method)
+        else:
+            self.message = {"headers": _http_fields(head, "response")}
+            method = self.flow.methods[0] if self.flow.methods else None
+            try:
+                status = int(start_line[1])
+            except (IndexError, ValueError):
+                status = None
+        self.message["status"] = status
+        self.body = _HttpBody(self.flow.spill_size, self.flow.spill_dir)
+
+        no_body = self.kind == "response" and (
+            method == b"HEAD" or status in (204, 304) or (status or 0) // 100 == 1
+        )
+        if no_body:
+            self._finish()
+        elif b"chunked" in headers.get(b"transfer-encoding", b"").lower():
+            self.state = "chunk_size"
+        elif headers.get(b"content-length", b"").isdigit():
+            self.remaining = int(headers[b"content-length"])
+            self.state = "body"
+            if not self.remaining:
+                self._finish()
+        elif self.kind == "response":
+            # the body ends when the connection is closed
+            self.state = "eof"
+        else:
+            self._finish()
+
+    def _finish(self):
+        message = self.message
+        status = message.pop("status")
+        message["payload"] = self.body.value()
+        self.message = self.body = None
+        self.state = "head"
+        if self.kind == "request":
+            self.flow.add_request(message)
+        elif status is None or status // 100 != 1:
+            self.flow.add_response(message)
+
+
+class _HttpFlow:
+    """Pair up the requests and responses of a TCP connection"""
+
+    __slots__ = ("streams", "requests", "methods", "results", "spill_size", "spill_dir")
+
+    def __init__(self, spill_size: int, spill_dir: str = None):
+        self.streams = {}
+        self.requests = collections.deque()
+        self.methods = collections.deque()
+        self.results = []
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir
+
+    def stream(self, src):
+        if src not in self.streams:
+            self.streams[src] = _TcpStream(_HttpParser(self))
+        return self.streams[src]
+
+    def add_request(self, message):
+        self.requests.append(message)
+
+    def add_response(self, message):
+        if not self.requests:
+            return
+        if self.methods:
+            self.methods.popleft()
+        self.results.append({"request": self.requests.popleft(), "response": message})
+
+    @property
+    def closed(self):
+        return len(self.streams) == 2 and all(s.closed for s in self.streams.values())
+
+    def close(self):
+        for stream in self.streams.values():
+            stream.close()
+        while self.requests:
+            self.results.append({"request": self.requests.popleft(), "response": {}})
+
+
+class _SearchSink:
+    """Run a compiled pattern over one direction of a reassembled stream as
+    it is fed. The last `overlap` bytes are scanned again with the next
+    data, so matches that span segments are found while only the tail of
+    the stream is kept. A match that ends in that tail could still grow with
+    the next data, so it is only reported once it ends before the tail or
+    the stream is closed.
+    """
+
+    __slots__ = (
+        "pattern",
+        "overlap",
+        "flow",
+        "src",
+        "results",
+        "tail",
+        "base",
+        "done",
+        "seen",
+    )
+
+    def __init__(self, pattern, overlap: int, flow, src, results: list):
+        self.pattern = pattern
+        self.overlap = overlap
+        self.flow = flow
+        self.src = src
+        self.results = results
+        self.tail = b""
+        #: stream offset of the first byte of tail
+        self.base = 0
+        #: stream offset of the end of the last match
+        self.done = 0
+        #: stream offset up to which every match has been reported
+        self.seen = 0
+
+    def feed(self, data):
+        self._scan(self.tail + bytes(data), False)
+
+    def _scan(self, buffer: bytes, final: bool):
+        cut = len(buffer) if final else max(len(buffer) - self.overlap, 0)
+        keep = cut
+        for match in self.pattern.finditer(buffer, max(self.done - self.base, 0)):
+            start, end = self.base + match.start(), self.base + match.end()
+            if end <= self.seen or start == end:
+                # found in an earlier scan of the tail
+                continue
+            if match.end() > cut and match.end() - match.start() < self.overlap:
+                # the match may go on in the next data, so it is scanned
+                # again from its start
+                keep = min(keep, match.start())
+                break
+            self.results.append((self.flow, self.src, start, match.group()))
+            self.done = end
+        self.seen = self.base + cut
+        self.base += keep
+        self.tail = buffer[keep:]
+
+    def close(self):
+        if self.tail:
+            self._scan(self.tail, True)
+        self.tail = b""
+
+
+def _search_pattern(pattern, ignore_case: bool = False):
+    """Compile a regex, or a list of them, into one bytes pattern so every
+    pattern is checked in a single pass
+    """
+    patterns = pattern if isinstance(pattern, (list, tuple, set)) else [pattern]
+    patterns = [p.encode() if isinstance(p, str) else bytes(p) for p in patterns]
+    if not patterns:  # pragma: no cover
+        raise TypeError("Valid patterns are str, bytes or a list of them")
+    if len(patterns) > 1:
+        pattern = b"|".join(b"(?:" + p + b")" for p in patterns)
+    else:
+        pattern = patterns[0]
+    return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+
+def _tcp_segments(records, flows):
+    """Yield ``(flow, src, seq, flags, payload)`` for every TCP segment in the
+    records, where src is the packed address and port of the sender and flow
+    is its `_Flow` in the flows table. Every packet is counted in the flows
+    table, so unless it evicts flows, it holds the same flows as
+    `_flow_table`.
+    """
+    for _, timestamp, linktype, wirelen, data in records:
+        headers, packet = flows.decode(linktype, data)
+        flow = flows.add(timestamp, wirelen, headers)
+        if headers.proto != 6:
+            continue
+        segment = _l4_segment(headers, packet, data)
+        if segment is None:
+            continue
+        yield (flow, (headers.src, headers.sport)) + segment
+
+
+_SEQ_FLAGS = struct.Struct("!I5xB")
+
+
+def _l4_segment(headers, packet, data):
+    """Get ``(seq, flags, payload)`` of a TCP or UDP record from its fast
+    decoded headers, or from the scapy packet when `_FlowTable.decode`
+    returned one. seq and flags are None for UDP. Returns None when the
+    transport header can not be read.
+    """
+    if packet is None:
+        seq = flags = None
+        if headers.proto == 6:
+            if headers.l4 is None or headers.l4 + 14 > len(data):
+                return None
+            seq, flags = _SEQ_FLAGS.unpack_from(data, headers.l4 + 4)
+        start, end = headers.payload or (0, 0)
+        return seq, flags, data[start:end]
+    layer = scapy.TCP if headers.proto == 6 else scapy.UDP
+    if not layer in packet:  # pragma: no cover
+        return None
+    l4 = packet.getlayer(layer)
+    load = bytes(l4.payload)
+    if scapy.Padding in packet:
+        load = load[: -len(packet.getlayer(scapy.Padding).load)]
+    if headers.proto == 6:
+        return l4.seq, int(l4.flags), load
+    return None, None, load
+
+
+class _Column:
+    """Accumulate the values of one field in compact storage. The kind of the
+    column is taken from its first value, and the column falls back to a
+    list of objects when a later value does not fit.
+    """
+
+    __slots__ = ("kind", "values", "offsets", "valid")
+
+    def __init__(self):
+        self.kind = None
+        self.values = None
+        self.offsets = None
+        self.valid = bytearray()
+
+    def append(self, row: int, value):
+        if value is None:
+            return
+        if self.kind is None:
+            self._start(self._kind_of(value))
+        if len(self.valid) < row:
+            self._pad(row - len(self.valid))
+        try:
+            if self.kind == "bytes":
+                if not isinstance(value, bytes):
+                    raise TypeError
+                self.values += value
+                self.offsets.append(len(self.values))
+            elif self.kind == "str":
+                if not isinstance(value, str):
+                    raise TypeError
+                self.values.append(value)
+            elif self.kind == "object":
+                self.values.append(value)
+            else:
+                if isinstance(value, (bool, str, bytes)):
+                    raise TypeError
+                self.values.append(value)
+        except (TypeError, OverflowError):
+            self._to_objects()
+            self.values.append(value)
+        self.valid.append(1)
+
+    @staticmethod
+    def _kind_of(value):
+        if isinstance(value, bytes):
+            return "bytes"
+        if isinstance(value, str):
+            return "str"
+        if isinstance(value, int) and not isinstance(value, bool):
+            return "int"
+        if isinstance(value, float):
+            return "float"
+        return "object"
+
+    def _start(self, kind: str):
+        self.kind = kind
+        if kind == "bytes":
+            self.values = bytearray()
+            self.offsets = array.array("Q", [0])
+        elif kind == "int":
+            self.values = array.array("q")
+        elif kind == "float":
+            self.values = array.array("d")
+        else:
+            self.values = []
+        # rows before the first value are missing
+        count, self.valid = len(self.valid), bytearray()
+        self._pad(count)
+
+    def _pad(self, count: int):
+        self.valid += bytes(count)
+        if self.kind is None:
+            return
+        if self.kind == "bytes":
+            self.offsets.extend([self.offsets[-1]] * count)
+        elif self.kind == "str":
+            self.values.extend([""] * count)
+        elif self.kind == "object":
+            self.values.extend([None] * count)
+        else:
+            self.values.extend([0] * count)
+
+    def _to_objects(self):
+        if self.kind == "object":
+            return
+        if self.kind == "bytes":
+            offsets, data = self.offsets, self.values
+            values = [
+                bytes(data[offsets[i] : offsets[i + 1]]) for i in range(len(self.valid))
+            ]
+        else:
+            values = list(self.values)
+        self.values = [v if ok else None for v, ok in zip(values, self.valid)]
+        self.kind, self.offsets = "object", None
+
+    def extend(self, row: int, other):
+        """Append the rows of a column built over a later part of the pcap"""
+        if other.kind is None:
+            return
+        if self.kind is None:
+            self._start(other.kind)
+        if self.kind != other.kind:
+            self._to_objects()
+            other._to_objects()
+        if len(self.valid) < row:
+            self._pad(row - len(self.valid))
+        if self.kind == "bytes":
+            base = self.offsets[-1]
+            self.offsets.extend(base + offset for offset in other.offsets[1:])
+        self.values += other.values
+        self.valid += other.valid
+
+    def to_array(self, rows: int):
+        """Convert the column to NumPy. Missing values are masked, and bytes
+        become a dict of an offsets array and a uint8 buffer, so that the
+        value of row i is buffer[offsets[i]:offsets[i + 1]].
+        """
+        if self.kind is None:
+            self._start("object")
+        if len(self.valid) < rows:
+            self._pad(rows - len(self.valid))
+        if self.kind == "bytes":
+            return {
+                "offsets": np.frombuffer(self.offsets, dtype=np.uint64),
+                "buffer": np.frombuffer(bytes(self.values), dtype=np.uint8),
+            }
+        if self.kind == "int":
+            values = np.frombuffer(self.values, dtype=np.int64)
+        elif self.kind == "float":
+            values = np.frombuffer(self.values, dtype=np.float64)
+        elif self.kind == "str":
+            values = np.array(self.values, dtype=str)
+        else:
+            values = np.empty(rows, dtype=object)
+            for i, value in enumerate(self.values):
+                values[i] = value
+        mask = np.frombuffer(bytes(self.valid), dtype=np.uint8) == 0
+        if mask.any():
+            return np.ma.masked_array(values, mask=mask)
+        return values
 
 
-def _layer2dict(obj):
-    d = {}
+class _ColumnarPcap:
+    """Build one column per `layer.field` name from dissected packets,
+    together with the time and length of each packet. This is the columnar
+    form of `_Pkt2Dict`: the first layer of a name wins, and nested packets
+    are turned into dicts.
+    """
 
-    if not getattr(obj, "fields_desc", None):
-        return
-    for f in obj.fields_desc:
-        value = getattr(obj, f.name)
-        if value is type(None):  # pragma: no cover
-            value = None
+    __slots__ = ("rows", "columns")
 
-        if not isinstance(
-            value, (int, float, str, bytes, bool, list, tuple, set, dict, type(None))
-        ):
-            value = _layer2dict(value)
-        d[f.name] = value
-    return {obj.name: d}
+    def __init__(self):
+        self.rows = 0
+        self.columns = {"time": _Column(), "len": _Column()}
 
+    def add(self, packet):
+        row = self.rows
+        columns = self.columns
+        columns["time"].append(row, float(packet.time))
+        columns["len"].append(row, packet.wirelen or len(packet))
+        seen = set()
+        for layer in _iter_layers(packet):
+            if layer.name in seen or not getattr(layer, "fields_desc", None):
+                continue
+            seen.add(layer.name)
+            for f in layer.fields_desc:
+                name = "{}.{}".format(layer.name, f.name)
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = _Column()
+                column.append(row, self._value(getattr(layer, f.name)))
+        self.rows += 1
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, (int, float, str, bytes, type(None))):
+            return value
+        if isinstance(value, scapy.FlagValue):
+            return int(value)
+        if isinstance(value, scapy.Packet):
+            return _layer2dict(value)
+        if isinstance(value, list):
+            return [_layer2dict(v) if isinstance(v, scapy.Packet) else v for v in value]
+        return value
+
+    def extend(self, other):
+        for name, column in other.columns.items():
+            self.columns.setdefault(name, _Column()).extend(self.rows, column)
+        self.rows += other.rows
+
+    def to_arrays(self):
+        return {
+            name: column.to_array(self.rows) for name, column in self.columns.items()
+        }
+
+
+def _filter_records(records, bpf_filter: str):
+    packet_filter = _BpfFilter(bpf_filter)
+    return (r for r in records if packet_filter.match(r[2], r[4]))
+
+
+def _dissect_records(records):
+    for _, timestamp, linktype, wirelen, data in records:
+        packet = _dissect(linktype, data, timestamp)
+        packet.wirelen = wirelen
+        yield packet
 
-class _Pkt2Dict:
-    def __init__(self, pkt):
-        self.pkt = pkt
+
+def _payloads(packets, layer: str):
+    for packet in packets:
+        if layer in packet and scapy.Raw in packet:
+            yield packet.getlayer(scapy.Raw).load
+
+
+def _fast_payloads(records, layer: str):
+    """Yield the Raw payload of every packet that contains layer by slicing
+    it out of the record. Only records that the fast decoder does not
+    understand are dissected with scapy.
+    """
+    decoder = _FastDecoder()
+    for _, _, linktype, _, data in records:
+        headers = decoder.decode(linktype, data)
+        if headers is None or not headers.exact:
+            packet = _dissect(linktype, data)
+            if layer in packet and scapy.Raw in packet:
+                yield packet.getlayer(scapy.Raw).load
+        elif headers.payload is not None and decoder.has_layer(headers, layer):
+            start, end = headers.payload
+            yield data[start:end]
+
+
+class _ConvoStats:
+    __slots__ = ("packets", "bytes", "first", "last")
+
+    def __init__(self, timestamp):
+        self.packets = 0
+        self.bytes = 0
+        self.first = timestamp
+        self.last = timestamp
+
+
+class _Convos:
+    """Layer 3 conversations keyed by (src, layer, dst) in the order they are
+    first seen. Addresses are interned, as the same few hosts repeat across
+    millions of packets.
+    """
+
+    def __init__(self):
+        self.pairs = {}
+
+    def add(self, src: str, layer: str, dst: str, length: int, timestamp):
+        key = (sys.intern(src), layer, sys.intern(dst))
+        stats = self.pairs.get(key)
+        if stats is None:
+            stats = self.pairs[key] = _ConvoStats(timestamp)
+        stats.packets += 1
+        stats.bytes += length
+        if timestamp < stats.first:
+            stats.first = timestamp
+        if timestamp > stats.last:
+            stats.last = timestamp
+
+    def extend(self, other):
+        for key, stats in other.pairs.items():
+            mine = self.pairs.get(key)
+            if mine is None:
+                key = (sys.intern(key[0]), key[1], sys.intern(key[2]))
+                self.pairs[key] = stats
+                continue
+            mine.packets += stats.packets
+            mine.bytes += stats.bytes
+            mine.first = min(mine.first, stats.first)
+            mine.last = max(mine.last, stats.last)
 
     def to_dict(self):
-        """
-        Turn every layer to dict, store in ChainMap type.
-        `Reference <https://github.com/littlezz/scapy2dict>`__
-        """
-        d = list()
-        count = 0
+        convo = collections.OrderedDict()
+        for src, layer, dst in self.pairs:
+            convo.setdefault(src, {}).setdefault(layer, []).append(dst)
+        return dict(convo)
 
-        while True:
-            layer = self.pkt.getlayer(count)
-            if not layer:
+    def to_stats(self):
+        return [
+            {
+                "src": src,
+                "dst": dst,
+                "layer": layer,
+                "packets": stats.packets,
+                "bytes": stats.bytes,
+                "first": stats.first,
+                "last": stats.last,
+            }
+            for (src, layer, dst), stats in self.pairs.items()
+        ]
+
+    def to_edges(self):
+        """Edge list as NumPy arrays. src and dst index into nodes."""
+        nodes = {}
+        count = len(self.pairs)
+        src = np.empty(count, dtype=np.int64)
+        dst = np.empty(count, dtype=np.int64)
+        packets = np.empty(count, dtype=np.int64)
+        length = np.empty(count, dtype=np.int64)
+        first = np.empty(count, dtype=np.float64)
+        last = np.empty(count, dtype=np.float64)
+        for i, ((s, _, d), stats) in enumerate(self.pairs.items()):
+            src[i] = nodes.setdefault(s, len(nodes))
+            dst[i] = nodes.setdefault(d, len(nodes))
+            packets[i] = stats.packets
+            length[i] = stats.bytes
+            first[i] = stats.first
+            last[i] = stats.last
+        return {
+            "nodes": np.array(list(nodes), dtype=str),
+            "src": src,
+            "dst": dst,
+            "layer": np.array([layer for _, layer, _ in self.pairs], dtype=str),
+            "packets": packets,
+            "bytes": length,
+            "first": first,
+            "last": last,
+        }
+
+
+def _layer_counts(packets):
+    counts = collections.OrderedDict()
+    for packet in packets:
+        layer = packet
+        while layer:
+            counts[layer.name] = counts.get(layer.name, 0) + 1
+            layer = layer.payload
+    return counts
+
+
+def _layer3_convos(packets):
+    convos = _Convos()
+    for packet in packets:
+        # packets with nothing past their first two layers have no layer to
+        # key the conversation by
+        if not scapy.IP in packet or packet.getlayer(2) is None:
+            continue
+        ip_layer = packet.getlayer(scapy.IP)
+        convos.add(
+            ip_layer.src,
+            packet.getlayer(2).name,
+            ip_layer.dst,
+            packet.wirelen or len(packet),
+            float(packet.time),
+        )
+    return convos
+
+
+def _flow_table(records):
+    flows = _FlowTable()
+    for _, timestamp, linktype, wirelen, data in records:
+        flows.add(timestamp, wirelen, flows.decode(linktype, data)[0])
+    return flows
+
+
+class _DnsSession:
+    """The DNS query names of one flow, as grouped by `_dns_sessions`"""
+
+    __slots__ = ("key", "queries")
+
+    def __init__(self, key):
+        self.key = key
+        self.queries = []
+
+
+def _dns_sessions(records):
+    """Group DNS query names per flow, in the order the flows are first seen.
+    Only records that the fast decoder can not fully account for are
+    dissected, as a plain payload can not hold a DNS layer.
+
+    The flow table forgets flows once their TCP connection is closed or they
+    were idle for `_FlowTable.timeout` seconds. Only the sessions of flows
+    with queries are kept after that, and a flow that shows up again goes
+    on in its session, so the sessions match those of scapy's `sessions`.
+    A flow that is forgotten before its first query is put where it shows
+    up again instead.
+
+    Returns:
+        list: `_DnsSession` per flow with queries, and per flow that is
+        still open at the end of the records
+    """
+    flows = _FlowTable(evict=True)
+    sessions = {}
+
+    def close(key):
+        if not sessions[key].queries:
+            del sessions[key]
+
+    for _, timestamp, linktype, wirelen, data in records:
+        headers, packet = flows.decode(linktype, data)
+        flow = flows.add(timestamp, wirelen, headers)
+        for expired in flows.take_expired():
+            close(expired.key)
+        if flow is None:
+            continue
+        session = sessions.get(flow.key)
+        if session is None:
+            session = sessions[flow.key] = _DnsSession(flow.key)
+        if not headers.exact:
+            if packet is None:
+                packet = _dissect(linktype, data)
+            if scapy.DNSQR in packet:
+                session.queries.append(packet.getlayer("DNS").qd.qname)
+        if headers.proto == 6:
+            segment = _l4_segment(headers, packet, data)
+            if segment is not None and flows.tcp_flags(flow, headers, segment[1]):
+                close(flow.key)
+    return list(sessions.values())
+
+
+_DNS_HEADER = struct.Struct("!HHHH4x")
+_DNS_RR = struct.Struct("!HHIH")
+_DNS_TYPES = {
+    1: "A",
+    2: "NS",
+    5: "CNAME",
+    6: "SOA",
+    12: "PTR",
+    15: "MX",
+    16: "TXT",
+    28: "AAAA",
+    33: "SRV",
+    65: "HTTPS",
+    255: "ANY",
+}
+
+
+def _dns_name(message, offset: int):
+    """Read a name that may use compression pointers. Returns the name in
+    the same form as scapy, ``b'example.com.'``, and the offset after it.
+    """
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = message[offset]
+        if length >= 0xC0:
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise ValueError("DNS compression loop")
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            continue
+        if length > 63:
+            raise ValueError("Invalid DNS label")
+        offset += 1
+        if not length:
+            break
+        if offset + length > len(message):
+            raise ValueError("Truncated DNS label")
+        labels.append(bytes(message[offset : offset + length]))
+        offset += length
+    return b".".join(labels) + b".", offset if end is None else end
+
+
+def _dns_message(message):
+    """Decode the first question and the A, AAAA, CNAME and TXT answers of a
+    DNS message. Returns None when the payload is not a DNS message with at
+    least one question. Answers after a truncated record are left out.
+    """
+    try:
+        txid, flags, qdcount, ancount = _DNS_HEADER.unpack_from(message)
+        offset = 12
+        for n in range(qdcount):
+            name, offset = _dns_name(message, offset)
+            if n == 0:
+                qtype = message[offset] << 8 | message[offset + 1]
+                qname, qtype = name, _DNS_TYPES.get(qtype, qtype)
+            offset += 4
+    except (struct.error, IndexError, ValueError):
+        return None
+    if not qdcount or offset > len(message):
+        return None
+    answers = []
+    try:
+        for _ in range(ancount if flags & 0x8000 else 0):
+            name, offset = _dns_name(message, offset)
+            rtype, _, ttl, size = _DNS_RR.unpack_from(message, offset)
+            offset += 10
+            if offset + size > len(message):
+                break
+            if rtype == 1 and size == 4:
+                value = socket.inet_ntop(socket.AF_INET, message[offset : offset + 4])
+            elif rtype == 28 and size == 16:
+                value = socket.inet_ntop(socket.AF_INET6, message[offset : offset + 16])
+            elif rtype == 5:
+                value = _dns_name(message, offset)[0]
+            elif rtype == 16:
+                value, start = [], offset
+                while start < offset + size:
+                    value.append(bytes(message[start + 1 : start + 1 + message[start]]))
+                    start += 1 + message[start]
+            else:
+                offset += size
+                continue
+            answers.append(
+                {"name": name, "type": _DNS_TYPES[rtype], "ttl": ttl, "data": value}
+            )
+            offset += size
+    except (struct.error, IndexError, ValueError):
+        pass
+    return txid, flags, qname, qtype, answers
+
+
+class _DnsTcpSink:
+    """Split the reassembled stream of a DNS over TCP connection into the
+    length prefixed messages it carries
+    """
+
+    __slots__ = ("buffer", "messages")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.messages = []
+
+    def feed(self, data):
+        self.buffer += data
+        while len(self.buffer) >= 2:
+            size = self.buffer[0] << 8 | self.buffer[1]
+            if len(self.buffer) < 2 + size:
                 break
-            d.append(_layer2dict(layer))
+            self.messages.append(bytes(self.buffer[2 : 2 + size]))
+            del self.buffer[: 2 + size]
 
-            count += 1
-        return dict(**collections.ChainMap(*list(filter(lambda x: x is not None, d))))
+    def close(self):
+        self.buffer = bytearray()
+
+
+def _dns_records(records):
+    """Decode the DNS messages on UDP and TCP port 53 of the records without
+    dissecting them. TCP streams are reassembled, so messages that span
+    segments are decoded too. Streams are forgotten once their connection
+    was idle for `_FlowTable.timeout` seconds.
+
+    Yields:
+        dict: One dict per DNS message
+    """
+    flows = _FlowTable(evict=True)
+    streams = {}
+    for _, timestamp, linktype, wirelen, data in records:
+        headers, packet = flows.decode(linktype, data)
+        if headers.proto not in (6, 17) or 53 not in (headers.sport, headers.dport):
+            continue
+        segment = _l4_segment(headers, packet, data)
+        if segment is None:
+            continue
+        seq, flags, load = segment
+        if headers.proto == 17:
+            messages = (load,)
+        else:
+            flow = flows.add(timestamp, wirelen, headers)
+            for expired in flows.take_expired():
+                _, lo, lo_port, hi, hi_port = expired.key
+                streams.pop((lo, lo_port, hi, hi_port), None)
+                streams.pop((hi, hi_port, lo, lo_port), None)
+            key = (headers.src, headers.sport, headers.dst, headers.dport)
+            stream = streams.get(key)
+            if stream is None:
+                stream = streams[key] = _TcpStream(_DnsTcpSink())
+            stream.add(seq, flags, load)
+            messages, stream.sink.messages = stream.sink.messages, []
+            if stream.closed or flags & 0x04:
+                del streams[key]
+            flows.tcp_flags(flow, headers, flags)
+        for message in messages:
+            decoded = _dns_message(message)
+            if decoded is None:
+                continue
+            txid, dns_flags, qname, qtype, answers = decoded
+            response = bool(dns_flags & 0x8000)
+            client, server = headers.src, headers.dst
+            if response:
+                client, server = server, client
+            yield {
+                "time": timestamp,
+                "client": _ntop(client),
+                "server": _ntop(server),
+                "id": txid,
+                "response": response,
+                "rcode": dns_flags & 0xF,
+                "qname": qname,
+                "qtype": qtype,
+                "answers": answers,
+            }
+
+
+def _dns_aggregate(messages, key: str):
+    """Count queries and responses per qname or per client, with the time of
+    the first and last message
+    """
+    counts = collections.OrderedDict()
+    for message in messages:
+        group = counts.get(message[key])
+        if group is None:
+            group = counts[message[key]] = {
+                "queries": 0,
+                "responses": 0,
+                "first": message["time"],
+                "last": message["time"],
+            }
+        group["responses" if message["response"] else "queries"] += 1
+        if message["time"] < group["first"]:
+            group["first"] = message["time"]
+        if message["time"] > group["last"]:
+            group["last"] = message["time"]
+    return counts
+
+
+def _merge_counts(parts):
+    merged = collections.OrderedDict()
+    for part in parts:
+        for key, count in part.items():
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+def _merge_convos(parts):
+    merged = _Convos()
+    for part in parts:
+        merged.extend(part)
+    return merged
+
+
+def _merge_sessions(parts):
+    """Join the DNS sessions of the parts of a pcap. The queries of a flow
+    that has sessions in several parts go on in its first session.
+    """
+    merged = {}
+    for part in parts:
+        for session in part:
+            mine = merged.setdefault(session.key, session)
+            if mine is not session:
+                mine.queries.extend(session.queries)
+    return list(merged.values())
+
+
+def _pickled_dicts(records):
+    """Convert records with `_Pkt2Dict` and pickle each dict. Some scapy
+    field values can not be pickled, so the raw record is returned in their
+    place and the dict is built again by `_unpickle_dicts`.
+    """
+    hold = []
+    for _, timestamp, linktype, _, data in records:
+        d = _Pkt2Dict(_dissect(linktype, data, timestamp)).to_dict()
+        try:
+            hold.append(pickle.dumps(d))
+        except Exception:
+            hold.append((linktype, bytes(data), timestamp))
+    return hold
+
+
+def _unpickle_dicts(items):
+    for item in items:
+        if isinstance(item, bytes):
+            yield pickle.loads(item)
+        else:
+            yield _Pkt2Dict(_dissect(*item)).to_dict()
+
+
+def _pcap_chunk(
+    task: str, path: str, state, start: int, end: int, bpf_filter, window, args
+):
+    """Run a task over one byte range of a capture. This runs in the worker
+    processes of `Pcap._pcap_map`.
+    """
+    records = _open_records(path, state, start).records(end)
+    if window is not None:
+        records = _window_records(records, window)
+    if bpf_filter:
+        records = _filter_records(records, bpf_filter)
+    if task == "fast_payload":
+        return [bytes(load) for load in _fast_payloads(records, *args)]
+    if task == "to_dict":
+        return _pickled_dicts(records)
+    if task == "columns":
+        columns = _ColumnarPcap()
+        for packet in _dissect_records(records):
+            columns.add(packet)
+        return columns
+    if task == "flows":
+        return _flow_table(records)
+    if task == "dns":
+        return _dns_sessions(records)
+    packets = _dissect_records(records)
+    if task == "payload":
+        return list(_payloads(packets, *args))
+    if task == "layer_stats":
+        return _layer_counts(packets)
+    if task == "convos":
+        return _layer3_convos(packets)
+    raise TypeError("Unknown task {}".format(task))  # pragma: no cover
 
 
 class PcapUSB:
@@ -296,40 +3355,428 @@ class PcapUSB:
     }
 
 
+def _hid_tables(key_map: dict, shift_modifier: dict):
+    """Turn a `PcapUSB` layout into 256 entry lookup tables indexed by the
+    keycode, one without and one with shift held
+    """
+    plain = np.full(256, "", dtype=object)
+    shifted = np.full(256, "", dtype=object)
+    for code in range(1, 256):
+        key = "{:02x}".format(code)
+        pressed = key_map.get(key)
+        plain[code] = pressed or ""
+        special = shift_modifier.get(key)
+        if special:
+            shifted[code] = special
+        elif pressed:
+            shifted[code] = pressed.upper()
+    return plain, shifted
+
+
 class Pcap(chepy.core.ChepyCore):
     """This plugin allows handling of various pcap
     related operations.
 
-    scapy is a requirement for this plugin.
+    scapy is a requirement for this plugin. BPF filters made of host, net,
+    port, portrange, proto, vlan and protocol primitives are evaluated in
+    process. Other filters need tcpdump.
     """
 
+    #: tasks whose results do not depend on the order packets are seen in,
+    #: so the files of a capture set can be split across workers
+    _pcap_unordered_tasks = ("layer_stats", "convos", "flows")
+
     def _pcap_reader_instance(self, bpf_filter):
-        if sys.platform == "darwin":
-            self._warning_logger("Need tcpdump from Brew for filter to work")
+        if (
+            not bpf_filter
+            and self._pcap_window is None
+            and len(self._pcap_filepaths) == 1
+            and _compression(self._pcap_filepath) is None
+            and self._pcap_follow is None
+        ):
+            return scapy.PcapReader(self._pcap_filepath)
+        return _dissect_records(self._pcap_records(bpf_filter))
+
+    @property
+    def _pcap_window(self):
+        return getattr(self, "_pcap_time_window", None)
+
+    @property
+    def _pcap_follow(self):
+        return getattr(self, "_pcap_followers", None)
+
+    @property
+    def _pcap_filepaths(self):
+        return getattr(self, "_pcap_paths", None) or [self._pcap_filepath]
+
+    def _pcap_buffer(self, path: str):
+        """Get the memory map of a capture, or the slices of a compressed
+        one. Every file is mapped once per loaded capture.
+        """
+        if getattr(self, "_pcap_buffers", None) is None:
+            self._pcap_buffers = {}
+        if path not in self._pcap_buffers:
+            self._pcap_buffers[path] = _capture_buffer(path)
+        return self._pcap_buffers[path]
+
+    def _pcap_close_buffers(self):
+        _close_buffers(getattr(self, "_pcap_buffers", None) or {})
+        self._pcap_buffers = None
+
+    def _pcap_window_range(self, path: str):
+        """Get the byte range of the time window that was set by `read_pcap`.
+        The sparse time index of a file is built the first time it is needed.
+        """
+        if getattr(self, "_pcap_time_index", None) is None:
+            self._pcap_time_index = {}
+        if path not in self._pcap_time_index:
+            self._pcap_time_index[path] = _TimeIndex(path, self._pcap_buffer(path))
+        return self._pcap_time_index[path].range(*self._pcap_window)
+
+    def _pcap_window_records(self, path: str):
+        """Raw records of a file, restricted to the time window if one is set.
+        In follow mode only the records appended since the last read are used.
+        """
+        if self._pcap_follow is not None:
+            records = self._pcap_follow[path].records(self._pcap_follow_timeout)
+            if self._pcap_window is not None:
+                records = _window_records(records, self._pcap_window)
+            yield from records
+            return
+        if self._pcap_window is None:
+            yield from _open_records(path, buffer=self._pcap_buffer(path))
+            return
+        window = self._pcap_window_range(path)
+        if window is None:
+            return
+        state, start, end = window
+        records = _open_records(path, state, start, self._pcap_buffer(path))
+        yield from _window_records(records.records(end), self._pcap_window)
+
+    def _pcap_records(self, bpf_filter: str = ""):
+        """Iterate over the raw records of the pcap. When a set of files was
+        loaded, the records of all files are merged by timestamp.
+        """
+        paths = self._pcap_filepaths
+        if len(paths) == 1:
+            return self._pcap_file_records(paths[0], bpf_filter)
+        return heapq.merge(
+            *(self._pcap_file_records(path, bpf_filter) for path in paths),
+            key=_record_time,
+        )
+
+    def _pcap_file_records(self, path: str, bpf_filter: str = ""):
+        """Iterate over the raw records of one file. BPF filters are evaluated
+        in process when possible, so records that do not match are never
+        dissected. Other filters are handed to tcpdump.
+        """
+        try:
+            packet_filter = _BpfFilter(bpf_filter) if bpf_filter else None
+        except _BpfUnsupported:
+            if self._pcap_follow is not None:
+                raise TypeError("Follow mode needs a filter that runs in process")
+            if sys.platform == "darwin":
+                self._warning_logger("Need tcpdump from Brew for filter to work")
+            if self._pcap_window is None:
+                yield from _tcpdump_records(path, bpf_filter)
+            else:
+                yield from _window_records(
+                    _tcpdump_records(path, bpf_filter), self._pcap_window
+                )
+            return
+        for record in self._pcap_window_records(path):
+            if packet_filter is None or packet_filter.match(record[2], record[4]):
+                yield record
+
+    def _pcap_map(self, task: str, workers: int, bpf_filter: str = "", *args):
+        """Run a task over byte ranges of the pcap in a process pool.
+
+        Returns:
+            list: The result of every byte range in file order, or None if
+            the query can not be split and has to run in this process.
+        """
+        if not workers or workers < 2 or self._pcap_follow is not None:
+            return None
+        paths = self._pcap_filepaths
+        if len(paths) > 1 and task not in self._pcap_unordered_tasks:
+            # the results have to follow the merged order of the files
+            return None
         if bpf_filter:
-            return scapy.PcapReader(
-                scapy.tcpdump(
-                    self._pcap_filepath, args=["-w", "-", bpf_filter], getfd=True
+            try:
+                _BpfFilter(bpf_filter)
+            except _BpfUnsupported:
+                return None
+        window = self._pcap_window
+        parts = max(workers * 4 // len(paths), 1)
+        chunks = []
+        for path in paths:
+            window_range = (None, None, None)
+            if window is not None:
+                window_range = self._pcap_window_range(path)
+                if window_range is None:
+                    continue
+            if not _capture_seekable(path):
+                # a compressed file without a frame index is read start to
+                # end by one worker
+                chunks.append((path,) + window_range)
+                continue
+            chunks.extend(
+                (path,) + c
+                for c in _split_records(
+                    path, parts, *window_range, buffer=self._pcap_buffer(path)
                 )
             )
+        if len(chunks) < 2:
+            return None
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(
+                    _pcap_chunk,
+                    task,
+                    path,
+                    state,
+                    start,
+                    end,
+                    bpf_filter,
+                    window,
+                    args,
+                )
+                for path, state, start, end in chunks
+            ]
+            return [future.result() for future in futures]
+
+    def _pcap_payloads(self, layer: str, bpf_filter: str, engine: str, workers: int):
+        task = "fast_payload" if engine == "fast" else "payload"
+        parts = self._pcap_map(task, workers, bpf_filter, layer)
+        if parts is not None:
+            return (load for part in parts for load in part)
+        if engine == "fast":
+            return _fast_payloads(self._pcap_records(bpf_filter), layer)
+        return _payloads(self._pcap_reader_instance(bpf_filter), layer)
+
+    def _pcap_check_engine(self, engine: str):
+        if engine not in ("scapy", "fast"):  # pragma: no cover
+            raise TypeError("Valid engines are scapy and fast")
+
+    def _pcap_cached_index(self, path: str, cache_dir: str = None):
+        sidecar = path + ".chepy-index"
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            sidecar = os.path.join(
+                cache_dir,
+                "{}-{}.chepy-index".format(
+                    os.path.basename(path),
+                    hashlib.blake2b(path.encode(), digest_size=8).hexdigest(),
+                ),
+            )
+        key = _PacketIndex.file_key(path)
+        index = _PacketIndex.load(path, sidecar, key)
+        if index is not None:
+            return index
+        index = _PacketIndex.build(path, self._pcap_buffer(path))
+        try:
+            index.save(sidecar, key)
+        except OSError as e:  # pragma: no cover
+            self._warning_logger("Could not write pcap index {}: {}".format(sidecar, e))
+        return index
+
+    def _pcap_expand_paths(self, source):
+        """Resolve a file, a directory, a glob or a list of files to the
+        sorted list of capture files. Only the files of a directory or a glob
+        that `_is_capture` are kept.
+        """
+        if isinstance(source, (list, tuple)):
+            paths = [str(self._abs_path(path)) for path in source]
         else:
-            return scapy.PcapReader(self._pcap_filepath)
+            source = str(source)
+            if os.path.isdir(source):
+                paths = [
+                    os.path.join(source, name)
+                    for name in sorted(os.listdir(source))
+                    if not name.startswith(".")
+                    and _is_capture(os.path.join(source, name))
+                ]
+            elif not os.path.exists(source) and any(c in source for c in "*?["):
+                paths = sorted(
+                    path
+                    for path in glob.glob(os.path.expanduser(source))
+                    if _is_capture(path)
+                )
+            else:
+                paths = [source]
+            paths = [str(self._abs_path(path)) for path in paths]
+        if not paths:  # pragma: no cover
+            raise TypeError("No pcap files found in {}".format(source))
+        return paths
+
+    def _pcap_index_for(self, bpf_filter: str = ""):
+        """Get the packet index if one was built and it can answer the query"""
+        index = getattr(self, "_pcap_index", None)
+        if index is None or bpf_filter:
+            return None
+        if self._pcap_window is not None:
+            return index.window(*self._pcap_window)
+        return index
 
     @chepy.core.ChepyDecorators.call_stack
-    def read_pcap(self):
+    def read_pcap(
+        self,
+        index: bool = False,
+        cache: bool = False,
+        cache_dir: str = None,
+        start_time=None,
+        end_time=None,
+        follow: bool = False,
+        follow_timeout: float = 0,
+    ):
         """Load a pcap. The state is set to scapy
 
+        Args:
+            index (bool, optional): Dissect the pcap once and keep an in memory
+                index of offsets, timestamps, layers, conversations and payload
+                positions. pcap_payload, pcap_payload_offset, pcap_layer_stats
+                and pcap_convos answer from the index instead of dissecting
+                the pcap again, unless a bpf_filter is given. The other pcap
+                methods decode the capture as usual. Defaults to False.
+            cache (bool, optional): Keep the index in a sidecar file next to
+                the pcap and load it from there on later reads. The sidecar is
+                only used while the path, size, mtime and content hash of the
+                pcap match, and is rebuilt otherwise. The pcap is hashed once
+                per read. Implies index. Defaults to False.
+            cache_dir (str, optional): Directory to keep the sidecar in
+                instead of next to the pcap.
+            start_time (float|str|datetime, optional): Only use packets from
+                this time on. Epoch seconds, a datetime or an ISO 8601 string.
+            end_time (float|str|datetime, optional): Only use packets before
+                this time. A sparse index of timestamps to file offsets is
+                built the first time a window is used, so later pcap methods
+                seek to the start of the window and stop at its end.
+            follow (bool, optional): Follow a capture that is still being
+                written. Every pcap method only reads the records that were
+                appended since the last one, and a record that is only
+                partly written is left for the next read. Can not be used
+                with index or cache. Defaults to False.
+            follow_timeout (float, optional): In follow mode, wait up to this
+                many seconds for new records at the end of the file before
+                stopping. The wait starts over with every new record, so
+                methods with lazy=True keep yielding packets as they are
+                written. Defaults to 0.
+
+        The state can be a pcap, or a directory, glob or list of pcaps that
+        are read as one capture. Packets from a set of files are merged in
+        timestamp order.
+
+        Captures compressed with gzip, xz or zstd are decompressed while they
+        are read, without a copy on disk. zstd needs the zstandard package.
+        BGZF files and zstd files made of several frames are seekable, so
+        time windows and workers skip to the frame they need.
+
         Returns:
             ChepyPlugin: The Chepy object.
+
+        Examples:
+            >>> c = Chepy("tests/files/test.pcapng").read_pcap(index=True)
+            >>> c.pcap_layer_stats().o
+            {'Ethernet': 6, 'IP': 6, 'ICMP': 6, 'Raw': 6}
+            >>> Chepy("captures/sensor-*.pcap").read_pcap().pcap_layer_stats(workers=4).o
+            >>> c = Chepy("live.pcap").read_pcap(follow=True)
+            >>> c.pcap_layer_stats().o  # the packets written so far
+            >>> c.pcap_layer_stats().o  # only the packets written since
         """
-        self._pcap_filepath = str(self._abs_path(self.state))
+        self._pcap_close_buffers()
+        self._pcap_paths = self._pcap_expand_paths(self.state)
+        self._pcap_filepath = self._pcap_paths[0]
+        self._pcap_index = None
+        self._pcap_time_index = None
+        self._pcap_time_window = None
+        self._pcap_followers = None
+        if follow:
+            if index or cache:
+                raise TypeError("Follow mode can not be used with index or cache")
+            if any(_compression(path) for path in self._pcap_paths):
+                raise TypeError("Compressed captures can not be followed")
+            self._pcap_followers = {path: _Follower(path) for path in self._pcap_paths}
+            self._pcap_follow_timeout = follow_timeout
+        if start_time is not None or end_time is not None:
+            self._pcap_time_window = (_pcap_time(start_time), _pcap_time(end_time))
+        if cache:
+            indexes = [self._pcap_cached_index(p, cache_dir) for p in self._pcap_paths]
+        elif index:
+            indexes = [
+                _PacketIndex.build(p, self._pcap_buffer(p)) for p in self._pcap_paths
+            ]
+        if cache or index:
+            if len(indexes) == 1:
+                self._pcap_index = indexes[0]
+            else:
+                self._pcap_index = _PacketIndex.merge(indexes)
         self.state = "Pcap loaded"
         return self
 
     @chepy.core.ChepyDecorators.call_stack
-    def pcap_dns_queries(self):
+    def pcap_dns(self, bpf_filter: str = "", aggregate: str = None, lazy: bool = False):
+        """Get the DNS queries and answers of the pcap. DNS on UDP and TCP
+        port 53 is decoded straight from the payloads, without dissecting the
+        packets with scapy. Compressed names are followed and DNS over TCP is
+        reassembled.
+
+        Every message is a dict with its time, the client and server
+        addresses, the DNS id, whether it is a response, the rcode, the first
+        question and the A, AAAA, CNAME and TXT answers.
+
+        Args:
+            bpf_filter (str, optional): Apply a BPF filter to the packets
+            aggregate (str, optional): qname or client. Count the queries and
+                responses per query name or per client address, with the time
+                of the first and last message, instead of listing the messages.
+            lazy (bool, optional): Set the state to a generator of messages
+                instead of a list. Ignored with aggregate. Defaults to False.
+
+        Returns:
+            ChepyPlugin: The Chepy object.
+
+        Examples:
+            >>> Chepy("tests/files/test.pcapng").read_pcap().pcap_dns().o[1]
+            {
+                'time': 1234567890.1,
+                'client': '10.0.0.1',
+                'server': '8.8.8.8',
+                'id': 4660,
+                'response': True,
+                'rcode': 0,
+                'qname': b'google.com.',
+                'qtype': 'A',
+                'answers': [
+                    {'name': b'google.com.', 'type': 'A', 'ttl': 300, 'data': '142.250.1.1'}
+                ]
+            }
+            >>> Chepy("tests/files/test.pcapng").read_pcap().pcap_dns(aggregate="qname").o
+            {b'google.com.': {'queries': 1, 'responses': 1, 'first': 1234567890.0, 'last': 1234567890.1}}
+        """
+        if aggregate not in (None, "qname", "client"):
+            raise TypeError("Valid aggregates are qname and client")
+        messages = _dns_records(self._pcap_records(bpf_filter))
+        if aggregate is not None:
+            self.state = _dns_aggregate(messages, aggregate)
+        else:
+            self.state = messages if lazy else list(messages)
+        return self
+
+    @chepy.core.ChepyDecorators.call_stack
+    def pcap_dns_queries(self, workers: int = 1):
         """Get DNS queries and their frame numbers
 
+        Queries are grouped by flow in the order the flows are first seen.
+        Flows are forgotten once their TCP connection is closed or they are
+        idle for 300 seconds of capture time, so memory follows the open
+        flows, and a flow that shows up again goes on in its group. A flow
+        that was idle that long before its first query is put where it shows
+        up again.
+
+        Args:
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
+
         Returns:
             ChepyPlugin: The Chepy object.
 
@@ -341,86 +3788,189 @@ class Pcap(chepy.core.ChepyCore):
                 b'google.com.'
             ]
         """
-        hold = []
-        pcap = scapy.rdpcap(self._pcap_filepath)
-        sessions = pcap.sessions(_full_duplex)
-        for session in sessions:
-            packets = sessions.get(session)
-            for packet in packets:
-                if not scapy.DNSQR in packet:
-                    continue
-                query = packet.getlayer("DNS").qd.qname
-                hold.append(query)
-        self.state = hold
+        parts = self._pcap_map("dns", workers)
+        if parts is not None:
+            sessions = _merge_sessions(parts)
+        else:
+            sessions = _dns_sessions(self._pcap_records())
+        self.state = [query for session in sessions for query in session.queries]
+        return self
+
+    @chepy.core.ChepyDecorators.call_stack
+    def pcap_flows(self, bpf_filter: str = "", workers: int = 1):
+        """Get the IP flows of the pcap, in the order they are first seen.
+        Both directions of a conversation are counted in the same flow, and
+        src is the side that sent the first packet.
+
+        Args:
+            bpf_filter (str, optional): Apply a BPF filter to the packets
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
+
+        Returns:
+            ChepyPlugin: The Chepy object.
+
+        Examples:
+            >>> Chepy("tests/files/test.pcapng").read_pcap().pcap_flows().o
+            [
+                {
+                    'proto': 'UDP',
+                    'src': '10.0.0.1',
+                    'sport': 5353,
+                    'dst': '8.8.8.8',
+                    'dport': 53,
+                    'packets': 2,
+                    'bytes': 152,
+                    'first': 1234567890.0,
+                    'last': 1234567890.1
+                },
+                ...
+            ]
+        """
+        parts = self._pcap_map("flows", workers, bpf_filter)
+        if parts is not None:
+            flows = _FlowTable()
+            for part in parts:
+                flows.extend(part)
+        else:
+            flows = _flow_table(self._pcap_records(bpf_filter))
+        self.state = flows.to_list()
         return self
 
     @chepy.core.ChepyDecorators.call_stack
-    def pcap_http_streams(self):
+    def pcap_http_streams(self, spill_size: int = 10485760, spill_dir: str = None):
         """Get a dict of HTTP req/res
 
-        This method does full fully assemble when data exceeds a
-        certain threshold.
+        TCP streams are reassembled in sequence order, dropping retransmitted
+        data, and every HTTP/1.x request/response pair is returned with its
+        full Content-Length or de-chunked body. Bodies larger than spill_size
+        are written to a file instead, and their payload is a dict of the path
+        of that file and the size of the body, such as
+        ``{'spilled': '/tmp/chepy_http_x1/body_ab12', 'size': 52428800}``.
+        The files of a call share one temporary directory, which is removed
+        by the next call or when the Chepy object is freed, so copy any body
+        that should be kept.
+
+        Pairs are grouped by flow in the order the flows are first seen, and
+        connections that reuse the addresses and ports of an earlier one go
+        on in its group. Connections are forgotten once they are closed or
+        idle for 300 seconds of capture time, so memory follows the open
+        connections. A connection that was idle that long before its first
+        request is put where it shows up again.
+
+        Args:
+            spill_size (int, optional): Largest body kept in memory. Defaults to 10MB.
+            spill_dir (str, optional): Directory to create the temporary
+                directory for spilled bodies in. Defaults to the system
+                temporary directory.
 
         Returns:
             ChepyPlugin: The Chepy object.
         """
-        import scapy.layers.http as scapy_http
+        spill = getattr(self, "_pcap_spill", None)
+        if spill is not None:
+            spill.cleanup()
+        spill = self._pcap_spill = tempfile.TemporaryDirectory(
+            prefix="chepy_http_", dir=spill_dir
+        )
+        flows = {}
+        # results of the closed flows, by the order their flow was first seen
+        done = []
+        count = 0
+        # position of the flows with results, so a connection that reuses
+        # their addresses and ports goes on at the same position
+        positions = {}
 
-        hold = []
-        pcap = scapy.rdpcap(self._pcap_filepath)
-        sessions = pcap.sessions(_full_duplex)
-        for session in sessions:
-            packets = sessions.get(session)
-            req_res = {"request": {}, "response": {}}
-            for packet in packets:
-                if not scapy_http.HTTP in packet:
+        def finish(key, position, flow):
+            flow.close()
+            # flows without HTTP, like the trailing ACKs of a closed
+            # connection, are dropped
+            if flow.results:
+                positions.setdefault(key, position)
+                done.append((position, flow.results))
+
+        # closed and idle connections are forgotten, so only the open ones
+        # are held
+        tcp_flows = _FlowTable(evict=True)
+        segments = _tcp_segments(self._pcap_records(), tcp_flows)
+        for tcp_flow, src, seq, flags, load in segments:
+            for expired in tcp_flows.take_expired():
+                if expired.key in flows:
+                    finish(expired.key, *flows.pop(expired.key))
+            key = tcp_flow.key
+            entry = flows.get(key)
+            if entry is None:
+                position = positions.get(key, count)
+                entry = flows[key] = (position, _HttpFlow(spill_size, spill.name))
+                count += 1
+            flow = entry[1]
+            if not flags & 0x04:
+                flow.stream(src).add(seq, flags, load)
+                if not flow.closed:
                     continue
-                if scapy_http.HTTPRequest in packet:
-                    req_res["request"]["headers"] = packet.getlayer(
-                        scapy_http.HTTPRequest
-                    ).fields
-                    if scapy.Raw in packet:
-                        req_res["request"]["payload"] = packet.getlayer(scapy.Raw).load
-                    else:
-                        req_res["request"]["payload"] = {}
-                if scapy_http.HTTPResponse in packet:
-                    req_res["response"]["headers"] = packet.getlayer(
-                        scapy_http.HTTPResponse
-                    ).fields
-                    if scapy.Raw in packet:
-                        req_res["response"]["payload"] = packet.getlayer(scapy.Raw).load
-                    else:  # pragma: no cover
-                        req_res["response"]["payload"] = {}
-            if len(req_res.get("request")):
-                hold.append(req_res)
+            # RST tears down both directions
+            del flows[key]
+            tcp_flows.close(tcp_flow)
+            finish(key, *entry)
+        for key, entry in flows.items():
+            finish(key, *entry)
+        done.sort(key=lambda item: item[0])
 
-        self.state = hold
+        self.state = [req_res for _, results in done for req_res in results]
         return self
 
     @chepy.core.ChepyDecorators.call_stack
-    def pcap_payload(self, layer: str, bpf_filter: str = ""):
+    def pcap_payload(
+        self,
+        layer: str,
+        bpf_filter: str = "",
+        engine: str = "scapy",
+        workers: int = 1,
+        lazy: bool = False,
+    ):
         """Get an array of payloads based on provided layer
 
         Args:
             layer (str): Required. A valid Scapy layer.
             bpf_filter (str, optional): Apply a BPF filter to the packets
+            engine (str, optional): scapy or fast. The fast engine decodes the
+                packet headers with struct and only dissects packets with scapy
+                when it does not understand one of their layers. Defaults to scapy.
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
+            lazy (bool, optional): Set the state to a generator that reads the
+                pcap as payloads are taken from it, instead of a list. workers
+                is ignored. Defaults to False.
 
         Returns:
             ChepyPlugin: The Chepy object.
+
+        Examples:
+            >>> Chepy("tests/files/test.pcapng").read_pcap().pcap_payload("ICMP", engine="fast").o
+            [b'...', b'...']
         """
-        hold = []
-        for packet in self._pcap_reader_instance(bpf_filter):
-            if not layer in packet:
-                continue
-            check_raw = scapy.Raw in packet
-            if check_raw:
-                hold.append(packet.getlayer(scapy.Raw).load)
-        self.state = hold
+        self._pcap_check_engine(engine)
+        index = self._pcap_index_for(bpf_filter)
+        if index is not None:
+            loads = index.payloads(layer, self._pcap_buffer)
+        else:
+            loads = self._pcap_payloads(
+                layer, bpf_filter, engine, 1 if lazy else workers
+            )
+        loads = (bytes(load) for load in loads)
+        self.state = loads if lazy else list(loads)
         return self
 
     @chepy.core.ChepyDecorators.call_stack
     def pcap_payload_offset(
-        self, layer: str, start: int, end: int = None, bpf_filter: str = ""
+        self,
+        layer: str,
+        start: int,
+        end: int = None,
+        bpf_filter: str = "",
+        engine: str = "scapy",
+        workers: int = 1,
+        lazy: bool = False,
     ):
         """Dump the raw payload by offset.
 
@@ -430,6 +3980,12 @@ class Pcap(chepy.core.ChepyCore):
                 This could be a negative index number.
             end (int, optional): The end index of the offset.
             bpf_filter (str, optional): Apply a BPF filter to the packets
+            engine (str, optional): scapy or fast. See `pcap_payload`.
+                Defaults to scapy.
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
+            lazy (bool, optional): Set the state to a generator instead of a
+                list. See `pcap_payload`. Defaults to False.
 
         Returns:
             ChepyPlugin: The Chepy object.
@@ -441,28 +3997,157 @@ class Pcap(chepy.core.ChepyCore):
             >>> Chepy('tests/files/test.pcapng').read_pcap().pcap_payload_offset('ICMP', -20)
             [b'secret', b'message']
         """
-        hold = []
+        self._pcap_check_engine(engine)
+        index = self._pcap_index_for(bpf_filter)
+        if index is not None:
+            loads = index.payloads(layer, self._pcap_buffer)
+        else:
+            loads = self._pcap_payloads(
+                layer, bpf_filter, engine, 1 if lazy else workers
+            )
+        loads = (bytes(load[start:end]) for load in loads)
+        self.state = loads if lazy else list(loads)
+        return self
 
-        for packet in self._pcap_reader_instance(bpf_filter):
-            if not layer in packet:
-                continue
-            if not scapy.Raw in packet:  # pragma: no cover
-                continue
-            load = packet.getlayer("Raw").load
-            hold.append(load[start:end])
+    @chepy.core.ChepyDecorators.call_stack
+    def pcap_search(
+        self,
+        pattern,
+        bpf_filter: str = "",
+        ignore_case: bool = False,
+        overlap: int = 4096,
+    ):
+        """Search the reassembled TCP streams of the pcap for a regex, or a
+        list of them that are compiled into one pattern and checked in a
+        single pass.
+
+        Both directions of every connection are put back into sequence order
+        and searched as they are read, so matches that span segments are
+        found without keeping whole streams in memory. flow is the position
+        of the connection in `pcap_flows`, src is the sender and offset is
+        the position of the match in the bytes sent by src.
+
+        Args:
+            pattern (str|bytes|list): Required. A regex or a list of them.
+            bpf_filter (str, optional): Apply a BPF filter to the packets
+            ignore_case (bool, optional): Match case insensitively. Defaults
+                to False.
+            overlap (int, optional): Bytes of a stream that are searched again
+                with the next segment. Matches that span segments are found
+                when they are no longer than this. Defaults to 4096.
+
+        Returns:
+            ChepyPlugin: The Chepy object.
+
+        Examples:
+            >>> Chepy("tests/files/test.pcapng").read_pcap().pcap_search([r"Host: \\S+", "evil.com"]).o
+            [
+                {
+                    'flow': 3,
+                    'src': '10.0.0.1',
+                    'sport': 49152,
+                    'dst': '93.184.216.34',
+                    'dport': 80,
+                    'offset': 16,
+                    'match': b'Host: example.com'
+                },
+                ...
+            ]
+        """
+        compiled = _search_pattern(pattern, ignore_case)
+        found = []
+        streams = {}
+        flows = _FlowTable()
+        for flow, src, seq, flags, load in _tcp_segments(
+            self._pcap_records(bpf_filter), flows
+        ):
+            key = (flow.key, src)
+            stream = streams.get(key)
+            if stream is None:
+                stream = streams[key] = _TcpStream(
+                    _SearchSink(compiled, overlap, flow, src, found)
+                )
+            stream.add(seq, flags, load)
+            if stream.closed:
+                del streams[key]
+        for stream in streams.values():
+            stream.flush()
+            stream.close()
+
+        ids = {key: n for n, key in enumerate(flows.flows)}
+        hold = []
+        for flow, (src, sport), offset, match in found:
+            proto, lo, lo_port, hi, hi_port = flow.key
+            dst, dport = (
+                (hi, hi_port) if (src, sport) == (lo, lo_port) else (lo, lo_port)
+            )
+            hold.append(
+                {
+                    "flow": ids[flow.key],
+                    "src": _ntop(src),
+                    "sport": sport,
+                    "dst": _ntop(dst),
+                    "dport": dport,
+                    "offset": offset,
+                    "match": match,
+                }
+            )
         self.state = hold
         return self
 
     @chepy.core.ChepyDecorators.call_stack
-    def pcap_to_dict(self, bpf_filter: str = ""):
+    def pcap_to_dict(
+        self,
+        bpf_filter: str = "",
+        workers: int = 1,
+        columnar: bool = False,
+        lazy: bool = False,
+    ):
         """Convert a pcap to a dict
 
         Args:
             bpf_filter (str, optional): Apply a BPF filter to the packets
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
+            columnar (bool, optional): Instead of a dict per packet, return a
+                dict of NumPy arrays with one row per packet, keyed by time,
+                len and layer.field names such as IP.src and TCP.dport. Rows
+                of packets without the field are masked. Bytes fields are a
+                dict of offsets and buffer arrays, where row i is
+                buffer[offsets[i]:offsets[i + 1]]. Defaults to False.
+            lazy (bool, optional): Set the state to a generator that dissects
+                packets as dicts are taken from it. workers is ignored, and
+                columnar output is always built in full. Defaults to False.
 
         Returns:
             ChepyPlugin: The Chepy object.
+
+        Examples:
+            >>> c = Chepy("tests/files/test.pcapng").read_pcap()
+            >>> cols = c.pcap_to_dict(columnar=True).o
+            >>> cols["IP.src"][cols["TCP.dport"] == 80]
         """
+        if columnar:
+            columns = _ColumnarPcap()
+            parts = self._pcap_map("columns", workers, bpf_filter)
+            if parts is not None:
+                for part in parts:
+                    columns.extend(part)
+            else:
+                for packet in self._pcap_reader_instance(bpf_filter):
+                    columns.add(packet)
+            self.state = columns.to_arrays()
+            return self
+        if lazy:
+            self.state = (
+                _Pkt2Dict(packet).to_dict()
+                for packet in self._pcap_reader_instance(bpf_filter)
+            )
+            return self
+        parts = self._pcap_map("to_dict", workers, bpf_filter)
+        if parts is not None:
+            self.state = [d for part in parts for d in _unpickle_dicts(part)]
+            return self
         hold = []
         for packet in self._pcap_reader_instance(bpf_filter):
             hold.append(_Pkt2Dict(packet).to_dict())
@@ -470,67 +4155,91 @@ class Pcap(chepy.core.ChepyCore):
         return self
 
     @chepy.core.ChepyDecorators.call_stack
-    def pcap_layer_stats(self, bpf_filter: str = ""):
+    def pcap_layer_stats(self, bpf_filter: str = "", workers: int = 1):
         """Get a count of all layers in the pcap
 
         Args:
             bpf_filter (str, optional): Apply a BPF filter to the packets
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
 
         Returns:
             ChepyPlugin: The Chepy object.
         """
-
-        def get_layers(pkt):
-            yield pkt.name
-            while pkt.payload:
-                pkt = pkt.payload
-                yield pkt.name
-
         layer_dict = collections.OrderedDict()
-        for packet in self._pcap_reader_instance(bpf_filter):
-            for key in list(get_layers(packet)):
-                if layer_dict.get(key):
-                    layer_dict[key] += 1
-                else:
-                    layer_dict[key] = 1
+        index = self._pcap_index_for(bpf_filter)
+        if index is not None:
+            for entry in index.entries:
+                for key in entry.layers:
+                    key = index.names[key]
+                    layer_dict[key] = layer_dict.get(key, 0) + 1
+            self.state = dict(layer_dict)
+            return self
 
+        parts = self._pcap_map("layer_stats", workers, bpf_filter)
+        if parts is not None:
+            layer_dict = _merge_counts(parts)
+        else:
+            layer_dict = _layer_counts(self._pcap_reader_instance(bpf_filter))
         self.state = dict(layer_dict)
         return self
 
-    def pcap_convos(self, bpf_filter: str = ""):
+    def pcap_convos(self, bpf_filter: str = "", workers: int = 1, output: str = "dict"):
         """Get layer 3 conversation states
 
+        The layer of a conversation is the third layer of its packets. IP
+        packets with nothing past their IP layer have none, and are left out.
+
         Args:
             bpf_filter (str, optional): Apply a BPF filter to the packets
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
+            output (str, optional): dict, stats or edges. dict maps every source
+                to its layers and destinations. stats is a list with the packet
+                and byte counts and first/last seen times of each src, layer,
+                dst pair. edges is the same as NumPy arrays, where src and dst
+                index into the nodes array. Defaults to dict.
 
         Returns:
             ChepyPlugin: The Chepy object.
         """
-        convo = collections.OrderedDict()
-
-        for packet in self._pcap_reader_instance(bpf_filter):
-            if not scapy.IP in packet:  # pragma: no cover
-                continue
-            ip_layer = packet.getlayer(scapy.IP)
-            src = ip_layer.src
-            dst = ip_layer.dst
-            layer_3 = packet.getlayer(2).name
-            if not convo.get(src):
-                convo[src] = {}
-            if convo[src].get(layer_3):
-                if dst not in convo[src][layer_3]:
-                    convo[src][layer_3].append(dst)
+        if output not in ("dict", "stats", "edges"):  # pragma: no cover
+            raise TypeError("Valid outputs are dict, stats and edges")
+        index = self._pcap_index_for(bpf_filter)
+        if index is not None:
+            convos = _Convos()
+            for entry in index.entries:
+                if entry.convo is None:
+                    continue
+                src, layer_3, dst = entry.convo
+                convos.add(src, layer_3, dst, entry.length, entry.time)
+        else:
+            parts = self._pcap_map("convos", workers, bpf_filter)
+            if parts is not None:
+                convos = _merge_convos(parts)
             else:
-                convo[src][layer_3] = [dst]
-        self.state = dict(convo)
+                convos = _layer3_convos(self._pcap_reader_instance(bpf_filter))
+
+        if output == "stats":
+            self.state = convos.to_stats()
+        elif output == "edges":
+            self.state = convos.to_edges()
+        else:
+            self.state = convos.to_dict()
         return self
 
     @chepy.core.ChepyDecorators.call_stack
-    def pcap_usb_keyboard(self, layout: str = "qwerty"):
+    def pcap_usb_keyboard(self, layout: str = "qwerty", workers: int = 1):
         """Decode usb keyboard pcap
 
+        All six key slots of each HID report are decoded. A key is only typed
+        in the report where it is first pressed, so keys that are held down
+        across reports are not repeated. Either shift key shifts the keys.
+
         Args:
             layout (str, optional): Layout of the keyboard. Defaults to "qwerty".
+            workers (int, optional): Number of processes to split the pcap
+                across. Defaults to 1.
 
         Raises:
             TypeError: If layout is not qwerty or dvorak
@@ -547,26 +4256,33 @@ class Pcap(chepy.core.ChepyCore):
         else:  # pragma: no cover
             raise TypeError("Valid layouts are qwerty and dvorak")
 
-        packets = scapy.PcapReader(self._pcap_filepath)
-        hold = []
-
-        for packet in packets:
-            if not scapy.Raw in packet:  # pragma: no cover
-                continue
-            load = packet.getlayer("Raw").load
-            key_press = binascii.hexlify(load)[-16:]
-            if key_press == "0000000000000000":  # pragma: no cover
+        index = self._pcap_index_for()
+        if index is not None:
+            loads = index.payloads(buffer=self._pcap_buffer)
+        else:
+            loads = self._pcap_payloads("Raw", "", "scapy", workers)
+        # boot protocol reports are the last 8 bytes of the payload: the
+        # modifier byte, a reserved byte and six key slots
+        reports = bytearray()
+        for load in loads:
+            if len(load) < 3:  # pragma: no cover
                 continue
-            shift, _, key = re.findall(b".{2}", key_press)[0:3]
-            shift_pressed = bool(shift == b"02")
-            pressed = key_map.get(key.decode())
-            if shift_pressed:
-                special = shift_modifier.get(key.decode())
-                if special:
-                    hold.append(special)
-                elif pressed:
-                    hold.append(pressed.upper())
-            elif pressed:
-                hold.append(pressed)
+            reports += bytes(load[-8:]).ljust(8, b"\x00")
+        reports = np.frombuffer(bytes(reports), dtype=np.uint8).reshape(-1, 8)
+
+        # keycodes 1 to 3 are error reports that say nothing about the keys
+        reports = reports[~((reports[:, 2:] >= 1) & (reports[:, 2:] <= 3)).any(axis=1)]
+        keys = reports[:, 2:]
+        previous = np.zeros_like(keys)
+        previous[1:] = keys[:-1]
+        # a key is typed in the report where it shows up, not while it is held
+        held = (keys[:, :, None] == previous[:, None, :]).any(axis=2)
+        pressed = (keys != 0) & ~held
+
+        plain, shifted = _hid_tables(key_map, shift_modifier)
+        shift = (reports[:, 0] & 0x22).astype(bool)
+        shift = np.broadcast_to(shift[:, None], keys.shape)
+        chars = np.where(shift, shifted[keys], plain[keys])[pressed]
+        hold = chars.tolist()
         self.state = "".join(hold)
         return self
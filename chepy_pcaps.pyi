@@ -1,5 +1,6 @@
 import chepy.core
-from typing import Any
+import datetime
+from typing import Any, Union
 
 scapy: Any
 
@@ -16,12 +17,15 @@ class PcapUSB:
 
 class Pcap(chepy.core.ChepyCore):
     state: str = ...
-    def read_pcap(self): ...
-    def pcap_dns_queries(self): ...
-    def pcap_http_streams(self): ...
-    def pcap_payload(self, layer: str, bpf_filter: str=...) -> Any: ...
-    def pcap_payload_offset(self, layer: str, start: int, end: int=..., bpf_filter: str=...) -> Any: ...
-    def pcap_to_dict(self, bpf_filter: str=...) -> Any: ...
-    def pcap_layer_stats(self, bpf_filter: str=...) -> Any: ...
-    def pcap_convos(self, bpf_filter: str=...) -> Any: ...
-    def pcap_usb_keyboard(self, layout: str=...) -> Any: ...
+    def read_pcap(self, index: bool=..., cache: bool=..., cache_dir: str=..., start_time: Union[float, str, datetime.datetime]=..., end_time: Union[float, str, datetime.datetime]=..., follow: bool=..., follow_timeout: float=...): ...
+    def pcap_dns(self, bpf_filter: str=..., aggregate: str=..., lazy: bool=...) -> Any: ...
+    def pcap_dns_queries(self, workers: int=...): ...
+    def pcap_flows(self, bpf_filter: str=..., workers: int=...) -> Any: ...
+    def pcap_http_streams(self, spill_size: int=..., spill_dir: str=...): ...
+    def pcap_payload(self, layer: str, bpf_filter: str=..., engine: str=..., workers: int=..., lazy: bool=...) -> Any: ...
+    def pcap_payload_offset(self, layer: str, start: int, end: int=..., bpf_filter: str=..., engine: str=..., workers: int=..., lazy: bool=...) -> Any: ...
+    def pcap_search(self, pattern: Union[str, bytes, list], bpf_filter: str=..., ignore_case: bool=..., overlap: int=...) -> Any: ...
+    def pcap_to_dict(self, bpf_filter: str=..., workers: int=..., columnar: bool=..., lazy: bool=...) -> Any: ...
+    def pcap_layer_stats(self, bpf_filter: str=..., workers: int=...) -> Any: ...
+    def pcap_convos(self, bpf_filter: str=..., workers: int=..., output: str=...) -> Any: ...
+    def pcap_usb_keyboard(self, layout: str=..., workers: int=...) -> Any: ...
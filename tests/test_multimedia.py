@@ -0,0 +1,258 @@
+import io
+import warnings
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from chepy_multimedia import Multimedia
+
+
+def _png(size=(20, 10), mode: str = "RGB", color="red") -> bytes:
+    fh = io.BytesIO()
+    Image.new(mode, size, color).save(fh, "png")
+    return fh.getvalue()
+
+
+def _noise(width: int, height: int, mode: str = "RGB") -> bytes:
+    pixels = np.random.default_rng(1).integers(0, 256, (height, width, 3), np.uint8)
+    fh = io.BytesIO()
+    Image.fromarray(pixels).convert(mode).save(fh, "png")
+    return fh.getvalue()
+
+
+def _pixels(data: bytes):
+    image = Image.open(io.BytesIO(data))
+    return image.mode, np.asarray(image)
+
+
+def _bits(plane) -> bytes:
+    return "".join(map(str, plane.ravel())).encode()
+
+
+def test_image_pipeline_states_are_bytes():
+    c = Multimedia(_png()).image_pipeline().invert_image()
+    assert c.get_state(0)[:4] == b"\x89PNG"
+    c.invert_image().copy_state()
+    assert all(isinstance(state, bytes) for state in c.states.values())
+    c.resize_image(10, 20)
+    assert Image.open(io.BytesIO(c.states[0])).size == (10, 20)
+
+
+def test_image_pipeline_decodes_once(monkeypatch):
+    import chepy_multimedia
+
+    opened = []
+    open_image = Image.open
+
+    def counted(fh, *args, **kwargs):
+        opened.append(fh)
+        return open_image(fh, *args, **kwargs)
+
+    monkeypatch.setattr(chepy_multimedia.Image, "open", counted)
+    data = _noise(9, 5)
+    plain = Multimedia(data).invert_image().rotate_image(90).grayscale_image().o
+    assert len(opened) == 3
+    c = Multimedia(data).image_pipeline()
+    assert c.invert_image().rotate_image(90).grayscale_image().o == plain
+    assert len(opened) == 4
+    assert type(c.states) is dict
+    # a state that was written since is decoded again
+    c.state = data
+    assert c.invert_image().o == Multimedia(data).invert_image().o
+    assert len(opened) == 6
+
+
+def test_bit_dumps_keep_their_default_order():
+    for size in ((7, 7), (9, 5)):
+        data = _noise(*size)
+        green = np.asarray(Image.open(io.BytesIO(data)))[:, :, 1]
+        assert Multimedia(data).lsb_dump_by_channel("g").o == _bits(green & 1)
+        assert Multimedia(data).msb_dump_by_channel("g").o == _bits((green >> 7).T)
+
+
+def test_bit_dumps_column_first_is_deprecated():
+    data = _noise(9, 5)
+    green = np.asarray(Image.open(io.BytesIO(data)))[:, :, 1]
+    with pytest.warns(DeprecationWarning, match="order") as caught:
+        lsb = Multimedia(data).lsb_dump_by_channel("g", True).o
+    assert caught[0].filename == __file__
+    assert lsb == _bits((green & 1).T)
+    with pytest.warns(DeprecationWarning) as caught:
+        msb = Multimedia(data).msb_dump_by_channel("g", True, order="row").o
+    assert caught[0].filename == __file__
+    assert msb == _bits(green >> 7)
+
+
+def test_bit_dumps_order():
+    data = _noise(9, 5)
+    green = np.asarray(Image.open(io.BytesIO(data)))[:, :, 1] >> 7
+    for rows in (None, 2):
+        c = Multimedia(data)
+        if rows:
+            c.image_tiles(rows=rows)
+        assert c.msb_dump_by_channel("g", order="row").o == _bits(green)
+        c = Multimedia(data)
+        if rows:
+            c.image_tiles(rows=rows)
+        assert c.msb_dump_by_channel("g", order="column").o == _bits(green.T)
+
+
+def _split_by_pixel(data: bytes):
+    """Split the color channels a pixel at a time, the way
+    split_color_channels did before it was vectorised
+    """
+    pixels = np.asarray(Image.open(io.BytesIO(data)).convert("RGBA"))
+    height, width = pixels.shape[:2]
+    hold = {}
+    for i, name in enumerate(("red", "green", "blue")):
+        channel = np.zeros((height, width, 4), np.uint8)
+        channel[:, :, 3] = 255
+        for y in range(height):
+            for x in range(width):
+                channel[y, x, i] = pixels[y, x, i]
+        fh = io.BytesIO()
+        Image.fromarray(channel, "RGBA").save(fh, "png")
+        hold[name] = fh.getvalue()
+    return hold
+
+
+def test_split_color_channels():
+    for mode in ("RGB", "RGBA", "L", "P"):
+        data = _noise(13, 7, mode)
+        expected = {k: _pixels(v) for k, v in _split_by_pixel(data).items()}
+        split = Multimedia(data).split_color_channels().o
+        assert sorted(split) == sorted(expected)
+        for name, channel in split.items():
+            mode_, pixels = _pixels(channel)
+            assert mode_ == expected[name][0], (mode, name)
+            assert np.array_equal(pixels, expected[name][1]), (mode, name)
+        gray = Multimedia(data).split_color_channels(output="gray").o
+        arrays = Multimedia(data).split_color_channels(output="array").o
+        for i, name in enumerate(("red", "green", "blue")):
+            band = expected[name][1][:, :, i]
+            assert _pixels(gray[name])[0] == "L"
+            assert np.array_equal(_pixels(gray[name])[1], band), (mode, name)
+            assert arrays[name].dtype == np.uint8
+            assert np.array_equal(arrays[name], band), (mode, name)
+        # the arrays do not share memory, so changing one leaves the others
+        arrays["red"][:] = 0
+        assert np.array_equal(arrays["green"], expected["green"][1][:, :, 1])
+
+    data = _noise(13, 7)
+    inverted = Multimedia(data).invert_image().o
+    piped = Multimedia(data).image_pipeline().invert_image()
+    assert (
+        piped.split_color_channels().o == Multimedia(inverted).split_color_channels().o
+    )
+
+
+def _stream(pixels, candidate) -> bytes:
+    """Read a bit plane stream of a bit_plane_sweep candidate a pixel and a
+    bit at a time
+    """
+    height, width = pixels.shape[:2]
+    if candidate["order"] == "row":
+        coords = [(y, x) for y in range(height) for x in range(width)]
+    else:
+        coords = [(y, x) for x in range(width) for y in range(height)]
+    if candidate["reverse"]:
+        coords.reverse()
+    bits = [
+        (int(pixels[y, x, "rgba".index(channel)]) >> candidate["bit"]) & 1
+        for y, x in coords
+        for channel in candidate["channels"]
+    ]
+    bits += [0] * (-len(bits) % 8)
+    shifts = range(7, -1, -1) if candidate["bit_order"] == "msb" else range(8)
+    return bytes(
+        sum(bit << shift for bit, shift in zip(bits[i : i + 8], shifts))
+        for i in range(0, len(bits), 8)
+    )
+
+
+def _stego_png(message: bytes, width: int, height: int) -> bytes:
+    """Noise with message in the red LSBs, read row by row, MSB first"""
+    pixels = np.random.default_rng(2).integers(0, 256, (height, width, 4), np.uint8)
+    bits = np.unpackbits(np.frombuffer(message, np.uint8))
+    red = pixels[:, :, 0].ravel()
+    red[: len(bits)] = (red[: len(bits)] & 0xFE) | bits
+    pixels[:, :, 0] = red.reshape(height, width)
+    fh = io.BytesIO()
+    Image.fromarray(pixels, "RGBA").save(fh, "png")
+    return fh.getvalue()
+
+
+def test_bit_plane_sweep(tmp_path):
+    message = b"flag{bit_planes_in_one_decode!!}"
+    data = _stego_png(message, 32, 8)
+    pixels = np.asarray(Image.open(io.BytesIO(data)))
+    found = Multimedia(data).bit_plane_sweep(top=12, sample=16).o
+    assert len(found) == 12
+    best = found[0]
+    assert (best["channels"], best["bit"], best["order"]) == ("r", 0, "row")
+    assert (best["reverse"], best["bit_order"], best["printable"]) == (
+        False,
+        "msb",
+        1.0,
+    )
+    assert best["data"] == message
+    lsb = Multimedia(data).lsb_dump_by_channel("r", packed=True, order="row").o
+    assert best["data"] == lsb
+    for candidate in found:
+        assert candidate["data"] == _stream(pixels, candidate), candidate
+    ranks = [(c["magic"] is not None, c["printable"]) for c in found]
+    assert ranks == sorted(ranks, reverse=True)
+
+    for name in ("a.png", "b.png"):
+        (tmp_path / name).write_bytes(data)
+    (tmp_path / "notes.txt").write_bytes(b"not an image")
+    for workers in (1, 2):
+        swept = Multimedia(str(tmp_path)).bit_plane_sweep(12, 16, workers).o
+        assert swept == {"a.png": found, "b.png": found}
+
+
+def test_bit_plane_sweep_tiny_image():
+    for mode in ("RGB", "RGBA"):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            # padded to a byte, the rgb planes would read as a printable 0x60
+            data = _png((1, 1), mode, (0, 255, 255, 255))
+            found = Multimedia(data).bit_plane_sweep(top=200).o
+        # a pixel holds at most 4 bits of a plane, less than a byte
+        assert all(c["printable"] == 0.0 and c["magic"] is None for c in found)
+        assert all(len(c["data"]) == 1 for c in found)
+    with pytest.raises(TypeError):
+        Multimedia(_png((1, 1))).bit_plane_sweep(sample=0)
+
+
+_TILED = (
+    ("invert_image", ()),
+    ("image_brightness", (1.7,)),
+    ("image_contrast", (0.6,)),
+    ("grayscale_image", ()),
+    ("blur_image", ()),
+    ("blur_image", ("png", True, 3)),
+    ("blur_image", ("png", True, (1, 4))),
+    ("lsb_dump_by_channel", ("b",)),
+    ("msb_dump_by_channel", ("r", False, True)),
+)
+
+
+def test_image_tiles_match_whole_image():
+    for mode in ("RGB", "RGBA", "L"):
+        data = _noise(23, 17, mode)
+        for method, args in _TILED:
+            if mode == "L" and "dump" in method:
+                continue
+            whole = getattr(Multimedia(data), method)(*args).o
+            for rows in (1, 2, 5, 64):
+                c = Multimedia(data).image_tiles(rows=rows)
+                tiled = getattr(c, method)(*args).o
+                if "dump" in method:
+                    assert tiled == whole, (mode, method, rows)
+                else:
+                    mode_, pixels = _pixels(tiled)
+                    expected_mode, expected = _pixels(whole)
+                    assert mode_ == expected_mode, (mode, method, rows)
+                    assert np.array_equal(pixels, expected), (mode, method, rows)
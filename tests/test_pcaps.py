@@ -0,0 +1,964 @@
+import gzip
+import lzma
+import os
+import struct
+import subprocess
+import sys
+import zlib
+
+import pytest
+from scapy.all import (
+    ARP,
+    DNS,
+    DNSQR,
+    DNSRR,
+    ICMP,
+    IP,
+    TCP,
+    UDP,
+    Dot1Q,
+    Ether,
+    IPOption_RR,
+    IPv6,
+    IPv6ExtHdrDestOpt,
+    IPv6ExtHdrHopByHop,
+    Raw,
+    rdpcap,
+    wrpcap,
+)
+
+from chepy_pcaps import Pcap
+
+
+def _ether():
+    # fixed addresses, so scapy does not look up the destination mac
+    return Ether(src="00:11:22:33:44:55", dst="66:77:88:99:aa:bb")
+
+
+def _tcp_session(
+    client: bytes, server: bytes = b"", split=(), port: int = 80, client_port=40000
+):
+    """Packets of one TCP connection. The client data is sent in segments cut
+    at the offsets in split.
+    """
+    c, s = dict(src="10.0.0.1", dst="10.0.0.2"), dict(src="10.0.0.2", dst="10.0.0.1")
+    cs, ss = dict(sport=client_port, dport=port), dict(sport=port, dport=client_port)
+    packets = [
+        _ether() / IP(**c) / TCP(flags="S", seq=100, **cs),
+        _ether() / IP(**s) / TCP(flags="SA", seq=500, ack=101, **ss),
+    ]
+    bounds = [0, *split, len(client)]
+    for start, end in zip(bounds, bounds[1:]):
+        packets.append(
+            _ether()
+            / IP(**c)
+            / TCP(flags="PA", seq=101 + start, ack=501, **cs)
+            / Raw(client[start:end])
+        )
+    if server:
+        packets.append(
+            _ether()
+            / IP(**s)
+            / TCP(flags="PA", seq=501, ack=101 + len(client), **ss)
+            / Raw(server)
+        )
+    for n, packet in enumerate(packets):
+        packet.time = 1000 + n
+    return packets
+
+
+def _mixed_packets(count: int = 200):
+    """A capture with a mix of the layers the fast decoders handle and the
+    ones they leave to scapy
+    """
+    packets = []
+    for n in range(count):
+        a, b = "10.0.%d.1" % (n % 7), "10.1.0.%d" % (n % 11)
+        load = Raw(b"data-%d" % n)
+        kind = n % 10
+        if kind == 0:
+            packet = (
+                _ether() / IP(src=a, dst=b) / TCP(sport=40000 + n, dport=4444) / load
+            )
+        elif kind == 1:
+            packet = _ether() / IP(src=b, dst=a) / UDP(sport=5000, dport=9999) / load
+        elif kind == 2:
+            packet = (
+                _ether()
+                / IP(src=a, dst="8.8.8.8")
+                / UDP(sport=30000 + n, dport=53)
+                / DNS(id=n, rd=1, qd=DNSQR(qname="host%d.example.com" % n))
+            )
+        elif kind == 3:
+            packet = (
+                _ether()
+                / IP(src="8.8.8.8", dst=a)
+                / UDP(sport=53, dport=30000 + n - 1)
+                / DNS(
+                    id=n - 1,
+                    qr=1,
+                    qd=DNSQR(qname="host%d.example.com" % (n - 1)),
+                    an=DNSRR(
+                        rrname="host%d.example.com" % (n - 1),
+                        rdata="192.0.2.%d" % n,
+                    ),
+                )
+            )
+        elif kind == 4:
+            packet = _ether() / IP(src=a, dst=b) / ICMP() / load
+        elif kind == 5:
+            packet = (
+                _ether()
+                / IPv6(src="fd00::%x" % n, dst="fd00::1")
+                / TCP(sport=1234, dport=443)
+                / load
+            )
+        elif kind == 6:
+            packet = (
+                _ether()
+                / Dot1Q(vlan=10)
+                / IP(src=a, dst=b)
+                # scapy defaults the source port to 53, which it dissects as DNS
+                / UDP(sport=7000, dport=7000)
+                / load
+            )
+        elif kind == 7:
+            packet = _ether() / ARP(psrc=a, pdst=b)
+        elif kind == 8:
+            packet = _ether() / IP(src=a, dst=b, flags="MF") / TCP(dport=80) / load
+        else:
+            packet = (
+                _ether()
+                / IP(src=a, dst=b, options=[IPOption_RR()])
+                / TCP(sport=80, dport=50000 + n)
+                / load
+            )
+        packet.time = 1000 + n / 10
+        packets.append(packet)
+    return packets
+
+
+_LAYERS = ("Raw", "IP", "IPv6", "TCP", "UDP", "ICMP", "DNS", "Dot1Q", "802.1Q", "ARP")
+
+
+def _pcap(tmp_path, packets, name: str = "test.pcap"):
+    path = str(tmp_path / name)
+    wrpcap(path, packets)
+    return path
+
+
+@pytest.fixture(scope="module")
+def mixed_pcap(tmp_path_factory):
+    return _pcap(tmp_path_factory.mktemp("mixed"), _mixed_packets())
+
+
+def test_pcap_search_match_spans_segments(tmp_path):
+    request = b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n"
+    path = _pcap(
+        tmp_path, _tcp_session(request, split=[len(b"GET / HTTP/1.1\r\nHost: exam")])
+    )
+    found = Pcap(path).read_pcap().pcap_search([rb"Host: [^\r]+"]).o
+    assert [(m["offset"], m["match"]) for m in found] == [(16, b"Host: example.com")]
+
+
+def test_pcap_search_match_at_end_of_stream(tmp_path):
+    path = _pcap(tmp_path, _tcp_session(b"token=abc", split=[7]))
+    found = Pcap(path).read_pcap().pcap_search(rb"token=\w+").o
+    assert [m["match"] for m in found] == [b"token=abc"]
+
+
+def test_pcap_search_small_overlap(tmp_path):
+    data = b"".join(b"id=%d;" % n for n in range(50))
+    path = _pcap(tmp_path, _tcp_session(data, split=range(7, len(data), 7)))
+    found = Pcap(path).read_pcap().pcap_search(rb"id=\d+", overlap=8).o
+    assert [m["match"] for m in found] == [b"id=%d" % n for n in range(50)]
+
+
+def test_pcap_search_flushes_data_after_a_gap(tmp_path):
+    packets = _tcp_session(b"aaaa" + b"secret=1", split=[4])
+    del packets[2]
+    path = _pcap(tmp_path, packets)
+    found = Pcap(path).read_pcap().pcap_search(rb"secret=\d").o
+    assert [m["match"] for m in found] == [b"secret=1"]
+
+
+def test_pcap_lazy_payloads_survive_reload(tmp_path):
+    path = _pcap(tmp_path, _tcp_session(b"hello", b"world"))
+    for kwargs in ({}, {"index": True}):
+        c = Pcap(path).read_pcap(**kwargs)
+        started = c.pcap_payload("Raw", lazy=True, engine="fast").o
+        first = next(started)
+        waiting = c.pcap_payload("Raw", lazy=True, engine="fast").o
+        c.state = path
+        c.read_pcap(**kwargs)
+        assert [bytes(first)] + [bytes(load) for load in started] == [
+            b"hello",
+            b"world",
+        ]
+        assert [bytes(load) for load in waiting] == [b"hello", b"world"]
+
+
+def test_pcap_reload_closes_map(tmp_path):
+    path = _pcap(tmp_path, _tcp_session(b"hello", b"world"))
+    c = Pcap(path).read_pcap(index=True)
+    assert c.pcap_payload("Raw").o == [b"hello", b"world"]
+    mapping = c._pcap_buffers[path].obj
+    c.state = path
+    c.read_pcap()
+    assert mapping.closed
+
+
+def _layered_packets():
+    packets = [
+        _ether()
+        / IP(src="1.1.1.1", dst="2.2.2.2", options=[IPOption_RR()])
+        / TCP()
+        / Raw(b"opt"),
+        _ether() / IP(src="1.1.1.1", dst="2.2.2.2") / TCP() / Raw(b"plain"),
+        _ether() / IP(src="3.3.3.3", dst="4.4.4.4"),
+        _ether() / IP(src="5.5.5.5", dst="6.6.6.6") / ICMP() / Raw(b"ping"),
+    ]
+    for n, packet in enumerate(packets):
+        packet.time = 1000 + n
+    return packets
+
+
+def test_pcap_index_finds_layers_in_fields(tmp_path):
+    path = _pcap(tmp_path, _layered_packets())
+    for layer in ("IPOption_RR", "IP Option Record Route", "TCP", "Raw"):
+        expected = Pcap(path).read_pcap().pcap_payload(layer).o
+        assert Pcap(path).read_pcap(index=True).pcap_payload(layer).o == expected
+    assert Pcap(path).read_pcap(index=True).pcap_payload("IPOption_RR").o == [b"opt"]
+
+
+def test_pcap_index_convos(tmp_path):
+    path = _pcap(tmp_path, _layered_packets())
+    expected = Pcap(path).read_pcap().pcap_convos().o
+    assert expected == {
+        "1.1.1.1": {"IP Option Record Route": ["2.2.2.2"], "TCP": ["2.2.2.2"]},
+        "5.5.5.5": {"ICMP": ["6.6.6.6"]},
+    }
+    assert Pcap(path).read_pcap(index=True).pcap_convos().o == expected
+    cache = str(tmp_path / "cache")
+    Pcap(path).read_pcap(cache=True, cache_dir=cache)
+    c = Pcap(path).read_pcap(cache=True, cache_dir=cache)
+    assert c.pcap_convos().o == expected
+    assert c.pcap_payload("IPOption_RR").o == [b"opt"]
+
+
+def test_pcap_index_cache_key(tmp_path, monkeypatch):
+    from chepy_pcaps import _PacketIndex
+
+    path = _pcap(tmp_path, _layered_packets())
+    cache = str(tmp_path / "cache")
+    calls = {"file_key": 0, "build": 0}
+    file_key, build = _PacketIndex.file_key, _PacketIndex.build.__func__
+
+    def counted_key(*args):
+        calls["file_key"] += 1
+        return file_key(*args)
+
+    def counted_build(cls, *args):
+        calls["build"] += 1
+        return build(cls, *args)
+
+    monkeypatch.setattr(_PacketIndex, "file_key", staticmethod(counted_key))
+    monkeypatch.setattr(_PacketIndex, "build", classmethod(counted_build))
+    expected = Pcap(path).read_pcap(cache=True, cache_dir=cache).pcap_convos().o
+    assert calls == {"file_key": 1, "build": 1}
+    assert Pcap(path).read_pcap(cache=True, cache_dir=cache).pcap_convos().o == (
+        expected
+    )
+    assert calls == {"file_key": 2, "build": 1}
+    # a change in the middle with the same size and mtime is caught
+    stat = os.stat(path)
+    with open(path, "r+b") as fh:
+        fh.seek(stat.st_size // 2)
+        middle = fh.read(1)
+        fh.seek(stat.st_size // 2)
+        fh.write(bytes([middle[0] ^ 0xFF]))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    Pcap(path).read_pcap(cache=True, cache_dir=cache)
+    assert calls == {"file_key": 3, "build": 2}
+
+
+def _mixed_convos(packets):
+    """The (src, layer, dst) stats of _mixed_packets, worked out from how each
+    kind of packet is built. The layer is the third layer of the packet, so
+    it is IP for the VLAN packets, and the IPv6 and ARP packets have none.
+    """
+    convos = {}
+    for n, packet in enumerate(packets):
+        a, b = "10.0.%d.1" % (n % 7), "10.1.0.%d" % (n % 11)
+        key = {
+            0: (a, "TCP", b),
+            1: (b, "UDP", a),
+            2: (a, "UDP", "8.8.8.8"),
+            3: ("8.8.8.8", "UDP", a),
+            4: (a, "ICMP", b),
+            6: (a, "IP", b),
+            8: (a, "TCP", b),
+            9: (a, "IP Option Record Route", b),
+        }.get(n % 10)
+        if key is None:
+            continue
+        stats = convos.setdefault(key, [0, 0, 1000 + n / 10])
+        stats[0] += 1
+        stats[1] += len(packet)
+        stats[2:] = [stats[2], 1000 + n / 10]
+    return convos
+
+
+def test_pcap_convos_stats(tmp_path):
+    packets = _mixed_packets()
+    # IP packets with nothing past the IP layer have no layer to key by
+    for n in range(3):
+        ip_only = _ether() / IP(src="10.9.9.9", dst="10.9.9.%d" % n)
+        ip_only.time = 1001 + n
+        packets.append(ip_only)
+    path = _pcap(tmp_path, packets)
+    convos = _mixed_convos(_mixed_packets())
+    expected = [
+        {
+            "src": src,
+            "dst": dst,
+            "layer": layer,
+            "packets": count,
+            "bytes": size,
+            "first": pytest.approx(first),
+            "last": pytest.approx(last),
+        }
+        for (src, layer, dst), (count, size, first, last) in convos.items()
+    ]
+    for kwargs in ({}, {"workers": 3}):
+        c = Pcap(path).read_pcap()
+        assert c.pcap_convos(output="stats", **kwargs).o == expected
+    c = Pcap(path).read_pcap(index=True)
+    assert c.pcap_convos(output="stats").o == expected
+    assert "10.9.9.9" not in c.pcap_convos().o
+
+    edges = Pcap(path).read_pcap().pcap_convos(output="edges").o
+    nodes = list(dict.fromkeys(n for src, _, dst in convos for n in (src, dst)))
+    assert edges["nodes"].tolist() == nodes
+    assert [nodes[i] for i in edges["src"]] == [src for src, _, _ in convos]
+    assert [nodes[i] for i in edges["dst"]] == [dst for _, _, dst in convos]
+    assert edges["layer"].tolist() == [layer for _, layer, _ in convos]
+    assert edges["packets"].tolist() == [v[0] for v in convos.values()]
+    assert edges["bytes"].tolist() == [v[1] for v in convos.values()]
+    assert edges["first"].tolist() == pytest.approx([v[2] for v in convos.values()])
+    assert edges["last"].tolist() == pytest.approx([v[3] for v in convos.values()])
+
+
+def _http_session():
+    request = b"POST /up HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello"
+    response = (
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n"
+    )
+    packets = _tcp_session(request, response, split=[10, 30])
+    # out of order and retransmitted segments
+    packets[2], packets[3] = packets[3], packets[2]
+    packets.insert(4, packets[3].copy())
+    fin = _ether() / IP(src="10.0.0.1", dst="10.0.0.2")
+    fin /= TCP(sport=40000, dport=80, flags="FA", seq=101 + len(request), ack=1)
+    packets.append(fin)
+    ack = _ether() / IP(src="10.0.0.2", dst="10.0.0.1") / TCP(sport=80, dport=40000)
+    packets.append(ack / Raw(b"trailing"))
+    for n, packet in enumerate(packets):
+        packet.time = 1000 + n
+    return packets
+
+
+def test_pcap_http_streams(tmp_path):
+    path = _pcap(tmp_path, _http_session())
+    streams = Pcap(path).read_pcap().pcap_http_streams().o
+    assert len(streams) == 1
+    assert streams[0]["request"]["headers"]["Path"] == b"/up"
+    assert streams[0]["request"]["payload"] == b"hello"
+    assert streams[0]["response"]["payload"] == b"hello world"
+
+
+def test_pcap_http_streams_spill(tmp_path):
+    path = _pcap(tmp_path, _http_session())
+    c = Pcap(path).read_pcap()
+    payload = c.pcap_http_streams(spill_size=8).o[0]["response"]["payload"]
+    assert payload["size"] == 11
+    with open(payload["spilled"], "rb") as fh:
+        assert fh.read() == b"hello world"
+    c.pcap_http_streams(spill_size=8)
+    assert not os.path.exists(payload["spilled"])
+
+
+def _closed_session(client: bytes, server: bytes, port: int, client_port: int):
+    """A TCP connection that both sides close with a FIN"""
+    packets = _tcp_session(client, server, port=port, client_port=client_port)
+    c, s = dict(src="10.0.0.1", dst="10.0.0.2"), dict(src="10.0.0.2", dst="10.0.0.1")
+    client_seq, server_seq = 101 + len(client), 501 + len(server)
+    cs = dict(sport=client_port, dport=port)
+    ss = dict(sport=port, dport=client_port)
+    packets += [
+        _ether() / IP(**c) / TCP(flags="FA", seq=client_seq, ack=server_seq, **cs),
+        _ether() / IP(**s) / TCP(flags="FA", seq=server_seq, ack=client_seq + 1, **ss),
+        _ether()
+        / IP(**c)
+        / TCP(flags="A", seq=client_seq + 1, ack=server_seq + 1, **cs),
+    ]
+    return packets
+
+
+@pytest.fixture
+def flow_sizes(monkeypatch):
+    """Record how many flows the evicting flow tables hold, with a short
+    timeout
+    """
+    from chepy_pcaps import _FlowTable
+
+    sizes = []
+    add = _FlowTable.add
+
+    def counted(self, *args):
+        flow = add(self, *args)
+        if self.evict:
+            sizes.append(len(self.flows))
+        return flow
+
+    monkeypatch.setattr(_FlowTable, "add", counted)
+    monkeypatch.setattr(_FlowTable, "timeout", 5)
+    return sizes
+
+
+def test_pcap_http_streams_many_short_flows(tmp_path, flow_sizes):
+    packets = []
+    for n in range(100):
+        request = b"GET /%d HTTP/1.1\r\nHost: x\r\n\r\n" % n
+        response = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n%02d" % n
+        session = _closed_session(request, response, 80, 20000 + n)
+        for i, packet in enumerate(session):
+            packet.time = 1000 + n + i / 100
+        packets += session
+    # a connection that reuses the ports of the first one, long after it
+    # was closed, goes on in its group
+    request = b"GET /again HTTP/1.1\r\nHost: x\r\n\r\n"
+    response = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+    for i, packet in enumerate(_closed_session(request, response, 80, 20000)):
+        packet.time = 2000 + i / 100
+        packets.append(packet)
+    streams = Pcap(_pcap(tmp_path, packets)).read_pcap().pcap_http_streams().o
+    paths = [b"/%d" % n for n in range(100)]
+    paths.insert(1, b"/again")
+    assert [s["request"]["headers"]["Path"] for s in streams] == paths
+    payloads = [b"%02d" % n for n in range(100)]
+    payloads.insert(1, b"ok")
+    assert [s["response"]["payload"] for s in streams] == payloads
+    assert max(flow_sizes) <= 8
+
+
+def _scapy_dns_queries(path: str):
+    """DNS query names grouped by scapy's sessions of the whole capture"""
+
+    def full_duplex(packet):
+        if IP not in packet or not (TCP in packet or UDP in packet):
+            return "Other"
+        l4 = packet[TCP] if TCP in packet else packet[UDP]
+        ends = sorted([(packet[IP].src, l4.sport), (packet[IP].dst, l4.dport)])
+        return str((l4.name, ends))
+
+    sessions = rdpcap(path).sessions(full_duplex)
+    return [
+        packet[DNS].qd.qname
+        for packets in sessions.values()
+        for packet in packets
+        if DNSQR in packet
+    ]
+
+
+def test_pcap_dns_queries_many_short_flows(tmp_path, flow_sizes):
+    packets, expected = [], []
+    for n in range(300):
+        name = "host%d.example.com" % n
+        query = DNS(id=n, rd=1, qd=DNSQR(qname=name))
+        if n % 3 == 0:
+            response = _dns_response(
+                DNSRR(rrname=name, rdata="192.0.2.1"), id=n, qd=DNSQR(qname=name)
+            )
+            client, server = bytes(query), bytes(response)
+            session = _closed_session(
+                struct.pack("!H", len(client)) + client,
+                struct.pack("!H", len(server)) + server,
+                53,
+                20000 + n,
+            )
+        else:
+            session = [
+                _ether()
+                / IP(src="10.0.0.1", dst="8.8.8.8")
+                / UDP(sport=20000 + n, dport=53)
+                / query
+            ]
+        for i, packet in enumerate(session):
+            packet.time = 1000 + n + i / 100
+        packets += session
+        # the query and, over TCP, its response
+        expected += [name.encode() + b"."] * (2 if n % 3 == 0 else 1)
+    # a flow that is seen again within the timeout keeps its place
+    again = _ether() / IP(src="10.0.0.1", dst="8.8.8.8") / UDP(sport=20298, dport=53)
+    again /= DNS(id=1, rd=1, qd=DNSQR(qname="again.example.com"))
+    again.time = 1300
+    packets.append(again)
+    expected.insert(-1, b"again.example.com.")
+    # and one that is seen again after it timed out goes on in its group
+    late = again.copy()
+    late[UDP].sport = 20001
+    late[DNSQR].qname = "late.example.com"
+    packets.append(late)
+    expected.insert(3, b"late.example.com.")
+    path = _pcap(tmp_path, packets)
+    assert _scapy_dns_queries(path) == expected
+    c = Pcap(path).read_pcap()
+    assert c.pcap_dns_queries().o == expected
+    assert max(flow_sizes) <= 8
+    assert c.pcap_dns_queries(workers=3).o == expected
+    # pcap_dns reassembles the TCP messages with the same evicting table
+    flow_sizes.clear()
+    messages = c.pcap_dns().o
+    assert [m["qname"] for m in messages if not m["response"]] == [
+        b"host%d.example.com." % n for n in range(300)
+    ] + [b"again.example.com.", b"late.example.com."]
+    assert sum(m["response"] for m in messages) == 100
+    assert max(flow_sizes) <= 8
+
+
+def test_pcap_ipv6_extension_headers(tmp_path):
+    request = b"GET /?secret=1 HTTP/1.1\r\nHost: x\r\n\r\n"
+    response = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhi"
+    # the client sends a hop-by-hop header and the server a destination
+    # options header in front of TCP
+    packets = []
+    for packet in _tcp_session(request, response):
+        client = packet[IP].src == "10.0.0.1"
+        ip = IPv6(src="fe80::1", dst="fe80::2")
+        if not client:
+            ip = IPv6(src="fe80::2", dst="fe80::1")
+        ext = IPv6ExtHdrHopByHop() if client else IPv6ExtHdrDestOpt()
+        rebuilt = _ether() / ip / ext / packet[TCP]
+        rebuilt.time = packet.time
+        packets.append(rebuilt)
+    c = Pcap(_pcap(tmp_path, packets)).read_pcap()
+    flows = c.pcap_flows().o
+    assert [(f["proto"], f["sport"], f["dport"]) for f in flows] == [("TCP", 40000, 80)]
+    assert flows[0]["packets"] == len(packets)
+    assert [m["match"] for m in c.pcap_search(rb"secret=\d").o] == [b"secret=1"]
+    streams = c.pcap_http_streams().o
+    assert [s["request"]["headers"]["Path"] for s in streams] == [b"/?secret=1"]
+    assert streams[0]["response"]["payload"] == b"hi"
+
+
+def test_pcap_payload_fast_engine(mixed_pcap):
+    c = Pcap(mixed_pcap).read_pcap()
+    for layer in _LAYERS:
+        expected = c.pcap_payload(layer).o
+        assert c.pcap_payload(layer, engine="fast").o == expected, layer
+        assert (
+            c.pcap_payload_offset(layer, -3, engine="fast").o
+            == c.pcap_payload_offset(layer, -3).o
+        )
+    assert len(c.pcap_payload("Raw").o) == 140
+
+
+def _scapy_dns(message):
+    """The query name, type and answers of a scapy DNS layer, as pcap_dns
+    reports them. Records are read by position, which works both for the
+    record chains of scapy 2.5 and the record lists of later versions.
+    """
+    answers = [
+        {
+            "name": rr.rrname,
+            "type": rr.sprintf("%type%"),
+            "ttl": rr.ttl,
+            "data": rr.rdata,
+        }
+        for rr in (message.an[i] for i in range(message.ancount))
+    ]
+    question = message.qd[0]
+    return question.qname, question.sprintf("%qtype%"), answers
+
+
+def _dns_response(*answers, **kwargs):
+    """A compressed DNS response with the answer records appended on the
+    wire, as scapy versions disagree on how a record section is built
+    """
+    head = DNS(qr=1, ancount=len(answers), **kwargs)
+    return DNS(bytes(head) + b"".join(bytes(rr) for rr in answers)).compress()
+
+
+def test_pcap_dns(mixed_pcap):
+    packets = [p for p in _mixed_packets() if p.haslayer(DNS)]
+    c = Pcap(mixed_pcap).read_pcap()
+    messages = c.pcap_dns().o
+    assert len(messages) == len(packets) == 40
+    for message, packet in zip(messages, packets):
+        dns = DNS(bytes(packet[DNS]))
+        assert (message["qname"], message["qtype"], message["answers"]) == (
+            _scapy_dns(dns)
+        )
+        assert (message["id"], message["response"]) == (dns.id, bool(dns.qr))
+        assert message["time"] == float(packet.time)
+    counts = c.pcap_dns(aggregate="qname").o
+    assert sorted(counts) == sorted(m["qname"] for m in messages if m["response"])
+    assert all(v["queries"] == v["responses"] == 1 for v in counts.values())
+    assert list(c.pcap_dns(lazy=True).o) == messages
+    assert c.pcap_dns_queries().o == [m["qname"] for m in messages]
+
+
+def test_pcap_dns_over_tcp(tmp_path):
+    query = DNS(id=7, rd=1, qd=DNSQR(qname="www.example.com"))
+    response = _dns_response(
+        DNSRR(rrname="www.example.com", type="CNAME", rdata="web.example.com"),
+        DNSRR(rrname="web.example.com", rdata="192.0.2.80", ttl=60),
+        id=7,
+        qd=DNSQR(qname="www.example.com"),
+    )
+    client, server = bytes(query), bytes(response)
+    packets = _tcp_session(
+        struct.pack("!H", len(client)) + client,
+        struct.pack("!H", len(server)) + server,
+        split=(1, 9),
+        port=53,
+    )
+    messages = Pcap(_pcap(tmp_path, packets)).read_pcap().pcap_dns().o
+    assert [m["response"] for m in messages] == [False, True]
+    for message, data in zip(messages, (client, server)):
+        assert (message["qname"], message["qtype"], message["answers"]) == (
+            _scapy_dns(DNS(data))
+        )
+    assert messages[1]["client"] == "10.0.0.1"
+
+
+def _usb_pcap(tmp_path, reports):
+    """A USBPcap capture of keyboard HID reports. scapy has no layer loaded
+    for its link type, so every record is dissected as Raw.
+    """
+    header = struct.pack("<HQIHBHHBBI", 27, 0, 0, 9, 0, 0, 0, 0x81, 1, 8)
+    packets = [Raw(header + bytes(report)) for report in reports]
+    for n, packet in enumerate(packets):
+        packet.time = 1000 + n
+    path = str(tmp_path / "usb.pcap")
+    wrpcap(path, packets, linktype=249)
+    return path
+
+
+def _scapy_keys(path: str):
+    """Decode the first key slot of every report with a scapy loop, the way
+    pcap_usb_keyboard did before it was vectorised
+    """
+    keys = {0x04 + n: chr(ord("a") + n) for n in range(26)}
+    keys.update({0x1E: "1", 0x1F: "2", 0x2C: " ", 0x28: "ENTER\n"})
+    shifted = {0x1E: "!", 0x1F: "@", 0x2C: " "}
+    hold = []
+    for packet in rdpcap(path):
+        report = packet[Raw].load[-8:]
+        key = report[2]
+        if report[0] == 0x02:
+            hold.append(shifted.get(key) or keys.get(key, "").upper())
+        else:
+            hold.append(keys.get(key, ""))
+    return "".join(hold).encode()
+
+
+def test_pcap_usb_keyboard(tmp_path):
+    typed = [(0x02, 0x0B), (0, 0x0C), (0x02, 0x1E), (0, 0x2C), (0, 0x1F), (0, 0x28)]
+    reports = []
+    for modifier, key in typed * 20:
+        reports.append([modifier, 0, key, 0, 0, 0, 0, 0])
+        reports.append([0] * 8)
+    path = _usb_pcap(tmp_path, reports)
+    expected = _scapy_keys(path)
+    assert expected.startswith(b"Hi! 2ENTER\nHi! 2")
+    assert Pcap(path).read_pcap().pcap_usb_keyboard().o == expected
+    assert Pcap(path).read_pcap(index=True).pcap_usb_keyboard().o == expected
+    assert Pcap(path).read_pcap().pcap_usb_keyboard(workers=3).o == expected
+
+
+def test_pcap_usb_keyboard_rollover(tmp_path):
+    reports = [
+        [0, 0, 0x04, 0, 0, 0, 0, 0],
+        # a is held while b is pressed, so only b is typed
+        [0, 0, 0x04, 0x05, 0, 0, 0, 0],
+        [0, 0, 0x05, 0, 0, 0, 0, 0],
+        # an error report says nothing about the keys that are down
+        [0, 0, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01],
+        [0] * 8,
+        # right shift
+        [0x20, 0, 0x06, 0, 0, 0, 0, 0],
+        [0x20, 0, 0x06, 0x1E, 0, 0, 0, 0],
+    ]
+    path = _usb_pcap(tmp_path, reports)
+    assert Pcap(path).read_pcap().pcap_usb_keyboard().o == b"abC!"
+
+
+def _pcap_records(path: str):
+    """Split a little endian pcap into its file header and its records"""
+    with open(path, "rb") as fh:
+        data = fh.read()
+    records, offset = [], 24
+    while offset < len(data):
+        size = 16 + struct.unpack_from("<I", data, offset + 8)[0]
+        records.append(data[offset : offset + size])
+        offset += size
+    return data[:24], records
+
+
+def test_pcap_follow(mixed_pcap, tmp_path):
+    header, records = _pcap_records(mixed_pcap)
+    data = header + b"".join(records)
+    path = str(tmp_path / "live.pcap")
+    with open(path, "wb") as fh:
+        fh.write(header[:10])
+    payloads = Pcap(path).read_pcap(follow=True)
+    dicts = Pcap(path).read_pcap(follow=True)
+    assert payloads.pcap_payload("Raw").o == []
+    assert dicts.pcap_to_dict(bpf_filter="udp").o == []
+    found = {"payloads": [], "dicts": []}
+    # every write but the last ends half way through a record
+    written = 10
+    for end in (55, 130, len(records)):
+        size = len(header) + sum(len(r) for r in records[:end])
+        if end < len(records):
+            size += 20
+        with open(path, "ab") as fh:
+            fh.write(data[written:size])
+        written = size
+        found["payloads"] += payloads.pcap_payload("Raw").o
+        found["dicts"] += dicts.pcap_to_dict(bpf_filter="udp").o
+    assert payloads.pcap_payload("Raw").o == []
+    full = Pcap(mixed_pcap).read_pcap()
+    assert found["payloads"] == full.pcap_payload("Raw").o
+    assert found["dicts"] == full.pcap_to_dict(bpf_filter="udp").o
+
+
+def _in_net(address: str, prefix: str):
+    return address.startswith(prefix)
+
+
+_BPF_CASES = {
+    "tcp": lambda p: not p.haslayer(Dot1Q) and p.haslayer(TCP),
+    "udp port 53": lambda p: not p.haslayer(Dot1Q) and p.haslayer(DNS),
+    "host 8.8.8.8": lambda p: IP in p and "8.8.8.8" in (p[IP].src, p[IP].dst),
+    "src net 10.0.0.0/16": lambda p: not p.haslayer(Dot1Q)
+    and (
+        (IP in p and _in_net(p[IP].src, "10.0."))
+        or (ARP in p and _in_net(p[ARP].psrc, "10.0."))
+    ),
+    "ip6 and tcp dst port 443": lambda p: IPv6 in p and p[TCP].dport == 443,
+    "icmp or arp": lambda p: p.haslayer(ICMP) or p.haslayer(ARP),
+    "not ip": lambda p: IP not in p or p.haslayer(Dot1Q),
+    "vlan and udp": lambda p: p.haslayer(Dot1Q) and p.haslayer(UDP),
+    "tcp portrange 4000-4500": lambda p: not p.haslayer(Dot1Q)
+    and TCP in p
+    and (4000 <= p[TCP].sport <= 4500 or 4000 <= p[TCP].dport <= 4500),
+    "ip proto 1 || (dst port 80 && !src host 10.0.1.1)": lambda p: not p.haslayer(Dot1Q)
+    and (
+        p.haslayer(ICMP)
+        or (TCP in p and p[TCP].dport == 80 and p[IP].src != "10.0.1.1")
+    ),
+}
+
+
+def test_pcap_bpf_in_process(mixed_pcap):
+    packets = _mixed_packets()
+    c = Pcap(mixed_pcap).read_pcap()
+    every = c.pcap_to_dict().o
+    for expression, check in _BPF_CASES.items():
+        expected = [d for d, p in zip(every, packets) if check(p)]
+        assert 0 < len(expected) < len(every), expression
+        assert c.pcap_to_dict(bpf_filter=expression).o == expected, expression
+
+
+def test_pcap_workers(mixed_pcap):
+    c = Pcap(mixed_pcap).read_pcap()
+    for method, kwargs in (
+        ("pcap_payload", {"layer": "UDP"}),
+        ("pcap_payload", {"layer": "TCP", "engine": "fast"}),
+        ("pcap_to_dict", {}),
+        ("pcap_to_dict", {"bpf_filter": "udp"}),
+        ("pcap_layer_stats", {}),
+        ("pcap_convos", {"output": "stats"}),
+        ("pcap_flows", {}),
+        ("pcap_dns_queries", {}),
+    ):
+        expected = getattr(c, method)(**kwargs).o
+        assert getattr(c, method)(workers=3, **kwargs).o == expected, method
+    columns = c.pcap_to_dict(columnar=True).o
+    split = c.pcap_to_dict(columnar=True, workers=3).o
+    assert sorted(columns) == sorted(split)
+    for key in ("time", "IP.src", "TCP.dport"):
+        assert columns[key].tolist() == split[key].tolist()
+
+
+def test_pcap_time_window(tmp_path, monkeypatch):
+    from chepy_pcaps import _TimeIndex
+
+    # small checkpoints, so the capture spans a dozen of them
+    monkeypatch.setattr(_TimeIndex, "every", 16)
+    packets = []
+    for n in range(200):
+        timestamp = 1000 + n
+        # records around each checkpoint boundary are out of order, some by
+        # more than a whole checkpoint
+        if n % 16 == 0:
+            timestamp -= 40
+        elif n % 16 == 15:
+            timestamp += 40
+        elif n % 16 == 1:
+            timestamp -= 3
+        packet = (
+            _ether() / IP(src="10.0.0.1", dst="10.0.0.2") / UDP(sport=7000, dport=7000)
+        )
+        packet = packet / Raw(b"packet-%d" % n)
+        packet.time = timestamp
+        packets.append(packet)
+    path = _pcap(tmp_path, packets)
+    windows = [(None, 1050), (1100, None), (1100.5, 1101), (1237, 1250)]
+    windows += [
+        (start, start + size) for start in range(950, 1260, 23) for size in (1, 17, 40)
+    ]
+    for start_time, end_time in windows:
+        expected = [
+            p[Raw].load
+            for p in packets
+            if (start_time is None or float(p.time) >= start_time)
+            and (end_time is None or float(p.time) < end_time)
+        ]
+        window = dict(start_time=start_time, end_time=end_time)
+        c = Pcap(path).read_pcap(**window)
+        assert c.pcap_payload("Raw").o == expected, window
+        assert c.pcap_payload("Raw", engine="fast").o == expected, window
+        assert c.pcap_payload("Raw", workers=3).o == expected, window
+        c = Pcap(path).read_pcap(index=True, **window)
+        assert c.pcap_payload("Raw").o == expected, window
+
+
+def _bgzf(data: bytes, block: int) -> bytes:
+    """Compress data as BGZF, gzip members that keep their size in an extra
+    field
+    """
+    members = []
+    for start in range(0, len(data), block):
+        chunk = data[start : start + block]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        deflated = compressor.compress(chunk) + compressor.flush()
+        header = b"\x1f\x8b\x08\x04" + bytes(6) + struct.pack("<H", 6) + b"BC"
+        header += struct.pack("<HH", 2, 18 + len(deflated) + 8 - 1)
+        trailer = struct.pack("<II", zlib.crc32(chunk), len(chunk))
+        members.append(header + deflated + trailer)
+    return b"".join(members)
+
+
+def _compressed(tmp_path, path: str):
+    """Write the capture at path with every supported compression"""
+    with open(path, "rb") as fh:
+        data = fh.read()
+    files = {
+        "gzip": gzip.compress(data),
+        "bgzf": _bgzf(data, 4096),
+        "xz": lzma.compress(data),
+    }
+    try:
+        import zstandard
+    except ImportError:  # pragma: no cover
+        pass
+    else:
+        compressor = zstandard.ZstdCompressor(write_content_size=True)
+        files["zstd"] = compressor.compress(data)
+        files["zstd-frames"] = b"".join(
+            compressor.compress(data[start : start + 4096])
+            for start in range(0, len(data), 4096)
+        )
+    paths = {}
+    for kind, compressed in files.items():
+        paths[kind] = str(tmp_path / ("capture.pcap." + kind))
+        with open(paths[kind], "wb") as fh:
+            fh.write(compressed)
+    return paths
+
+
+def test_pcap_compressed(mixed_pcap, tmp_path):
+    plain = Pcap(mixed_pcap).read_pcap()
+    expected = {
+        "payload": plain.pcap_payload("UDP", engine="fast").o,
+        "dicts": plain.pcap_to_dict(bpf_filter="tcp").o,
+        "stats": plain.pcap_layer_stats().o,
+    }
+    window = Pcap(mixed_pcap).read_pcap(start_time=1005, end_time=1012)
+    expected["window"] = window.pcap_payload("Raw", engine="fast").o
+    for kind, path in _compressed(tmp_path, mixed_pcap).items():
+        c = Pcap(path).read_pcap()
+        assert c.pcap_payload("UDP", engine="fast").o == expected["payload"], kind
+        assert c.pcap_to_dict(bpf_filter="tcp").o == expected["dicts"], kind
+        assert c.pcap_layer_stats(workers=3).o == expected["stats"], kind
+        c = Pcap(path).read_pcap(index=True)
+        assert c.pcap_payload("UDP").o == expected["payload"], kind
+        c = Pcap(path).read_pcap(start_time=1005, end_time=1012)
+        assert c.pcap_payload("Raw", engine="fast").o == expected["window"], kind
+
+
+def test_pcap_directory_skips_other_files(mixed_pcap, tmp_path):
+    with open(mixed_pcap, "rb") as fh:
+        data = fh.read()
+    files = {
+        "a.pcap": data,
+        "b": data,
+        "c.pcap.gz": gzip.compress(data),
+        "README": b"captures from the lab\n",
+        "data.npz": b"PK\x03\x04",
+        "meta.json": b"{}",
+        "notes.gz": gzip.compress(b"not a capture"),
+    }
+    for name, content in files.items():
+        with open(str(tmp_path / name), "wb") as fh:
+            fh.write(content)
+    Pcap(str(tmp_path / "a.pcap")).read_pcap(cache=True)
+    assert os.path.exists(str(tmp_path / "a.pcap.chepy-index"))
+    expected = Pcap(mixed_pcap).read_pcap().pcap_layer_stats().o
+    for source in (str(tmp_path), str(tmp_path / "*")):
+        c = Pcap(source).read_pcap()
+        assert [os.path.basename(path) for path in c._pcap_paths] == [
+            "a.pcap",
+            "b",
+            "c.pcap.gz",
+        ]
+        stats = c.pcap_layer_stats().o
+        assert stats == {layer: count * 3 for layer, count in expected.items()}
+
+
+def test_pcap_port_80_payloads(tmp_path):
+    request = b"GET / HTTP/1.1\r\nHost: x\r\n\r\n"
+    response = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhi"
+    path = _pcap(tmp_path, _tcp_session(request, response))
+    for kwargs in ({}, {"index": True}):
+        c = Pcap(path).read_pcap(**kwargs)
+        c.pcap_http_streams()
+        assert c.pcap_payload("TCP").o == [request, response]
+        assert c.pcap_payload("TCP", engine="fast").o == [request, response]
+        assert c.pcap_layer_stats().o == {
+            "Ethernet": 4,
+            "IP": 4,
+            "TCP": 4,
+            "Raw": 2,
+        }
+
+
+def test_pcap_dissection_does_not_depend_on_call_order(tmp_path):
+    path = _pcap(tmp_path, _http_session())
+    # a fresh interpreter, as other tests may have loaded the HTTP layers
+    script = (
+        "import sys\n"
+        "from chepy_pcaps import Pcap\n"
+        "c = Pcap({!r}).read_pcap()\n"
+        "before = c.pcap_layer_stats().o\n"
+        "c.pcap_http_streams()\n"
+        "assert c.pcap_layer_stats().o == before, before\n"
+        "assert 'scapy.layers.http' not in sys.modules\n"
+    ).format(path)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", script], cwd=root, check=True)